@@ -6,7 +6,9 @@ import os
 from lib.config import Config, ConfigType
 from lib.core.impartus import Impartus
 from lib.data.Icons import Icons
+from lib.profiling import Profiler
 from lib.threadlogging import ThreadLogger
+from lib.utils import Utils
 from lib.variables import Variables
 from ui.callbacks.utils import CallbackUtils
 from ui.content import ContentWindow
@@ -26,6 +28,7 @@ class App:
         self.impartus = Impartus()
         self.login_window = LoginWindow(self.impartus)
         self.content_window = ContentWindow(self.impartus)
+        self.profile_content_loading()
 
         Variables().set_log_window(self.content_window.log_window)
         self.thread_logger = ThreadLogger(self.__class__.__name__)
@@ -44,6 +47,20 @@ class App:
 
         self.menu_bar = Menubar(self.login_window, self.content_window).add_menu()
 
+    def profile_content_loading(self):
+        """
+        Profile the online / offline content loading with cProfile / tracemalloc, if profile / trace_memory are
+        turned on in the config. The stats are written to config_dir on every load.
+        """
+        conf = Config.load(ConfigType.IMPARTUS)
+        if not conf.get('profile') and not conf.get('trace_memory'):
+            return
+        for method_name in ['work_online', 'work_offline']:
+            method = getattr(self.content_window, method_name)
+            setattr(self.content_window, method_name, Profiler.wrap(
+                method, method_name, Utils.get_config_dir(),
+                profile=bool(conf.get('profile')), trace_memory=bool(conf.get('trace_memory'))))
+
     def run(self):
         self.app.exec_()
 
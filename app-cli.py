@@ -6,11 +6,15 @@ import json
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
 from typing import List
 
 from lib.captions import Captions
+from lib.core.catalog import Catalog
 from lib.core.impartus import Impartus
+from lib.downloadqueue import DownloadJob, JobStatus
+from lib.profiling import Profiler
 from lib.utils import Utils
 from lib.variables import Variables
 
@@ -97,12 +101,46 @@ def progress_log(value: int):
     sys.stdout.flush()
 
 
+def progress_log_multi(rf_id, value: int):
+    if value % 10 == 0:
+        print("[{}]: {}%".format(rf_id, value))
+        sys.stdout.flush()
+
+
+def job_finished(job: DownloadJob):
+    if job.status == JobStatus.DONE:
+        print("[{}]: Downloaded {}".format(job.rf_id, job.filepath))
+    else:
+        error("[{}]: Download failed for {}".format(job.rf_id, job.filepath))
+
+
+def get_download_queue():
+    return impartus.get_download_queue(os.path.join(Utils.get_config_dir(), 'download_queue.json'))
+
+
 def download_video():
-    with open(app_args.json, 'r') as fh:
-        video_metadata = json.load(fh)
-    callback = partial(progress_log)
-    mkv_filepath = '{}/{}'.format(app_args.dir, os.path.basename(Utils.get_mkv_path(video_metadata)))
-    impartus.process_video(video_metadata, mkv_filepath, None, None, callback, app_args.quality)
+    job_queue = get_download_queue()
+    for json_file in app_args.json:
+        with open(json_file, 'r') as fh:
+            video_metadata = json.load(fh)
+        video_id = video_metadata['ttid'] if video_metadata.get('ttid') else video_metadata['fcid']
+        if len(app_args.json) == 1:
+            callback = partial(progress_log)
+        else:
+            callback = partial(progress_log_multi, video_id)
+        mkv_filepath = '{}/{}'.format(app_args.dir, os.path.basename(Utils.get_mkv_path(video_metadata)))
+        job_queue.add(DownloadJob(video_id, video_metadata, mkv_filepath, priority=app_args.priority,
+                                  quality=app_args.quality, progress_func=callback, finished_func=job_finished))
+    job_queue.wait()
+
+
+def download_queue():
+    job_queue = get_download_queue()
+    for job in job_queue.load_saved_jobs():
+        job.progress_func = partial(progress_log_multi, job.rf_id)
+        job.finished_func = job_finished
+        job_queue.add(job)
+    job_queue.wait()
 
 
 def download_chat():
@@ -123,6 +161,97 @@ def download_document():
     impartus.download_slides(document_metadata.get('filePath'), doc_filepath)
 
 
+def document_finished(file_url, filepath, status):
+    if status:
+        print("Downloaded {}".format(filepath))
+    else:
+        error("Download failed for {}".format(file_url))
+
+
+def download_documents():
+    for json_file in app_args.json:
+        with open(json_file, 'r') as fh:
+            subject_json = json.load(fh)
+        for _, docs_list in impartus.get_slides([subject_json]):
+            impartus.download_documents(docs_list, target_dir=vars(app_args).get('dir'),
+                                        finished_func=document_finished)
+
+
+def sync_filepath(filepath: str):
+    if filepath and vars(app_args).get('dir'):
+        return '{}/{}'.format(app_args.dir, os.path.basename(filepath))
+    return filepath
+
+
+def sync_chat(video_id, video_metadata, vtt_filepath):
+    chats = impartus.get_chats(video_metadata)
+    return Captions.save_as_captions(video_id, video_metadata, chats, vtt_filepath)
+
+
+def sync():
+    if app_args.json:
+        subject_list = list()
+        for json_file in app_args.json:
+            with open(json_file, 'r') as fh:
+                subject_list.append(json.load(fh))
+    else:
+        subject_list = impartus.get_subjects()
+
+    job_queue = get_download_queue()
+    skipped = 0
+    file_tasks = list()     # (filepath, func), chats and documents.
+
+    fetch_videos = not app_args.no_videos or not app_args.no_chats
+    for kind, item in impartus.get_catalog(subject_list, videos=fetch_videos, documents=not app_args.no_documents):
+        if kind == Catalog.DOCUMENTS:
+            _, docs_list = item
+            for doc_metadata in docs_list:
+                if not doc_metadata.get('filePath'):
+                    continue
+                doc_filepath = sync_filepath(Utils.get_documents_path(doc_metadata))
+                if Utils.slides_exist_on_disk(doc_filepath)[0]:
+                    skipped += 1
+                else:
+                    file_url = '{}/{}'.format(Variables().login_url(), doc_metadata['filePath'])
+                    file_tasks.append((doc_filepath, partial(impartus.download_slides, file_url, doc_filepath)))
+            continue
+
+        video_id, video_metadata, is_flipped = item
+        if not app_args.no_videos:
+            mkv_filepath = sync_filepath(Utils.get_mkv_path(video_metadata))
+            if os.path.exists(mkv_filepath):
+                skipped += 1
+            else:
+                job_queue.add(DownloadJob(video_id, video_metadata, mkv_filepath, quality=app_args.quality,
+                                          progress_func=partial(progress_log_multi, video_id),
+                                          finished_func=job_finished))
+
+        # lecture chats are available for regular lectures only.
+        if not app_args.no_chats and not is_flipped:
+            vtt_filepath = sync_filepath(Utils.get_captions_path(video_metadata))
+            if os.path.exists(vtt_filepath):
+                skipped += 1
+            else:
+                file_tasks.append((vtt_filepath, partial(sync_chat, video_id, video_metadata, vtt_filepath)))
+
+    print("Found {} file(s) on disk, downloading {} video(s), {} chat(s) / document(s).".format(
+        skipped, job_queue.pending(), len(file_tasks)))
+
+    # chats and documents are small, fetch these alongside the videos.
+    workers = impartus.conf.get('document_workers', 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(func): filepath for filepath, func in file_tasks}
+        for future in as_completed(futures):
+            try:
+                if future.result():
+                    print("Downloaded {}".format(futures[future]))
+                else:
+                    error("Download failed for {}".format(futures[future]))
+            except Exception as ex:
+                error("Download failed for {}: {}".format(futures[future], ex))
+    job_queue.wait()
+
+
 def download():
     if app_args.subcommand == 'video':
         download_video()
@@ -130,6 +259,10 @@ def download():
         download_chat()
     elif app_args.subcommand == 'document':
         download_document()
+    elif app_args.subcommand == 'documents':
+        download_documents()
+    elif app_args.subcommand == 'queue':
+        download_queue()
     else:
         parser.print_help()
 
@@ -164,18 +297,27 @@ example:
 """.format(app=app)
 
 epilog_download_video = """
-Download a lecture video
+Download lecture videos, at most max_concurrent_downloads (see etc/impartus.conf) at a time.
+The queue is saved to config_dir, and can be resumed with 'download queue' if interrupted.
 
 example:
 ./{app} download video -j lecture.json -o dir
-"""
+./{app} download video -j lecture1.json lecture2.json ... -o dir [-p priority]
+""".format(app=app)
+
+epilog_download_queue = """
+Resume the downloads left in the download queue by an earlier run.
+
+example:
+./{app} download queue
+""".format(app=app)
 
 epilog_download_chat = """
 Download chat for a lecture
 
 example:
 ./{app} download chat -j lecture.json -o dir
-"""
+""".format(app=app)
 
 epilog_download_document = """
 Download a document.
@@ -184,6 +326,25 @@ example:
 ./{app} download document -j document.json -o dir
 """.format(app=app)
 
+epilog_download_documents = """
+Download all the backpack documents of the subjects, skipping the ones already on disk.
+At most document_workers (see etc/impartus.conf) documents are downloaded at a time.
+
+example:
+./{app} download documents -j subject.json [-o dir]
+./{app} download documents -j subject1.json subject2.json ... [-o dir]
+""".format(app=app)
+
+epilog_sync = """
+Download everything (lecture videos, chats and backpack documents) for the given subjects, or for all the
+subjects if none is given. Files already on disk are skipped, the rest are downloaded in parallel.
+Files are saved to the paths configured in etc/impartus.conf, or to dir if given.
+
+example:
+./{app} sync
+./{app} sync -j subject1.json subject2.json ... [-o dir] [--no-videos] [--no-chats] [--no-documents]
+""".format(app=app)
+
 epilog = """
 The CLI requires that the following variables are exported in the environment:
 IMPARTUS_USER
@@ -193,10 +354,18 @@ Once logged in, users would need to export
 IMPARTUS_TOKEN
 
 IMPARTUS_URL may also be exported to use a server other than https://a.impartus.com
-"""
+
+--profile / --trace-memory run the command under cProfile / tracemalloc, and write the stats and the top
+allocations to config_dir (see etc/impartus.conf), for example:
+./{app} --profile --trace-memory sync
+""".format(app=app)
 
 
 def _parse_args(args: List):
+    parser.add_argument('--profile', action='store_true',
+                        help='Profile the command with cProfile, stats are written to config_dir.')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Trace memory allocations with tracemalloc, top allocations are written to config_dir.')
     subparsers = parser.add_subparsers(dest="command", title='subcommands')
 
     login_parser = subparsers.add_parser('login',
@@ -233,10 +402,17 @@ def _parse_args(args: List):
                                                      help="Download lecture video.",
                                                      epilog=epilog_download_video,
                                                      formatter_class=argparse.RawDescriptionHelpFormatter)
-    video_dl_parser.add_argument('-j', '--json', required=True, help='Lecture json.')
+    video_dl_parser.add_argument('-j', '--json', required=True, nargs='+', help='Lecture json(s).')
     video_dl_parser.add_argument('-q', '--quality', default='highest', help='Video quality (default=highest).')
+    video_dl_parser.add_argument('-p', '--priority', type=int, default=0,
+                                 help='Download priority, higher priority downloads start first (default=0).')
     video_dl_parser.add_argument('-o', '--dir', required=True, help='Output mkv file')
 
+    download_subparsers.add_parser('queue',
+                                   help="Resume downloads left in the download queue.",
+                                   epilog=epilog_download_queue,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+
     chat_dl_parser = download_subparsers.add_parser('chat',
                                                     help="Download lecture chat.",
                                                     epilog=epilog_download_chat,
@@ -251,6 +427,25 @@ def _parse_args(args: List):
     document_dl_parser.add_argument('-j', '--json', required=True, help='Document json file.')
     document_dl_parser.add_argument('-o', '--dir', required=True, help='Output file')
 
+    documents_dl_parser = download_subparsers.add_parser('documents',
+                                                         help="Download all backpack documents for subjects.",
+                                                         epilog=epilog_download_documents,
+                                                         formatter_class=argparse.RawDescriptionHelpFormatter)
+    documents_dl_parser.add_argument('-j', '--json', required=True, nargs='+', help='Subject json(s).')
+    documents_dl_parser.add_argument('-o', '--dir',
+                                     help='Output directory (default=documents_path configured in impartus.conf).')
+
+    sync_parser = subparsers.add_parser('sync',
+                                        help="Download all videos/chats/documents for subjects.",
+                                        epilog=epilog_sync,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    sync_parser.add_argument('-j', '--json', nargs='+', help='Subject json(s) (default=all subjects).')
+    sync_parser.add_argument('-q', '--quality', default='highest', help='Video quality (default=highest).')
+    sync_parser.add_argument('-o', '--dir', help='Output directory (default=paths configured in impartus.conf).')
+    sync_parser.add_argument('--no-videos', action='store_true', help='Skip lecture videos.')
+    sync_parser.add_argument('--no-chats', action='store_true', help='Skip lecture chats.')
+    sync_parser.add_argument('--no-documents', action='store_true', help='Skip backpack documents.')
+
     return parser.parse_args(args)
 
 
@@ -288,6 +483,13 @@ if __name__ == '__main__':
         impartus = Impartus(token)
 
     if vars(app_args).get('command'):
-        globals()[app_args.command]()
+        if app_args.profile or app_args.trace_memory:
+            name = '-'.join(x for x in [app_args.command, vars(app_args).get('subcommand')] if x)
+            with Profiler(name, Utils.get_config_dir(), profile=app_args.profile,
+                          trace_memory=app_args.trace_memory) as profiler:
+                globals()[app_args.command]()
+            print("Profile written to {}".format(', '.join(profiler.files)))
+        else:
+            globals()[app_args.command]()
     else:
         parser.print_help()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Compare the throughput (MB/s) of the Decrypter apis against the earlier implementation, which read the whole
+stream, and created a new AES-CBC cipher for every stream.
+
+usage:
+python -m benchmarks.bench_decrypter [--size-kb 1024] [--streams 50]
+"""
+import argparse
+import io
+import os
+import time
+
+from Crypto.Cipher import AES   # noqa
+from Crypto.Util.Padding import pad
+
+from lib.media.decrypter import Decrypter
+
+
+def legacy_decrypt(encryption_key, ciphertext):
+    # read whole, decrypt with a new cipher object, as Decrypter.decrypt did earlier.
+    in_fh = io.BytesIO(ciphertext)
+    out_fh = io.BytesIO()
+    aes = AES.new(encryption_key, AES.MODE_CBC, bytes(16))
+    out_fh.write(aes.decrypt(in_fh.read()))
+    return out_fh
+
+
+def run(name, func, streams, total_bytes):
+    start = time.perf_counter()
+    for ciphertext in streams:
+        func(ciphertext)
+    elapsed = time.perf_counter() - start
+    print('{:<28} {:>10.1f} MB/s  ({:.3f}s)'.format(name, total_bytes / elapsed / (1 << 20), elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decrypter throughput benchmark.')
+    parser.add_argument('--size-kb', type=int, default=1024, help='size of each stream in KB (default=1024).')
+    parser.add_argument('--streams', type=int, default=50, help='number of streams (default=50).')
+    args = parser.parse_args()
+
+    key = os.urandom(16)
+    plaintext = os.urandom(args.size_kb * 1024 - 5)
+    ciphertext = AES.new(key, AES.MODE_CBC, bytes(16)).encrypt(pad(plaintext, AES.block_size))
+    streams = [ciphertext] * args.streams
+    total_bytes = len(ciphertext) * args.streams
+
+    output = bytearray(len(ciphertext))
+    assert Decrypter.decrypt_bytes(key, ciphertext) == plaintext
+
+    print('{} streams of {} KB'.format(args.streams, args.size_kb))
+    run('legacy (AES-CBC per stream)', lambda ct: legacy_decrypt(key, ct), streams, total_bytes)
+    run('decrypt_bytes', lambda ct: Decrypter.decrypt_bytes(key, ct), streams, total_bytes)
+    run('decrypt_into (prealloc)', lambda ct: Decrypter.decrypt_into(key, ct, output), streams, total_bytes)
+    run('decrypt_stream (64 KB)', lambda ct: Decrypter.decrypt_stream(
+        key, io.BytesIO(ct), io.BytesIO(), chunk_size=64 * 1024), streams, total_bytes)
+
+
+if __name__ == '__main__':
+    main()
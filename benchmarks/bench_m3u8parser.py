@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Compare the time taken and the memory held by M3u8Parser against the earlier (regex per line, dict per segment)
+parser, over generated multi-track playlists.
+
+usage:
+python -m benchmarks.bench_m3u8parser [--segments 100000] [--tracks 2] [--repeat 3]
+"""
+import argparse
+import gc
+import re
+import time
+import tracemalloc
+
+from lib.media.m3u8parser import M3u8Parser
+
+
+def legacy_parse(m3u8_content, num_tracks):
+    # as M3u8Parser.parse did earlier.
+    tracks = [list() for _ in range(num_tracks)]
+    url_maps = dict()
+    current_file_number = -1
+    current_file_duration = 0
+    current_encryption_method = "NONE"
+    current_encryption_key_url = None
+    key_id = 0
+    for token in m3u8_content:
+        if str(token).startswith("#EXT-X-KEY:METHOD"):
+            current_encryption_method = re.sub(r"^#EXT-X-KEY:METHOD=([A-Z0-9-]+).*$", r"\1", token)
+            if current_encryption_method == "NONE":
+                current_encryption_key_url = None
+            else:
+                current_encryption_key_url = re.sub(r"^#EXT-X-KEY:METHOD=([A-Z0-9-]+).*(http.*)\"$", r"\2", token)
+                key_id = re.sub(r"^.*keyid=([0-9]+).*$", r"\1", current_encryption_key_url)
+        elif str(token).startswith("#EXTINF:"):
+            current_file_duration = float(re.sub(r'^#EXTINF:([0-9]+\.[0-9]+),.*', r"\1", token))
+        elif str(token).startswith("http"):
+            current_file_number += 1
+            url = str(token).strip()
+            base_url = re.sub(r'/[^/]+\.[a-zA-Z0-9]{2,3}$', '', url)
+            if url_maps.get(base_url) is None:
+                url_maps[base_url] = len(url_maps.keys())
+            tracks[url_maps[base_url]].append({
+                "file_number": current_file_number,
+                "duration": current_file_duration,
+                "encryption_key_url": current_encryption_key_url,
+                "encryption_key_id": key_id,
+                "encryption_method": current_encryption_method,
+                "url": url,
+            })
+    return tracks
+
+
+def compact_parse(m3u8_content, num_tracks):
+    return M3u8Parser(m3u8_content, num_tracks=num_tracks).parse()[1]
+
+
+def generate_playlist(segments, num_tracks, segments_per_key=10):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-TARGETDURATION:11']
+    for i in range(segments):
+        track_index = i % num_tracks
+        if i % segments_per_key == 0:
+            lines.append('#EXT-X-KEY:METHOD=AES-128,URI="http://a.impartus.com/api/fetchvideo/getVideoKey?'
+                         'ttid=4168424&keyid={}"'.format(i // segments_per_key))
+        lines.append('#EXTINF:10.000000,')
+        lines.append('https://impartusmedia.oss-ap-south-1.aliyuncs.com/download1/4168424_hls/854x480_30_{}/'
+                     '854x480_30v1_{:06d}_hls_{}.ts'.format(track_index, i // num_tracks, i // segments_per_key))
+    return lines
+
+
+def run(name, func, lines, num_tracks, repeat):
+    timings = list()
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(lines, num_tracks)
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    tracks = func(lines, num_tracks)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('  {:<10} {:>8.1f} ms  retained {:>7.1f} MB  peak {:>7.1f} MB  ({} segments)'.format(
+        name, min(timings) * 1000, retained / (1 << 20), peak / (1 << 20), sum(len(x) for x in tracks)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='M3u8Parser benchmark.')
+    parser.add_argument('--segments', type=int, default=100000, help='number of segments (default=100000).')
+    parser.add_argument('--tracks', type=int, default=2, help='number of tracks (default=2).')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs, best is reported (default=3).')
+    args = parser.parse_args()
+
+    lines = generate_playlist(args.segments, args.tracks)
+    print('{} segments, {} tracks, {} lines'.format(args.segments, args.tracks, len(lines)))
+    run('legacy', legacy_parse, lines, args.tracks, args.repeat)
+    run('M3u8Parser', compact_parse, lines, args.tracks, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
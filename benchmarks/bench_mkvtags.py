@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Compare the time taken to read the TTID tag of mkv files with MkvTags against enzyme.MKV (used by Finder earlier),
+over generated mkv files of various sizes.
+
+usage:
+python -m benchmarks.bench_mkvtags [--sizes-mb 1 64 512] [--repeat 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import enzyme
+
+from benchmarks.mkvfixtures import write_mkv
+from lib.media.mkvtags import MkvTags
+
+
+def enzyme_rfid(filepath):
+    # as Finder._get_rfid did earlier.
+    with open(filepath, 'rb') as f:
+        mkv = enzyme.MKV(f)
+        for x in mkv.tags:
+            for y in x.simpletags:
+                if y.name == 'TTID':
+                    return int(y.string), False
+                if y.name == 'FCID':
+                    return int(y.string), True
+    return None, None
+
+
+def run(name, func, filepath, repeat):
+    result = func(filepath)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(filepath)
+    elapsed = time.perf_counter() - start
+    print('  {:<10} {:>10.1f} us/file  -> {}'.format(name, elapsed / repeat * 1e6, result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MkvTags benchmark.')
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[1, 64, 512], help='mkv file sizes in MB.')
+    parser.add_argument('--repeat', type=int, default=200, help='number of reads per file (default=200).')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in args.sizes_mb:
+            for with_seek_head in [True, False]:
+                filepath = os.path.join(tmp_dir, '{}.mkv'.format(size_mb))
+                write_mkv(filepath, size_mb << 20, {'ENCODER': 'Lavf58.29.100', 'TTID': '1234567'},
+                          with_seek_head=with_seek_head)
+                print('{} MB, {}'.format(size_mb, 'Tags in SeekHead' if with_seek_head else 'Tags not in SeekHead'))
+                run('enzyme', enzyme_rfid, filepath, args.repeat)
+                run('MkvTags', MkvTags.get_rfid, filepath, args.repeat)
+                os.remove(filepath)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Writes minimal matroska files (EBML header, SeekHead, Info, Tracks, Clusters and Tags at the end, laid out the
+way ffmpeg writes them) for the MkvTags benchmark and tests.
+"""
+import os
+import struct
+
+
+def _element_id(element_id: int):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+
+
+def _size(size: int):
+    for length in range(1, 9):
+        if size < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | size).to_bytes(length, 'big')
+    raise ValueError('Element too large.')
+
+
+def element(element_id: int, payload: bytes):
+    return _element_id(element_id) + _size(len(payload)) + payload
+
+
+def uint_element(element_id: int, value: int, length: int = None):
+    length = length or max(1, (value.bit_length() + 7) // 8)
+    return element(element_id, value.to_bytes(length, 'big'))
+
+
+def string_element(element_id: int, value: str):
+    return element(element_id, value.encode('utf-8'))
+
+
+def ebml_header():
+    return element(0x1A45DFA3, b''.join([
+        uint_element(0x4286, 1),
+        uint_element(0x42F7, 1),
+        uint_element(0x42F2, 4),
+        uint_element(0x42F3, 8),
+        string_element(0x4282, 'matroska'),
+        uint_element(0x4287, 4),
+        uint_element(0x4285, 2),
+    ]))
+
+
+def info():
+    return element(0x1549A966, b''.join([
+        uint_element(0x2AD7B1, 1000000),
+        string_element(0x4D80, 'Lavf58.29.100'),
+        string_element(0x5741, 'Lavf58.29.100'),
+        element(0x4489, struct.pack('>d', 3600000.0)),
+    ]))
+
+
+def tracks():
+    return element(0x1654AE6B, element(0xAE, b''.join([
+        uint_element(0xD7, 1),
+        uint_element(0x73C5, 1),
+        uint_element(0x83, 1),
+        string_element(0x86, 'V_MPEG4/ISO/AVC'),
+        element(0xE0, uint_element(0xB0, 1280) + uint_element(0xBA, 720)),
+    ])))
+
+
+def tags(tag_values: dict):
+    simple_tags = b''.join(element(0x67C8, string_element(0x45A3, name) + string_element(0x4487, value))
+                           for name, value in tag_values.items())
+    return element(0x1254C367, element(0x7373, element(0x63C0, b'') + simple_tags))
+
+
+def seek_head(entries):
+    # fixed width positions, so that the SeekHead size does not depend on the positions.
+    return element(0x114D9B74, b''.join(
+        element(0x4DBB, element(0x53AB, _element_id(element_id)) + uint_element(0x53AC, position, 8))
+        for element_id, position in entries
+    ))
+
+
+def write_mkv(filepath: str, size: int, tag_values: dict, with_seek_head: bool = True,
+              cluster_size: int = 1 << 20):
+    """
+    Write a matroska file of (about) size bytes, with the given global tags.
+    :param with_seek_head: if False, the SeekHead has no entry for the Tags.
+    """
+    block = os.urandom(cluster_size)
+    head = info() + tracks()
+    tail = tags(tag_values)
+    num_clusters = max(1, (size - len(head) - len(tail)) // cluster_size)
+    cluster = element(0x1F43B675, uint_element(0xE7, 0) + element(0xA3, b'\x81\x00\x00\x80' + block))
+
+    seek_head_size = len(seek_head([(0x1254C367, 0)] * 3))
+    info_position = seek_head_size
+    tracks_position = info_position + len(info())
+    tags_position = seek_head_size + len(head) + num_clusters * len(cluster)
+    entries = [(0x1549A966, info_position), (0x1654AE6B, tracks_position)]
+    if with_seek_head:
+        entries.append((0x1254C367, tags_position))
+    segment_size = tags_position + len(tail)
+
+    with open(filepath, 'wb') as fh:
+        fh.write(ebml_header())
+        fh.write(_element_id(0x18538067) + _size(segment_size))
+        fh.write(seek_head(entries))
+        if not with_seek_head:
+            # Void element in place of the missing entry.
+            fh.write(element(0xEC, bytes(seek_head_size - len(seek_head(entries)) - 2)))
+        fh.write(head)
+        for _ in range(num_clusters):
+            fh.write(cluster)
+        fh.write(tail)
+    return filepath
@@ -0,0 +1,206 @@
+import asyncio
+import json
+from typing import Dict, List
+
+import aiohttp
+
+from lib.config import Config, ConfigType
+from lib.core.flippedvideo import FlippedVideo
+from lib.core.impartus import Impartus
+from lib.core.mediatransport import get_backoff_time, get_retry
+from lib.core.regularvideo import RegularVideo
+from lib.threadlogging import ThreadLogger
+from lib.variables import Variables
+
+
+class AsyncImpartus:
+    """
+    asyncio counterpart of Impartus, built on aiohttp.
+    All the requests are made from a single event loop, over one connection pool of up to async_max_connections
+    connections, so any number of subjects / media streams can be fetched concurrently without a thread per
+    request. The responses are parsed with the same code as Impartus, RegularVideo and FlippedVideo.
+
+    usage:
+        async with AsyncImpartus(token) as imp:
+            subjects = await imp.get_subjects()
+            async for video_id, video_metadata, is_flipped in imp.get_lecture_videos(subjects):
+                ...
+    """
+    thread_logger = ThreadLogger(__name__)
+
+    def __init__(self, token=None):
+        self.token = token
+        self.session = None
+
+        self.logger = self.__class__.thread_logger.logger
+        self.conf = Config.load(ConfigType.IMPARTUS)
+        # retry policy of the requests made with requests / urllib3, applied by _request().
+        self.retry = get_retry(self.conf)
+        self.max_retries = self.retry.total
+        self.max_connections = self.conf.get('async_max_connections', 100)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _get_session(self):
+        # the session binds to the running event loop, so it is created on first use.
+        if self.session is None:
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=self.conf.get('connect_timeout', 5.0),
+                sock_read=self.conf.get('read_timeout', 5.0),
+            )
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _auth_headers(self):
+        if not self.token:
+            return {}
+        return {
+            'Authorization': 'Bearer {}'.format(self.token),
+            'Cookie': 'Bearer={}'.format(self.token),
+        }
+
+    async def _request(self, method: str, url: str, authenticated: bool = True, raise_for_status: bool = False,
+                       **kwargs):
+        """
+        Make a request, retrying connection errors, timeouts and the retry statuses of get_retry(), waiting
+        between the retries as urllib3 does with it (see get_backoff_time()).
+        :param raise_for_status: raise aiohttp.ClientResponseError for an error response.
+        :return: (http status, response body).
+        """
+        headers = self._auth_headers() if authenticated else {}
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._get_session().request(method, url, headers=headers, **kwargs) as response:
+                    body = await response.read()
+                    if response.status not in self.retry.status_forcelist or attempt == self.max_retries:
+                        if raise_for_status:
+                            response.raise_for_status()
+                        return response.status, body
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+                if attempt == self.max_retries:
+                    raise
+                self.logger.warning('{} for {}, retrying...'.format(type(ex).__name__, url))
+            await asyncio.sleep(get_backoff_time(self.retry, attempt + 1))
+
+    async def _get_json(self, url: str, default=None):
+        status, body = await self._request('GET', url)
+        if status == 200:
+            return json.loads(body)
+        return default
+
+    async def login(self, username: str = None, password: str = None):
+        root_url = Variables().login_url()
+        username = username or Variables().login_email()
+        password = password or Variables().login_password()
+
+        url = '{}/api/auth/signin'.format(root_url)
+        self.logger.info('Logging in to {} with username {}.'.format(url, username))
+        status, body = await self._request('POST', url, authenticated=False,
+                                           json={'username': username, 'password': password})
+        if status == 200:
+            self.token = json.loads(body)['token']
+            return True
+        else:
+            self.logger.error('Error authenticating to {} with username {}.'.format(url, username))
+            self.logger.error('Http response code: {}, response body: {}: '.format(status, body))
+            return False
+
+    def is_authenticated(self):
+        return True if self.token else False
+
+    async def get_subjects(self):
+        return await self._get_json('{}/api/subjects'.format(Variables().login_url()), [])
+
+    async def _get_subject_lectures(self, subject: Dict):
+        root_url = Variables().login_url()
+        regular, flipped = await asyncio.gather(
+            self._get_json('{}/api/subjects/{}/lectures/{}'.format(
+                root_url, subject.get('subjectId'), subject.get('sessionId')), []),
+            self._get_json('{}/api/subjects/flipped/{}/{}'.format(
+                root_url, subject.get('subjectId'), subject.get('sessionId')), []),
+        )
+        return RegularVideo.parse_lectures(regular) + FlippedVideo.parse_lectures(flipped)
+
+    async def get_lecture_videos(self, subjects: List[Dict]):
+        """
+        Yields (video_id, video_metadata, is_flipped) of the lectures of all the subjects, fetched concurrently.
+        """
+        for lectures in asyncio.as_completed([self._get_subject_lectures(subject) for subject in subjects]):
+            for video in await lectures:
+                yield video
+
+    async def _get_subject_slides(self, subject: Dict, mappings):
+        backpack_slides = await self._get_json('{}/api/subjects/backpack/{}/sessions/{}'.format(
+            Variables().login_url(), subject.get('subjectId'), subject.get('sessionId')))
+        if backpack_slides:
+            return subject, Impartus.parse_slides(subject, backpack_slides, mappings)
+
+    async def get_slides(self, subjects: List[Dict]):
+        """
+        Yields (subject, documents) for all the subjects with backpack documents, fetched concurrently.
+        """
+        mappings = Config.load(ConfigType.MAPPINGS)
+        for subject_slides in asyncio.as_completed([self._get_subject_slides(x, mappings) for x in subjects]):
+            result = await subject_slides
+            if result:
+                yield result
+
+    async def get_chats(self, video_metadata: Dict):
+        chat_url = '{}/api/videos/{}/chat'.format(Variables().login_url(), video_metadata['ttid'])
+        self.logger.info('[{}]: Downloading lecture chats from {}'.format(video_metadata['ttid'], chat_url))
+        chats = await self._get_json(chat_url)
+        if chats is None:
+            self.logger.info("[{}]: No lecture chats found for {}".format(video_metadata['ttid'], chat_url))
+            return []
+        return chats
+
+    async def _download_playlist(self, url: str):
+        status, body = await self._request('GET', url)
+        if status == 200:
+            return body.decode('utf-8').splitlines()
+
+    async def _download_m3u8(self, master_url: str):
+        status, body = await self._request('GET', master_url)
+        if status == 200:
+            return Impartus.parse_master_playlist(body.decode('utf-8'))
+        return []
+
+    async def download_m3u8_regular(self, ttid):
+        m3u8_urls = await self._download_m3u8(Impartus.get_master_url(ttid, self.token))
+        m3u8_url = Impartus.select_regular_playlist(m3u8_urls)
+        if m3u8_url:
+            self.logger.info("Using {} for download".format(m3u8_url))
+            return await self._download_playlist(m3u8_url)
+
+    async def download_m3u8_flipped(self, fcid, flipped_lecture_quality='highest'):
+        m3u8_urls = await self._download_m3u8(Impartus.get_master_url(fcid, self.token, flipped=True))
+        url = Impartus.select_flipped_playlist(self.conf, m3u8_urls, flipped_lecture_quality)
+        if url:
+            return await self._download_playlist(url)
+
+    async def download_stream(self, url: str):
+        """
+        Contents of a media stream (segment), the media hosts are not sent the auth token.
+        """
+        _, body = await self._request('GET', url, authenticated=False, raise_for_status=True)
+        return body
+
+    async def download_streams(self, urls: List[str]):
+        """
+        Contents of all the streams, in order. The requests in flight are limited by the connection pool size.
+        """
+        return await asyncio.gather(*[self.download_stream(url) for url in urls])
+
+    async def download_encryption_key(self, key_url: str):
+        _, body = await self._request('GET', key_url, raise_for_status=True)
+        return Impartus.decode_encryption_key(body)
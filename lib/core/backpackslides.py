@@ -1,17 +1,31 @@
 import os
 import re
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Tuple
+from urllib.parse import urlparse
+
+from lib.core.mediatransport import MediaTransport
 from lib.variables import Variables
 
 
 class BackpackSlides:
+    """
+    Downloads backpack documents over a MediaTransport, streaming them to disk.
+    """
 
-    def __init__(self, token, timeouts, logger, conf):
-        self.token = token
-        self.timeouts = timeouts
+    def __init__(self, transport: MediaTransport, logger, conf):
+        self.transport = transport
         self.logger = logger
         self.conf = conf
 
+    @staticmethod
+    def is_impartus_url(url: str):
+        """
+        True if url is on the impartus host, documents linked from other hosts are fetched without the auth token.
+        """
+        login_url = Variables().login_url()
+        return bool(login_url) and urlparse(url).hostname == urlparse(login_url).hostname
+
     def download_slides(self, file_url, filepath):
         root_url = Variables().login_url()
 
@@ -29,19 +43,41 @@ class BackpackSlides:
                 continue
 
             self.logger.info('Downloading document from {}'.format(slides_url))
-            response = requests.get(
-                slides_url,
-                timeout=self.timeouts,
-                headers={'Cookie': 'Bearer={}'.format(self.token)}
-            )
-            if response.status_code == 200:
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-
-                with open(filepath, 'wb+') as fh:
-                    fh.write(response.content)
+            # streamed to <filepath>.part, a partial download from an earlier attempt is resumed.
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            response = self.transport.download_to_file(
+                slides_url, filepath, authenticated=self.is_impartus_url(slides_url))
+            if response.ok:
                 download_status = True
             else:
                 self.logger.error('Error fetching slides from url: {}'.format(file_url))
                 self.logger.error('Http response code: {}, response body: {}: '.format(
                     response.status_code, response.text))
         return download_status
+
+    def download_batch(self, items: List[Tuple[str, str]], workers: int = 4, finished_func: Callable = None):
+        """
+        Download the (file_url, filepath) items, workers at a time, sharing the transport's connection pool.
+        :param items: list of (file_url, filepath) tuples.
+        :param workers: max number of documents downloaded concurrently.
+        :param finished_func: called with (file_url, filepath, status) as each download finishes.
+        :return: dict of filepath -> download status.
+        """
+        statuses = dict()
+        if not items:
+            return statuses
+
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as executor:
+            futures = {executor.submit(self.download_slides, file_url, filepath): (file_url, filepath)
+                       for file_url, filepath in items}
+            for future in as_completed(futures):
+                file_url, filepath = futures[future]
+                try:
+                    status = future.result()
+                except Exception as ex:
+                    self.logger.error('Error downloading document from {}: {}'.format(file_url, ex))
+                    status = False
+                statuses[filepath] = status
+                if finished_func:
+                    finished_func(file_url, filepath, status)
+        return statuses
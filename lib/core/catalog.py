@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Tuple
+
+
+class Catalog:
+    """
+    Runs the per subject catalog requests (lectures, flipped lectures, backpack documents) concurrently, with at
+    most [workers] requests in flight, and hands over the results as they arrive.
+    """
+
+    VIDEOS = 'videos'
+    DOCUMENTS = 'documents'
+
+    def __init__(self, workers: int = 5):
+        self.workers = max(1, int(workers))
+
+    def fetch(self, tasks: List[Tuple[str, Callable]]):
+        """
+        Run the (kind, func) tasks, and yield (kind, func()) in the order the tasks complete.
+        If a task fails, the tasks not started yet are cancelled and the exception is raised.
+        """
+        if not tasks:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(tasks))) as executor:
+            futures = {executor.submit(func): kind for kind, func in tasks}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                # also reached when the caller stops early.
+                for future in futures:
+                    future.cancel()
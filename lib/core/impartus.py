@@ -1,27 +1,37 @@
+import atexit
 import os
 import re
 import sys
-import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
+from itertools import zip_longest
+from threading import Lock
 
 import requests
 import platform
 
 from lib.config import Config, ConfigType
 from lib.core.backpackslides import BackpackSlides
+from lib.core.catalog import Catalog
 from lib.core.flippedvideo import FlippedVideo
+from lib.core.keycache import KeyCache
+from lib.core.mediatransport import MediaTransport, get_retry
 from lib.core.regularvideo import RegularVideo
+from lib.core.responsecache import CachingHTTPAdapter, ResponseCache
+from lib.core.segmentdownloader import InvalidContentError, SegmentDownloader
+from lib.core.streamchecker import StreamChecker
+from lib.downloadqueue import DownloadJob, DownloadQueue, FairLimiter
+from lib.instrumentation import Instrumentation
 from lib.threadlogging import ThreadLogger
 from lib.utils import Utils
 from lib.media.encoder import Encoder
 from lib.media.m3u8parser import M3u8Parser
 from lib.media.decrypter import Decrypter
+from lib.media.trackwriter import PipedTrackWriter, TrackWriter
+from lib.media.tsscanner import TsScanner
 from lib.variables import Variables
 
-from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
-from http import HTTPStatus
-from requests.exceptions import ConnectTimeout, ConnectionError, Timeout
 
 
 class Impartus:
@@ -31,6 +41,22 @@ class Impartus:
     """
     thread_logger = ThreadLogger(__name__)
 
+    # limits the media stream requests in flight, shared by all the videos being downloaded.
+    segment_limiter = None
+
+    # cache for the api responses, shared by all the sessions.
+    response_cache = None
+
+    # cache for the media encryption keys, shared by all the videos being downloaded.
+    key_cache = None
+    key_cache_lock = Lock()
+
+    # runs the post download stages (join, encode, cleanup), shared by all the videos being downloaded.
+    encode_pool = None
+
+    # chrome trace of the session is written here, if tracing (see get_trace_filepath()), '' if not.
+    trace_filepath = None
+
     def __init__(self, token=None):
         self.session = None
         self.token = None
@@ -43,9 +69,16 @@ class Impartus:
             self.conf.get('read_timeout', 5.0)
         ])
 
+        # pooled, retrying transport for streams, encryption keys and documents.
+        self.media = MediaTransport(self.conf, self.timeouts)
+        self.backpack_slides = BackpackSlides(self.media, self.logger, self.conf)
+        if Impartus.segment_limiter is None:
+            Impartus.segment_limiter = FairLimiter(self.conf.get('max_segment_requests', 8))
+
         # reuse the auth token, if we are already authenticated.
         if token:
             self.token = token
+            self.media.set_token(token)
             self.session = self._get_session_with_retry()
             self.session.cookies.update({'Bearer': token})
             self.session.headers.update({'Authorization': 'Bearer {}'.format(token)})
@@ -57,22 +90,33 @@ class Impartus:
         self.temp_downloads_dir = os.path.join(Utils.get_temp_dir(), 'impartus.media')
         os.makedirs(self.temp_downloads_dir, exist_ok=True)
 
-    def _download_m3u8(self, master_url):
-        response = self.session.get(master_url, timeout=self.timeouts)
+        if Impartus.encode_pool is None:
+            Impartus.encode_pool = ThreadPoolExecutor(max_workers=self.get_encode_workers(),
+                                                      thread_name_prefix='encode')
 
-        m3u8_urls = []
-        if response.status_code == 200:
-            lines = response.text.splitlines()
-            for line in lines:
-                if re.match('^http', line):
-                    m3u8_urls.append(line.strip())
-        return m3u8_urls
+        if Impartus.trace_filepath is None:
+            Impartus.trace_filepath = self.get_trace_filepath()
+            if Impartus.trace_filepath:
+                Instrumentation.start_trace()
+                atexit.register(Instrumentation.write_trace, Impartus.trace_filepath)
 
-    def download_m3u8_regular(self, ttid):
+    @staticmethod
+    def get_master_url(rf_id, token, flipped=False):
         root_url = Variables().login_url()
-        master_url = '{}/api/fetchvideo?ttid={}&token={}&type=index.m3u8'.format(root_url, ttid, self.token)
-        m3u8_urls = self._download_m3u8(master_url)
+        id_name = 'fcid' if flipped else 'ttid'
+        return '{}/api/fetchvideo?{}={}&token={}&type=index.m3u8'.format(root_url, id_name, rf_id, token)
+
+    @staticmethod
+    def parse_master_playlist(text):
+        m3u8_urls = []
+        lines = text.splitlines()
+        for line in lines:
+            if re.match('^http', line):
+                m3u8_urls.append(line.strip())
+        return m3u8_urls
 
+    @staticmethod
+    def select_regular_playlist(m3u8_urls):
         if len(m3u8_urls) > 0:
             m3u8_url = m3u8_urls[0]
             last_res = 0
@@ -81,154 +125,627 @@ class Impartus:
                 if resolution and int(resolution) > last_res:
                     m3u8_url = url
                     last_res = int(resolution)
+            return m3u8_url
+
+    @staticmethod
+    def select_flipped_playlist(conf, m3u8_urls, flipped_lecture_quality='highest'):
+        if flipped_lecture_quality == 'highest':
+            return Utils.get_url_for_highest_quality_video(conf, m3u8_urls)
+        elif flipped_lecture_quality == 'lowest':
+            return Utils.get_url_for_lowest_quality_video(conf, m3u8_urls)
+        else:  # given a specific resolution.
+            return Utils.get_url_for_resolution(m3u8_urls, flipped_lecture_quality)
+
+    @staticmethod
+    def decode_encryption_key(content):
+        key = content[2:]
+        return key[::-1]  # reverse the bytes.
+
+    def _download_m3u8(self, master_url):
+        response = self.session.get(master_url, timeout=self.timeouts)
+
+        m3u8_urls = []
+        if response.status_code == 200:
+            m3u8_urls = self.parse_master_playlist(response.text)
+        return m3u8_urls
 
+    def download_m3u8_regular(self, ttid):
+        m3u8_urls = self._download_m3u8(self.get_master_url(ttid, self.token))
+        m3u8_url = self.select_regular_playlist(m3u8_urls)
+
+        if m3u8_url:
             self.logger.info("Using {} for download".format(m3u8_url))
             response = self.session.get(m3u8_url, timeout=self.timeouts)
             if response.status_code == 200:
                 return response.text.splitlines()
 
     def download_m3u8_flipped(self, fcid, flipped_lecture_quality='highest'):
-        root_url = Variables().login_url()
-        master_url = '{}/api/fetchvideo?fcid={}&token={}&type=index.m3u8'.format(root_url, fcid, self.token)
-
-        m3u8_urls = self._download_m3u8(master_url)
-        if flipped_lecture_quality == 'highest':
-            url = Utils.get_url_for_highest_quality_video(self.conf, m3u8_urls)
-        elif flipped_lecture_quality == 'lowest':
-            url = Utils.get_url_for_lowest_quality_video(self.conf, m3u8_urls)
-        else:  # given a specific resolution.
-            url = Utils.get_url_for_resolution(m3u8_urls, flipped_lecture_quality)
+        m3u8_urls = self._download_m3u8(self.get_master_url(fcid, self.token, flipped=True))
+        url = self.select_flipped_playlist(self.conf, m3u8_urls, flipped_lecture_quality)
 
         if url:
             response = self.session.get(url, timeout=self.timeouts)
             if response.status_code == 200:
                 return response.text.splitlines()
 
+    def _download_stream(self, url, byte_range=None, rf_id=None):
+        """
+        Contents of a stream, or of the (first byte, last byte) range of it.
+        """
+        with Instrumentation.span(rf_id, 'fetch', url) as span:
+            if byte_range is None:
+                response = self.media.get(url)
+                response.raise_for_status()
+                content = response.content
+            else:
+                first, last = byte_range
+                response = self.media.get(url, headers={'Range': 'bytes={}-{}'.format(first, last)})
+                response.raise_for_status()
+                content = response.content
+                if response.status_code != 206:
+                    # server ignored the range, and sent the whole resource.
+                    content = content[first:last + 1]
+            span.add_bytes(len(content))
+            span.add_retries(MediaTransport.get_retries(response))
+            return content
+
+    def _download_stream_to_file(self, url, filepath, rf_id=None):
+        with Instrumentation.span(rf_id, 'fetch', url) as span:
+            response = self.media.download_to_file(url, filepath)
+            span.add_retries(MediaTransport.get_retries(response))
+            response.raise_for_status()
+            span.add_bytes(os.path.getsize(filepath))
+
+    def _download_encryption_key(self, key_url, rf_id=None):
+        with Instrumentation.span(rf_id, 'key') as span:
+            response = self.media.get(key_url, authenticated=True)
+            span.add_retries(MediaTransport.get_retries(response))
+            return self.decode_encryption_key(response.content)
+
+    def _get_key_cache(self):
+        # created on first use, the login password (used to encrypt the saved keys) is set by then.
+        with Impartus.key_cache_lock:
+            if Impartus.key_cache is None:
+                filepath = None
+                if self.conf.get('persist_encryption_keys', True):
+                    filepath = os.path.join(Utils.get_config_dir(), 'encryption_keys.json')
+                Impartus.key_cache = KeyCache(filepath, secret=Variables().login_password(), logger=self.logger)
+            return Impartus.key_cache
+
+    def get_key_cache_stats(self):
+        """
+        Hit / fetch counters and fetch latency of the encryption key cache.
+        """
+        return Impartus.key_cache.get_stats() if Impartus.key_cache else {}
+
     def process_video(self, video_metadata, mkv_filepath, pause_ev, resume_ev, progress_callback_func,
                       video_quality='highest'):
         """
         Download video and decrypt, join, encode to mkv
         :return:
         """
+        return self.download_video(video_metadata, mkv_filepath, pause_ev, resume_ev, progress_callback_func,
+                                   video_quality).result()
+
+    def download_video(self, video_metadata, mkv_filepath, pause_ev, resume_ev, progress_callback_func,
+                       video_quality='highest'):
+        """
+        Download the video streams on this thread, and hand the rest (decrypt, join, encode to mkv, cleanup) to the
+        encode pool, so that the caller can go on to download the next video while this one is encoded.
+        :return: Future of the status, True if the mkv file was created.
+        """
         number_of_tracks = int(video_metadata['tapNToggle'])
         duration = int(video_metadata['actualDuration'])
-        encryption_keys = dict()
 
         rf_id = video_metadata['ttid'] if video_metadata.get('ttid') else video_metadata['fcid']
         self.logger.info("[{}]: Starting download for {}".format(rf_id, mkv_filepath))
-        if video_metadata.get('fcid'):
-            m3u8_content = self.download_m3u8_flipped(rf_id, video_quality)
-        else:
-            m3u8_content = self.download_m3u8_regular(rf_id)
+        with Instrumentation.span(rf_id, 'playlist'):
+            if video_metadata.get('fcid'):
+                m3u8_content = self.download_m3u8_flipped(rf_id, video_quality)
+            else:
+                m3u8_content = self.download_m3u8_regular(rf_id)
 
         # download media files for this video.
-        if m3u8_content:
-            summary, tracks_info = M3u8Parser(m3u8_content, num_tracks=number_of_tracks).parse()
-            download_dir = os.path.join(self.temp_downloads_dir, str(rf_id))
-            os.makedirs(download_dir, exist_ok=True)
-
-            temp_files_to_delete = set()
-            ts_files = list()
-            items_processed = 0
-            last_percent = 0
-            for track_index, track_info in enumerate(tracks_info):
-                self.logger.info("[{}]: Downloading streams for track {} ..".format(rf_id, track_index))
-                streams_to_join = list()
-                for item in track_info:
-
-                    # download encrypted stream..
-                    enc_stream_filepath = '{}/{}'.format(download_dir, item['file_number'])
-                    temp_files_to_delete.add(enc_stream_filepath)
-
-                    if not os.path.exists(enc_stream_filepath) or os.path.getsize(enc_stream_filepath) == 0:
-                        download_flag = False
-                        while not download_flag:
-                            if pause_ev and pause_ev.is_set():
-                                self.logger.info("[{}]: Pausing download for {}".format(rf_id, mkv_filepath))
-                                resume_ev.wait()
-                                self.logger.info("[{}]: Resuming download for {}".format(rf_id, mkv_filepath))
-                                resume_ev.clear()
-                            try:
-                                content = requests.get(item['url'], timeout=self.timeouts).content
-                                download_flag = True
-                                with open(enc_stream_filepath, 'wb') as fh:
-                                    fh.write(content)
-                            except (ConnectionError, Timeout, ConnectTimeout):
-                                self.logger.warning("[{}]: Timeout error. retrying download for {}...".format(
-                                    rf_id, item['url']))
-                                time.sleep(self.conf.get('retry_wait'))
-
-                    # decrypt files if encrypted.
-                    if item.get('encryption_method') == "NONE":
-                        streams_to_join.append(enc_stream_filepath)
-                    else:
-                        decrypted_stream_filepath = '{}.ts'.format(enc_stream_filepath)
-                        if not os.path.exists(decrypted_stream_filepath) or os.path.getsize(decrypted_stream_filepath) == 0:
-                            if not encryption_keys.get(item['encryption_key_id']):
-                                key = self.session.get(item['encryption_key_url'], timeout=self.timeouts).content[2:]
-                                key = key[::-1]  # reverse the bytes.
-                                encryption_keys[item['encryption_key_id']] = key
-                            encryption_key = encryption_keys[item['encryption_key_id']]
-                            decrypted_stream_filepath = Decrypter.decrypt(
-                                encryption_key, enc_stream_filepath,
-                                download_dir)
-                        streams_to_join.append(decrypted_stream_filepath)
-                        temp_files_to_delete.add(decrypted_stream_filepath)
-                    # update progress bar
-                    items_processed += 1
-                    items_processed_percent = items_processed * 100 // summary.get('media_files')
-                    try:
-                        if progress_callback_func and items_processed_percent > last_percent:
-                            progress_callback_func(items_processed_percent)
-                            last_percent = items_processed_percent
-                    except RuntimeError as ex:
-                        self.logger.warning("Download interrupted - {}".format(ex))
-                        return False
-
-                # All stream files for this track are decrypted, join them.
-                self.logger.debug("[{}]: Joining streams for track {} ..".format(rf_id, track_index))
-                ts_file = Encoder.join(streams_to_join, download_dir, track_index)
-                ts_files.append(ts_file)
-                temp_files_to_delete.add(ts_file)
+        if not m3u8_content:
+            self._log_summary(rf_id)
+            return self._completed_future(None)
+
+        summary, tracks_info = M3u8Parser(m3u8_content, num_tracks=number_of_tracks).parse()
+        if M3u8Parser.needs_split(tracks_info):
+            # split at the segment boundaries, instead of splitting the joined track 0 with ffmpeg later.
+            self.logger.info("[{}]: All the streams are in track 0, splitting it by duration.".format(rf_id))
+            tracks_info = M3u8Parser.split_track(tracks_info, duration)
+        download_dir = os.path.join(self.temp_downloads_dir, str(rf_id))
+        os.makedirs(download_dir, exist_ok=True)
+
+        downloader = SegmentDownloader(
+            self.logger,
+            workers=self.conf.get('download_workers', 4),
+            retry_wait=self.conf.get('retry_wait'),
+            pause_ev=pause_ev, resume_ev=resume_ev, rf_id=rf_id,
+            limiter=Impartus.segment_limiter,
+        )
+        checker = StreamChecker(self.conf, tracks_info, self.logger, rf_id=rf_id)
+        last_percent = 0
+
+        def update_progress(items_processed):
+            nonlocal last_percent
+            items_processed_percent = items_processed * 100 // summary.get('media_files')
+            if progress_callback_func and items_processed_percent > last_percent:
+                progress_callback_func(items_processed_percent)
+                last_percent = items_processed_percent
+
+        media_pipeline = self._get_media_pipeline(rf_id, tracks_info)
+        os.makedirs(os.path.dirname(mkv_filepath), exist_ok=True)
+        try:
+            if media_pipeline == 'pipe':
+                # encoded while downloading, only the cleanup is left.
+                with Instrumentation.span(rf_id, 'download'):
+                    flag, temp_files_to_delete = self._download_tracks_piped(
+                        rf_id, tracks_info, download_dir, mkv_filepath, downloader, checker, update_progress)
+                self._log_download_stats(rf_id)
+                with Instrumentation.span(rf_id, 'duration_check'):
+                    checker.check_track_durations(duration)
+                return self._completed_future(
+                    self._finish_video(rf_id, mkv_filepath, download_dir, flag, temp_files_to_delete))
+
+            with Instrumentation.span(rf_id, 'download'):
+                if media_pipeline == 'stream':
+                    ts_files, temp_files_to_delete = self._download_tracks_streaming(
+                        rf_id, tracks_info, download_dir, downloader, checker, update_progress)
+
+                    def join_tracks():
+                        return ts_files, temp_files_to_delete
+                else:
+                    self._download_tracks(rf_id, tracks_info, download_dir, downloader, checker, update_progress)
+                    join_tracks = partial(self._join_tracks, rf_id, tracks_info, download_dir)
+        except (RuntimeError, requests.RequestException, ValueError) as ex:
+            # http errors fetching the streams / keys, and streams failing to decrypt.
+            self.logger.warning("Download interrupted - {}".format(ex))
+            self._log_summary(rf_id)
+            return self._completed_future(False)
+
+        self._log_download_stats(rf_id)
+        self.logger.info("[{}]: Download complete, queued for encoding.".format(rf_id))
+        first_segments = self._get_first_segments(tracks_info, download_dir, checker)
+        return Impartus.encode_pool.submit(self._encode_video, rf_id, join_tracks, mkv_filepath, duration,
+                                           download_dir, checker, first_segments)
+
+    def _encode_video(self, rf_id, join_tracks, mkv_filepath, duration, download_dir, checker, first_segments):
+        """
+        Post download stages of a video, run in the encode pool: join the streams into track files, encode the
+        tracks to mkv, delete the temporary files.
+        :param join_tracks: func() returning the list of track files, and the set of temporary files created.
+        :param checker: StreamChecker of the download, with the scans of the streams.
+        :param first_segments: (size, duration) of the first stream of each track, see _get_first_segments().
+        :return: True if the mkv file was created.
+        """
+        try:
+            ts_files, temp_files_to_delete = join_tracks()
+
+            with Instrumentation.span(rf_id, 'duration_check'):
+                checker.check_track_durations(duration)
 
             # Encode all ts files into a single output mkv.
-            os.makedirs(os.path.dirname(mkv_filepath), exist_ok=True)
             flag = Encoder.encode_mkv(rf_id, ts_files, mkv_filepath, duration, debug=self.conf.get('debug'),
-                                      priority=self.conf.get('external_process_priority'))
+                                      priority=self.conf.get('external_process_priority'),
+                                      tight_probe=self.conf.get('tight_probe', True), first_segments=first_segments)
+        except (RuntimeError, requests.RequestException, ValueError) as ex:
+            self.logger.warning("[{}]: Processing interrupted - {}".format(rf_id, ex))
+            self._log_summary(rf_id)
+            return False
+        return self._finish_video(rf_id, mkv_filepath, download_dir, flag, temp_files_to_delete)
 
-            if flag:
-                self.logger.info("[{}]: Processed {}\n---".format(rf_id, mkv_filepath))
+    @staticmethod
+    def _get_first_segments(tracks_info, download_dir, checker):
+        """
+        (size in bytes, duration in seconds) of the first stream of each track, bounding the probe windows of the
+        track files (see Encoder.get_probe_window()). The size is taken from the scan of the stream, its byte range,
+        or its file, whichever is known, None otherwise. None for empty tracks.
+        """
+        first_segments = list()
+        for track_index, track_info in enumerate(tracks_info):
+            if not track_info:
+                first_segments.append(None)
+                continue
+            item = track_info[0]
+            scan = checker.scans[track_index][0]
+            stream_filepath = '{}/{}'.format(download_dir, item.file_number)
+            if scan is not None:
+                size = scan.packets * TsScanner.packet_size + scan.trailing_bytes
+            elif item.byte_range is not None:
+                size = item.byte_range[1]
+            elif os.path.exists(stream_filepath):
+                size = os.path.getsize(stream_filepath)
+            else:
+                size = None
+            first_segments.append((size, item.duration))
+        return first_segments
+
+    def _log_summary(self, rf_id):
+        """
+        Log the per stage counters of the lecture, and update the metrics file with the totals, and the trace file.
+        """
+        self.logger.info("[{}]: Stages: {}".format(rf_id, Instrumentation.summary(rf_id)))
+        if self.conf.get('write_metrics', True):
+            try:
+                Instrumentation.write_metrics(os.path.join(Utils.get_config_dir(), 'metrics.prom'))
+            except OSError as ex:
+                self.logger.warning("[{}]: Error writing the metrics file: {}".format(rf_id, ex))
+        if Impartus.trace_filepath:
+            try:
+                Instrumentation.write_trace(Impartus.trace_filepath)
+            except OSError as ex:
+                self.logger.warning("[{}]: Error writing the trace file: {}".format(rf_id, ex))
+
+    def _finish_video(self, rf_id, mkv_filepath, download_dir, flag, temp_files_to_delete):
+        self._log_summary(rf_id)
+        if flag:
+            self.logger.info("[{}]: Processed {}\n---".format(rf_id, mkv_filepath))
+
+            # delete temp files.
+            if not self.conf.get('debug'):
+                Utils.delete_files(list(temp_files_to_delete))
+                os.rmdir(download_dir)
+        return flag
+
+    def get_trace_filepath(self):
+        """
+        File to write the chrome trace of the session to: $IMPARTUS_TRACE if set, else trace.json in the config
+        directory if the trace config flag is on. '' if not tracing.
+        """
+        if os.environ.get('IMPARTUS_TRACE'):
+            return os.environ.get('IMPARTUS_TRACE')
+        if self.conf.get('trace', False):
+            return os.path.join(Utils.get_config_dir(), 'trace.json')
+        return ''
+
+    def _log_download_stats(self, rf_id):
+        self.logger.debug("[{}]: Media connections: {}".format(rf_id, self.media.get_stats()))
+        self.logger.debug("[{}]: Encryption keys: {}".format(rf_id, self.get_key_cache_stats()))
+
+    @staticmethod
+    def _completed_future(result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def get_encode_workers(self):
+        """
+        Number of videos joined / encoded at the same time, encode_workers from the config, if not 0.
+        ffmpeg only copies the streams (-c copy), so encoding is mostly disk bound: one encode at a time when the
+        temporary files and the videos are on the same disk, up to two otherwise (cpus permitting).
+        """
+        encode_workers = int(self.conf.get('encode_workers', 0) or 0)
+        if encode_workers > 0:
+            return encode_workers
+        same_disk = Utils.get_device(self.temp_downloads_dir) == Utils.get_device(self.download_dir or '.')
+        return max(1, min(1 if same_disk else 2, (os.cpu_count() or 1) // 2))
+
+    def _get_media_pipeline(self, rf_id, tracks_info):
+        media_pipeline = self.conf.get('media_pipeline', 'files')
+        if media_pipeline == 'pipe':
+            if not Encoder.can_pipe():
+                self.logger.info("[{}]: Named pipes not supported on this platform, using 'stream' pipeline.".format(
+                    rf_id))
+                media_pipeline = 'stream'
+            elif any(len(track_info) == 0 for track_info in tracks_info):
+                # an empty track is left to encode_mkv(), which splits track 0 after joining.
+                self.logger.info("[{}]: Empty track(s), using 'stream' pipeline.".format(rf_id))
+                media_pipeline = 'stream'
+        return media_pipeline
+
+    def _get_requests(self, tracks_info, pending):
+        """
+        Requests for the streams of all the tracks, as (track_index, streams) tuples, streams being the list of
+        (stream_index, item) fetched by the request. Adjacent byte ranges (EXT-X-BYTERANGE) of a track are coalesced
+        into requests of up to max_range_request_size bytes, other streams are a request each.
+        The tracks are interleaved, so that they are downloaded together.
+        :param pending: func(track_index, stream_index, item), False for the streams already available.
+        """
+        max_length = self.conf.get('max_range_request_size', 8388608)
+        track_requests = list()
+        for track_index, track_info in enumerate(tracks_info):
+            streams = ((stream_index, item) for stream_index, item in enumerate(track_info)
+                       if pending(track_index, stream_index, item))
+            track_requests.append([(track_index, x) for x in M3u8Parser.coalesce_byte_ranges(streams, max_length)])
+
+        for requests in zip_longest(*track_requests):
+            for request in requests:
+                if request:
+                    yield request
+
+    def _get_fetch(self, rf_id, streams):
+        _, item = streams[0]
+        if item.byte_range is None:
+            return partial(self._download_stream, item.url, rf_id=rf_id)
+        _, last_item = streams[-1]
+        return partial(self._download_stream, item.url, (item.byte_range[0], sum(last_item.byte_range) - 1),
+                       rf_id=rf_id)
+
+    @staticmethod
+    def _split_content(streams, content):
+        # contents of the request for the streams, split by stream.
+        _, item = streams[0]
+        if item.byte_range is None:
+            return [content]
+        offset = item.byte_range[0]
+        return [content[x.byte_range[0] - offset:sum(x.byte_range) - offset] for _, x in streams]
+
+    def _get_encryption_key(self, item, rf_id=None):
+        return self._get_key_cache().get(
+            item.encryption_key_id, partial(self._download_encryption_key, item.encryption_key_url, rf_id))
+
+    def _get_iv(self, item):
+        # streams are decrypted with a zero iv when the playlist does not give one (as earlier versions did),
+        # implicit_iv: sequence uses the media sequence number instead, as per the HLS spec.
+        if item.key.iv is None and self.conf.get('implicit_iv', 'zero') == 'zero':
+            return None
+        return item.iv
+
+    def _download_tracks(self, rf_id, tracks_info, download_dir, downloader, checker, progress_func):
+        """
+        Download every stream to a file, see _join_tracks(). When checked, the streams are decrypted as they are
+        downloaded.
+        """
+        def pending(track_index, stream_index, item):     # noqa
+            return not downloader.is_downloaded('{}/{}'.format(download_dir, item.file_number))
+
+        downloads = list()
+        for track_index, streams in self._get_requests(tracks_info, pending):
+            _, item = streams[0]
+            if item.byte_range is None:
+                # resumable, if interrupted.
+                fetch = partial(self._download_stream_to_file, item.url, '{}/{}'.format(download_dir, item.file_number),
+                                rf_id)
+                check = None
+                if checker.enabled():
+                    check = partial(self._check_stream_files, rf_id, download_dir, checker, track_index, streams)
+                downloads.append((item.url, fetch, check, 1))
+            else:
+                downloads.append((item.url, self._get_fetch(rf_id, streams),
+                                  partial(self._save_streams_to_files, rf_id, download_dir, checker, track_index,
+                                          streams), len(streams)))
+
+        num_streams = sum(len(track_info) for track_info in tracks_info)
+        completed = num_streams - sum(segments for _, _, _, segments in downloads)
+        self.logger.info("[{}]: Downloading {} streams in {} requests ..".format(
+            rf_id, num_streams - completed, len(downloads)))
+        downloader.download_tasks(downloads, progress_func, completed=completed)
+
+    def _join_tracks(self, rf_id, tracks_info, download_dir):
+        """
+        Decrypt (unless done while downloading) and join the stream files downloaded by _download_tracks() into
+        track files.
+        :return: list of track files, and the set of temporary files created.
+        """
+        temp_files_to_delete = set()
+        ts_files = list()
+        for track_index, track_info in enumerate(tracks_info):
+            streams_to_join = list()
+            for item in track_info:
+                enc_stream_filepath = '{}/{}'.format(download_dir, item.file_number)
+                temp_files_to_delete.add(enc_stream_filepath)
+
+                stream_filepath = self._decrypt_stream_file(rf_id, download_dir, item)
+                streams_to_join.append(stream_filepath)
+                temp_files_to_delete.add(stream_filepath)
+
+            # All stream files for this track are decrypted, join them.
+            self.logger.debug("[{}]: Joining streams for track {} ..".format(rf_id, track_index))
+            ts_file = Encoder.join(streams_to_join, download_dir, track_index, rf_id=rf_id)
+            ts_files.append(ts_file)
+            temp_files_to_delete.add(ts_file)
+
+        return ts_files, temp_files_to_delete
+
+    def _decrypt_stream_file(self, rf_id, download_dir, item):
+        """
+        Decrypt the stream file of item to <stream file>.ts, if encrypted and not decrypted yet.
+        :return: path of the decrypted stream file.
+        """
+        enc_stream_filepath = '{}/{}'.format(download_dir, item.file_number)
+        if item.encryption_method == "NONE":
+            return enc_stream_filepath
+        decrypted_stream_filepath = '{}.ts'.format(enc_stream_filepath)
+        if not SegmentDownloader.is_downloaded(decrypted_stream_filepath):
+            encryption_key = self._get_encryption_key(item, rf_id)
+            decrypted_stream_filepath = Decrypter.decrypt(
+                encryption_key, enc_stream_filepath, download_dir, iv=self._get_iv(item), rf_id=rf_id)
+        return decrypted_stream_filepath
+
+    def _check_stream_files(self, rf_id, download_dir, checker, track_index, streams, content=None):
+        """
+        Decrypt and check the stream files of a request, as they are downloaded. The files of a stream failing the
+        checks are deleted before it is fetched again, so that a resumed download does not pick them up.
+        """
+        for stream_index, item in streams:
+            stream_filepath = self._decrypt_stream_file(rf_id, download_dir, item)
+            try:
+                checker.check(track_index, stream_index, item, filepath=stream_filepath)
+            except InvalidContentError:
+                enc_stream_filepath = '{}/{}'.format(download_dir, item.file_number)
+                Utils.delete_files([x for x in {enc_stream_filepath, stream_filepath} if os.path.exists(x)])
+                raise
+
+    def _save_streams_to_files(self, rf_id, download_dir, checker, track_index, streams, content):
+        for (_, item), stream_content in zip(streams, self._split_content(streams, content)):
+            SegmentDownloader.save_to_file('{}/{}'.format(download_dir, item.file_number), stream_content)
+        if checker.enabled():
+            self._check_stream_files(rf_id, download_dir, checker, track_index, streams)
+
+    def _save_streams(self, rf_id, track_writer, checker, track_index, streams, abort_ev, content):
+        """
+        Decrypt and check the streams of a request, and write them to the track. All the streams are checked
+        before any is written, a request failing the checks is fetched again as a whole.
+        """
+        stream_contents = list()
+        for (stream_index, item), stream_content in zip(streams, self._split_content(streams, content)):
+            if item.encryption_method != "NONE":
+                encryption_key = self._get_encryption_key(item, rf_id)
+                stream_content = Decrypter.decrypt_bytes(encryption_key, stream_content, iv=self._get_iv(item),
+                                                         rf_id=rf_id)
+            checker.check(track_index, stream_index, item, content=stream_content)
+            stream_contents.append(stream_content)
+
+        for (stream_index, _), stream_content in zip(streams, stream_contents):
+            # includes the time spent waiting for the earlier streams of the track, to write in order.
+            with Instrumentation.span(rf_id, 'write') as span:
+                track_writer.write(stream_index, stream_content, abort_ev)
+                span.add_bytes(len(stream_content))
+
+    def _download_tracks_streaming(self, rf_id, tracks_info, download_dir, downloader, checker, progress_func):
+        """
+        Download the streams, decrypt them in memory and append to the track files in playlist order,
+        without creating any intermediate files.
+        Track writers journal the streams written, so an interrupted download resumes from the last stream written.
+        :return: list of track files, and the set of temporary files created.
+        """
+        max_pending = 4 * self.conf.get('download_workers', 4)
+        track_writers = [
+            TrackWriter(os.path.join(download_dir, 'track-{}.ts'.format(track_index)), max_pending)
+            for track_index in range(len(tracks_info))
+        ]
+
+        def pending(track_index, stream_index, item):     # noqa
+            return stream_index >= track_writers[track_index].completed()
+
+        downloads = list()
+        for track_index, streams in self._get_requests(tracks_info, pending):
+            downloads.append((streams[0][1].url, self._get_fetch(rf_id, streams), partial(
+                self._save_streams, rf_id, track_writers[track_index], checker, track_index, streams,
+                downloader.stop_ev), len(streams)))
+
+        num_streams = sum(len(track_info) for track_info in tracks_info)
+        completed = num_streams - sum(segments for _, _, _, segments in downloads)
+        self.logger.info("[{}]: Downloading {} streams in {} requests ..".format(
+            rf_id, num_streams - completed, len(downloads)))
+        try:
+            downloader.download_tasks(downloads, progress_func, completed=completed)
+        finally:
+            for track_writer in track_writers:
+                track_writer.close()
+
+        ts_files = [track_writer.filepath for track_writer in track_writers]
+        temp_files_to_delete = set(ts_files)
+        temp_files_to_delete.update([track_writer.journal_filepath for track_writer in track_writers])
+        return ts_files, temp_files_to_delete
+
+    def _download_tracks_piped(self, rf_id, tracks_info, download_dir, mkv_filepath, downloader, checker,
+                               progress_func):
+        """
+        Launch ffmpeg reading a named pipe per track, and feed the decrypted streams to the pipes in playlist order
+        as they are downloaded. Encoding completes shortly after the last stream is downloaded.
+        Nothing is kept on disk, so an interrupted download starts over.
+        :return: encode status, and the set of temporary files created.
+        """
+        max_pending = 4 * self.conf.get('download_workers', 4)
+        fifos = Encoder.create_fifos(download_dir, len(tracks_info))
+        process = Encoder.start_encode_mkv(rf_id, fifos, mkv_filepath, debug=self.conf.get('debug'),
+                                           priority=self.conf.get('external_process_priority'))
+        track_writers = [
+            PipedTrackWriter(fifo_path, max_pending, reader_alive=lambda: process.poll() is None)
+            for fifo_path in fifos
+        ]
+
+        downloads = list()
+        for track_index, streams in self._get_requests(tracks_info, lambda *args: True):
+            downloads.append((streams[0][1].url, self._get_fetch(rf_id, streams), partial(
+                self._save_streams, rf_id, track_writers[track_index], checker, track_index, streams,
+                downloader.stop_ev), len(streams)))
+
+        self.logger.info("[{}]: Downloading streams in {} requests ..".format(rf_id, len(downloads)))
+        completed = False
+        try:
+            downloader.download_tasks(downloads, progress_func)
+            completed = True
+        finally:
+            if not completed:
+                # kill ffmpeg first, the pipe writers may be blocked on a fifo it no longer reads.
+                flag = Encoder.finish_encode_mkv(rf_id, process, abort=True)
+            for track_writer in track_writers:
+                track_writer.close(abort=not completed)
+            if completed:
+                flag = Encoder.finish_encode_mkv(rf_id, process)
+            elif os.path.exists(mkv_filepath):
+                os.unlink(mkv_filepath)
+
+        for track_writer in track_writers:
+            if track_writer.error:
+                self.logger.error("[{}]: Error writing to {}: {}".format(
+                    rf_id, track_writer.filepath, track_writer.error))
+                flag = False
+
+        return flag, set(fifos)
+
+    def get_download_queue(self, state_filepath=None):
+        """
+        Queue for downloading lecture videos with this session, at most max_concurrent_downloads at a time.
+        """
+        return DownloadQueue(self.process_job, max_downloads=self.conf.get('max_concurrent_downloads', 2),
+                             state_filepath=state_filepath, logger=self.logger)
 
-                # delete temp files.
-                if not self.conf.get('debug'):
-                    Utils.delete_files(list(temp_files_to_delete))
-                    os.rmdir(download_dir)
-            return flag
+    def process_job(self, job: DownloadJob):
+        # the queue worker goes on to the next job once the video is downloaded, see download_video().
+        return self.download_video(job.video_metadata, job.filepath, job.pause_ev, job.resume_ev, job.progress_func,
+                                   job.quality)
 
-    def get_slides(self, subjects):
-        mappings = Config.load(ConfigType.MAPPINGS)
-        for subject in subjects:
-            root_url = Variables().login_url()
-            subject_id = subject.get('subjectId')
-            response = self.session.get('{}/api/subjects/backpack/{}/sessions/{}'.format(
-                root_url, subject_id, subject.get('sessionId')),
-                timeout=self.timeouts
-            )
-            if response.status_code == 200:
-                backpack_slides = response.json()
-                if backpack_slides:
-                    for backpack_slide in backpack_slides:
-                        backpack_slide['professorName'] = subject['professorName'].strip()
-                        backpack_slide['subjectName'] = subject['subjectName'].strip()
+    def get_catalog(self, subjects, videos: bool = True, documents: bool = True):
+        """
+        Fetch the lectures (regular and flipped) and backpack documents of all the subjects, with up to
+        catalog_workers requests in flight.
+        Yields (Catalog.VIDEOS, (video_id, video_metadata, is_flipped)) and
+        (Catalog.DOCUMENTS, (subject, documents)) items, in the order the responses arrive.
+        """
+        tasks = list()
+        if videos:
+            regular_video = RegularVideo(subjects, self.session, self.timeouts)
+            flipped_video = FlippedVideo(subjects, self.session, self.timeouts)
+            for subject in subjects:
+                tasks.append((Catalog.VIDEOS, partial(regular_video.get_subject_lectures, subject)))
+                tasks.append((Catalog.VIDEOS, partial(flipped_video.get_subject_lectures, subject)))
+        if documents:
+            mappings = Config.load(ConfigType.MAPPINGS)
+            for subject in subjects:
+                tasks.append((Catalog.DOCUMENTS, partial(self._get_subject_slides, subject, mappings)))
+
+        for kind, result in Catalog(self.conf.get('catalog_workers', 5)).fetch(tasks):
+            if kind == Catalog.VIDEOS:
+                for video in result:
+                    yield kind, video
+            elif result:
+                yield kind, result
+        self.logger.info('api response cache: {}'.format(self.get_cache_stats()))
 
-                        backpack_slide['subjectNameShort'] = backpack_slide['subjectName']
-                        if mappings.get(subject['subjectName']):
-                            backpack_slide['subjectNameShort'] = mappings.get(backpack_slide['subjectName'])
-                        backpack_slide['ext'] = backpack_slide['filePath'].split('.')[-1]
-                        pattern = r'.{}$'.format(re.escape(backpack_slide['ext']))
-                        backpack_slide['fileName'] = re.sub(pattern, '', backpack_slide['fileName'])
+    def get_slides(self, subjects):
+        for _, subject_slides in self.get_catalog(subjects, videos=False):
+            yield subject_slides
 
-                    yield subject, backpack_slides
+    def _get_subject_slides(self, subject, mappings):
+        root_url = Variables().login_url()
+        subject_id = subject.get('subjectId')
+        response = self.session.get('{}/api/subjects/backpack/{}/sessions/{}'.format(
+            root_url, subject_id, subject.get('sessionId')),
+            timeout=self.timeouts
+        )
+        if response.status_code == 200:
+            backpack_slides = response.json()
+            if backpack_slides:
+                return subject, self.parse_slides(subject, backpack_slides, mappings)
+
+    @staticmethod
+    def parse_slides(subject, backpack_slides, mappings):
+        for backpack_slide in backpack_slides:
+            backpack_slide['professorName'] = subject['professorName'].strip()
+            backpack_slide['subjectName'] = subject['subjectName'].strip()
+
+            backpack_slide['subjectNameShort'] = backpack_slide['subjectName']
+            if mappings.get(subject['subjectName']):
+                backpack_slide['subjectNameShort'] = mappings.get(backpack_slide['subjectName'])
+            backpack_slide['ext'] = backpack_slide['filePath'].split('.')[-1]
+            pattern = r'.{}$'.format(re.escape(backpack_slide['ext']))
+            backpack_slide['fileName'] = re.sub(pattern, '', backpack_slide['fileName'])
+        return backpack_slides
 
     def get_subjects(self):
         root_url = Variables().login_url()
@@ -252,31 +769,36 @@ class Impartus:
 
     def _get_session_with_retry(self):
         session = requests.Session()
-        retries = Retry(
-            total=self.conf.get('max_retries', 3),  # number of retries
-            backoff_factor=1.0,                     # retry after 1.0, 2.0, 3.0 ... seconds
-            status_forcelist=[
-                # 4xx
-                HTTPStatus.REQUEST_TIMEOUT,
-                HTTPStatus.TOO_MANY_REQUESTS,
-
-                # 5xx
-                HTTPStatus.INTERNAL_SERVER_ERROR,
-                HTTPStatus.BAD_GATEWAY,
-                HTTPStatus.SERVICE_UNAVAILABLE,
-                HTTPStatus.GATEWAY_TIMEOUT,
-            ])
+        retries = get_retry(self.conf)
 
         adapter_options = {
             'pool_connections': self.conf.get('pool_connections', 5),
-            'pool_maxsize': self.conf.get('pool_maxsize', 5),
+            # catalog requests are made concurrently over this session.
+            'pool_maxsize': max(self.conf.get('pool_maxsize', 5), self.conf.get('catalog_workers', 5)),
             'max_retries': retries,
         }
 
         # retry/timeout only for impartus site.
-        session.mount(Variables().login_url(), HTTPAdapter(**adapter_options))
+        if self.conf.get('http_cache', True):
+            if Impartus.response_cache is None:
+                Impartus.response_cache = ResponseCache(
+                    os.path.join(Utils.get_config_dir(), 'http_cache'), ttl=self.conf.get('http_cache_ttl', 300),
+                    max_size=self.conf.get('http_cache_max_size', 0),
+                    max_age=self.conf.get('http_cache_max_age', 0) * 86400)
+                Impartus.response_cache.prune()
+            adapter = CachingHTTPAdapter(Impartus.response_cache, self.conf.get('http_cache_urls', []),
+                                         user=Variables().login_email(), **adapter_options)
+        else:
+            adapter = HTTPAdapter(**adapter_options)
+        session.mount(Variables().login_url(), adapter)
         return session
 
+    def get_cache_stats(self):
+        """
+        Hit / miss counters of the api response cache.
+        """
+        return Impartus.response_cache.get_stats() if Impartus.response_cache else {}
+
     def login(self):
         root_url = Variables().login_url()
         username = Variables().login_email()
@@ -292,6 +814,7 @@ class Impartus:
         response = self.session.post(url, json=data, timeout=self.timeouts)
         if response.status_code == 200:
             self.token = response.json()['token']
+            self.media.set_token(self.token)
             self.session.cookies.update({'Bearer': self.token})
             self.session.headers.update({'Authorization': 'Bearer {}'.format(self.token)})
             return True
@@ -303,6 +826,7 @@ class Impartus:
     def logout(self):
         self.session = None
         self.token = None
+        self.media.set_token(None)
         self.logger.info('Logged out from impartus!.')
         # Really Impartus? No server api to logout ?
         pass
@@ -311,9 +835,30 @@ class Impartus:
         return True if self.session else False
 
     def get_lecture_videos(self, subjects):
-        yield from RegularVideo(subjects, self.session, self.timeouts).get_lectures()
-        yield from FlippedVideo(subjects, self.session, self.timeouts).get_lectures()
+        for _, video in self.get_catalog(subjects, documents=False):
+            yield video
 
     def download_slides(self, file_url, filepath):
-        return BackpackSlides(self.token, self.timeouts, self.logger, self.conf)\
-            .download_slides(file_url, filepath)
+        return self.backpack_slides.download_slides(file_url, filepath)
+
+    def download_documents(self, documents, target_dir=None, finished_func=None):
+        """
+        Download the documents (of a subject) not already on disk, document_workers at a time.
+        :param documents: list of document metadata, as returned by get_slides().
+        :param target_dir: directory to save the documents in, default is the documents_path from config.
+        :param finished_func: called with (file_url, filepath, status) as each download finishes.
+        :return: dict of filepath -> download status, for the documents downloaded.
+        """
+        items = list()
+        for document in documents:
+            if not document.get('filePath'):
+                continue
+            filepath = Utils.get_documents_path(document)
+            if target_dir:
+                filepath = os.path.join(target_dir, os.path.basename(filepath))
+            if not Utils.slides_exist_on_disk(filepath)[0]:
+                items.append(('{}/{}'.format(Variables().login_url(), document['filePath']), filepath))
+
+        self.logger.info('Downloading {} of {} documents.'.format(len(items), len(documents)))
+        return self.backpack_slides.download_batch(items, workers=self.conf.get('document_workers', 4),
+                                                   finished_func=finished_func)
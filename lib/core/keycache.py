@@ -0,0 +1,156 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable
+
+from Crypto.Cipher import AES   # noqa
+
+
+class KeyCache:
+    """
+    Process wide cache of the media encryption keys, by key id.
+
+    Fetching is single-flight: concurrent requests for a key not in the cache wait for the first request to fetch
+    it, instead of each making its own http call.
+    If a filepath and secret are given, the keys are saved to the file, encrypted with AES-GCM using a key derived
+    from the secret, so they survive restarts / resumed downloads. A file that can not be decrypted with the secret
+    (say the password changed) is discarded.
+    """
+
+    # PBKDF2 iterations, for deriving the file encryption key from the secret.
+    kdf_iterations = 100000
+
+    def __init__(self, filepath: str = None, secret: str = None, logger=None):
+        """
+        :param filepath: file to persist the keys in, keys are kept in memory only if None.
+        :param secret: secret to derive the file encryption key from, keys are kept in memory only if None.
+        :param logger: logger for the errors saving the file.
+        """
+        self.filepath = filepath if secret else None
+        self.secret = secret
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = Lock()
+        self.keys = dict()
+        self.in_flight = dict()
+        self.salt = None
+        self.file_key = None    # derived from the secret and salt, once.
+        self.save_lock = Lock()
+        self.stats = {
+            'hits': 0,              # served from the cache.
+            'shared': 0,            # waited for a fetch in flight.
+            'fetches': 0,           # fetched from the key url.
+            'fetch_seconds': 0.0,   # total / max time taken by the fetches.
+            'max_fetch_seconds': 0.0,
+        }
+        if self.filepath:
+            self._load()
+
+    def _get_cipher(self, nonce: bytes = None):
+        if self.file_key is None:
+            self.file_key = hashlib.pbkdf2_hmac('sha256', self.secret.encode('utf-8'), self.salt, self.kdf_iterations)
+        return AES.new(self.file_key, AES.MODE_GCM, nonce=nonce)
+
+    def _load(self):
+        try:
+            with open(self.filepath, 'r') as fh:
+                data = json.load(fh)
+            self.salt = base64.b64decode(data['salt'])
+            payload = base64.b64decode(data['keys'])
+            nonce, tag, ciphertext = payload[:16], payload[16:32], payload[32:]
+            keys = json.loads(self._get_cipher(nonce).decrypt_and_verify(ciphertext, tag))
+            self.keys = {key_id: bytes.fromhex(key) for key_id, key in keys.items()}
+        except (OSError, ValueError, KeyError):
+            self.salt = None
+            self.file_key = None
+            self.keys = dict()
+
+    def _save(self):
+        """
+        Write the keys to the file, outside of self.lock: writes are serialized by save_lock, each writing the
+        keys at the time it gets to run, so an older set of keys never overwrites a newer one.
+        """
+        with self.save_lock:
+            with self.lock:
+                keys = dict(self.keys)
+            if self.salt is None:
+                self.salt = os.urandom(16)
+                self.file_key = None
+            self._write(keys)
+
+    def _write(self, keys):
+        plaintext = json.dumps({key_id: key.hex() for key_id, key in keys.items()}).encode('utf-8')
+        cipher = self._get_cipher()
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+        data = {
+            'salt': base64.b64encode(self.salt).decode('ascii'),
+            'keys': base64.b64encode(cipher.nonce + tag + ciphertext).decode('ascii'),
+        }
+        os.makedirs(os.path.dirname(self.filepath) or '.', exist_ok=True)
+        tmp_filepath = '{}.{}.tmp'.format(self.filepath, os.getpid())
+        with open(os.open(tmp_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as fh:
+            json.dump(data, fh)
+        os.replace(tmp_filepath, self.filepath)
+
+    def get(self, key_id, fetch_func: Callable[[], bytes]):
+        """
+        Key for the key id, calling fetch_func() to fetch it if not in the cache, or already being fetched.
+        :param key_id: id of the key.
+        :param fetch_func: returns the key bytes, exceptions raised are raised to all the waiting callers.
+        """
+        key_id = str(key_id)
+        with self.lock:
+            if key_id in self.keys:
+                self.stats['hits'] += 1
+                return self.keys[key_id]
+            future = self.in_flight.get(key_id)
+            waiting = future is not None
+            if waiting:
+                self.stats['shared'] += 1
+            else:
+                future = Future()
+                self.in_flight[key_id] = future
+        if waiting:
+            return future.result()
+
+        start = time.monotonic()
+        try:
+            key = fetch_func()
+        except BaseException as ex:
+            with self.lock:
+                del self.in_flight[key_id]
+            future.set_exception(ex)
+            raise
+
+        elapsed = time.monotonic() - start
+        with self.lock:
+            self.keys[key_id] = key
+            del self.in_flight[key_id]
+            self.stats['fetches'] += 1
+            self.stats['fetch_seconds'] += elapsed
+            self.stats['max_fetch_seconds'] = max(self.stats['max_fetch_seconds'], elapsed)
+        future.set_result(key)
+
+        # the key is served from memory whether or not it gets saved.
+        if self.filepath:
+            try:
+                self._save()
+            except (OSError, ValueError) as ex:
+                self.logger.warning('Error saving the encryption keys to {}: {}'.format(self.filepath, ex))
+        return key
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['mean_fetch_seconds'] = stats['fetch_seconds'] / stats['fetches'] if stats['fetches'] else 0.0
+        return stats
+
+    def clear(self):
+        with self.save_lock, self.lock:
+            self.keys = dict()
+            if self.filepath and os.path.exists(self.filepath):
+                os.remove(self.filepath)
@@ -0,0 +1,234 @@
+import os
+import re
+from http import HTTPStatus
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# http status codes worth a retry.
+RETRY_STATUSES = [
+    # 4xx
+    HTTPStatus.REQUEST_TIMEOUT,
+    HTTPStatus.TOO_MANY_REQUESTS,
+
+    # 5xx
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+]
+
+
+class IncompleteDownloadError(requests.exceptions.ConnectionError):
+    """
+    Connection closed before the whole body was received, the partial file is kept to resume from.
+    """
+    pass
+
+
+def get_retry(conf, **kwargs):
+    """
+    Retry policy for the requests made to impartus site and the media hosts.
+    """
+    return Retry(
+        total=conf.get('max_retries', 3),      # number of retries
+        backoff_factor=1.0,                     # retry right away, then after 2.0, 4.0, 8.0 ... seconds
+        status_forcelist=RETRY_STATUSES,
+        **kwargs)
+
+
+def get_backoff_time(retry: Retry, retries: int):
+    """
+    Seconds urllib3 waits before retry number [retries] (1 based) with the retry policy, for the requests made
+    outside of urllib3 (see AsyncImpartus).
+    """
+    if retries <= 1:
+        return 0
+    backoff_max = getattr(retry, 'backoff_max', getattr(Retry, 'BACKOFF_MAX', 120))
+    return max(0, min(backoff_max, retry.backoff_factor * (2 ** (retries - 1))))
+
+
+class TransportStats:
+    """
+    Thread safe counters for the requests made, and the connections opened by a transport.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def request_made(self):
+        with self.lock:
+            self.requests += 1
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections_opened += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'connections_opened': self.connections_opened,
+                'connections_reused': max(0, self.requests - self.connections_opened),
+            }
+
+
+class _CountingPoolMixin:
+    """
+    Mixin for urllib3 connection pools, to count new connections vs. requests served.
+    """
+    stats = None
+
+    def _new_conn(self):
+        self.stats.connection_opened()
+        return super()._new_conn()  # noqa
+
+    def _make_request(self, *args, **kwargs):
+        self.stats.request_made()
+        return super()._make_request(*args, **kwargs)  # noqa
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that records the connections opened and reused across all of its host pools.
+    """
+
+    def __init__(self, stats: TransportStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: type(pool_class.__name__, (_CountingPoolMixin, pool_class), {'stats': self.stats})
+            for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+
+class MediaTransport:
+    """
+    Http transport for media content - streams, encryption keys and documents.
+    Owns a pool of keep-alive connections per host (impartus site as well as the cdn hosts serving the media),
+    and retries failed requests with a backoff.
+    """
+
+    def __init__(self, conf, timeouts, token=None):
+        self.conf = conf
+        self.timeouts = timeouts
+        self.token = token
+        self.stats = TransportStats()
+
+        # pool_connections: number of hosts to keep a pool for, pool_maxsize: connections kept per host.
+        # size the pools to at least the number of concurrent downloads, so the connections do get reused.
+        pool_maxsize = max(conf.get('pool_maxsize', 5), conf.get('download_workers', 4),
+                           conf.get('document_workers', 4))
+        adapter = CountingHTTPAdapter(
+            self.stats,
+            pool_connections=conf.get('pool_connections', 5),
+            pool_maxsize=pool_maxsize,
+            max_retries=get_retry(conf, raise_on_status=False),
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def set_token(self, token):
+        self.token = token
+
+    def _auth_headers(self):
+        return {
+            'Authorization': 'Bearer {}'.format(self.token),
+            'Cookie': 'Bearer={}'.format(self.token),
+        }
+
+    def get(self, url, authenticated=False, headers=None, **kwargs):
+        """
+        GET a url using the pooled session.
+        :param url: url to fetch.
+        :param authenticated: send the auth token along with the request, media hosts other than impartus
+        site do not need it.
+        :param headers: any additional headers.
+        """
+        request_headers = dict()
+        if authenticated and self.token:
+            request_headers.update(self._auth_headers())
+        if headers:
+            request_headers.update(headers)
+        kwargs.setdefault('timeout', self.timeouts)
+        return self.session.get(url, headers=request_headers, **kwargs)
+
+    @staticmethod
+    def _get_content_range(response: requests.Response):
+        """
+        :return: (offset of the first byte in the response, full length of the content or None if not known)
+        """
+        if response.status_code == HTTPStatus.PARTIAL_CONTENT:
+            match = re.match(r'bytes\s+(\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+            if match:
+                return int(match.group(1)), int(match.group(2)) if match.group(2).isdigit() else None
+            return None, None
+        content_length = response.headers.get('Content-Length')
+        return 0, int(content_length) if content_length and content_length.isdigit() else None
+
+    def download_to_file(self, url, filepath, authenticated=False, chunk_size=1 << 16):
+        """
+        Download a url to a file, streaming the content to <filepath>.part and moving it to filepath once the
+        length received matches the Content-Length. A .part file left by an interrupted download is continued
+        with a Range request, or started over if the server does not support ranges.
+        :param url: url to fetch.
+        :param filepath: file to save the content to.
+        :param authenticated: send the auth token along with the request.
+        :param chunk_size: size of the chunks read from the connection.
+        :return: response, the file is complete if response.ok, the response body is available otherwise.
+        :raise IncompleteDownloadError: if the connection was closed early.
+        """
+        part_filepath = '{}.part'.format(filepath)
+        offset = os.path.getsize(part_filepath) if os.path.exists(part_filepath) else 0
+
+        # no content-encoding, so the ranges and lengths are of the bytes saved.
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+
+        with self.get(url, authenticated=authenticated, headers=headers, stream=True) as response:
+            if response.status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE and offset:
+                # the .part file is not a prefix of the content, start over.
+                os.remove(part_filepath)
+                return self.download_to_file(url, filepath, authenticated, chunk_size)
+            if not response.ok:
+                response.content    # noqa, read the body, for the caller to log.
+                return response
+
+            # a 200 response (server ignored the range request) has the whole content.
+            start, total_length = self._get_content_range(response)
+            if start != offset:
+                if start != 0:
+                    # not the range asked for, start over.
+                    os.remove(part_filepath)
+                    return self.download_to_file(url, filepath, authenticated, chunk_size)
+                offset = 0
+            with open(part_filepath, 'ab' if offset else 'wb') as fh:
+                for chunk in response.iter_content(chunk_size):
+                    fh.write(chunk)
+                length = fh.tell()
+
+        if total_length is not None and length != total_length:
+            raise IncompleteDownloadError('Received {} of {} bytes for {}'.format(length, total_length, url))
+        os.replace(part_filepath, filepath)
+        return response
+
+    @staticmethod
+    def get_retries(response: requests.Response):
+        """
+        Number of retries made (by urllib3) before the response was received.
+        """
+        retries = getattr(response.raw, 'retries', None)
+        return len(retries.history) if retries else 0
+
+    def get_stats(self):
+        return self.stats.as_dict()
@@ -9,16 +9,25 @@ class RegularVideo(Video):
         super().__init__(subjects, session, timeouts)
 
     def get_lectures(self):
-        root_url = Variables().login_url()
         for subject in self.subjects:
-            response = self.session.get('{}/api/subjects/{}/lectures/{}'.format(
-                root_url, subject.get('subjectId'), subject.get('sessionId')),
-                timeout=self.timeouts
-            )
+            yield from self.get_subject_lectures(subject)
+
+    def get_subject_lectures(self, subject):
+        root_url = Variables().login_url()
+        response = self.session.get('{}/api/subjects/{}/lectures/{}'.format(
+            root_url, subject.get('subjectId'), subject.get('sessionId')),
+            timeout=self.timeouts
+        )
+
+        if response.status_code == 200:
+            return self.parse_lectures(response.json())
+        return []
 
-            if response.status_code == 200:
-                videos_by_subject = response.json()
-                for video_metadata in videos_by_subject:
-                    video_id = video_metadata['ttid']
-                    is_flipped = False
-                    yield video_id, MetadataDictParser.add_new_fields(video_metadata), is_flipped
+    @staticmethod
+    def parse_lectures(videos_by_subject):
+        lectures = list()
+        for video_metadata in videos_by_subject:
+            video_id = video_metadata['ttid']
+            is_flipped = False
+            lectures.append((video_id, MetadataDictParser.add_new_fields(video_metadata), is_flipped))
+        return lectures
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from threading import Lock
+from typing import Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib.parse import urlparse
+
+
+class ResponseCache:
+    """
+    On disk cache of http response bodies, one <key>.json (status, headers, time stored) and <key>.body file
+    per url and user. Entries not saved / revalidated for max_age seconds are pruned, as are the least recently
+    saved ones beyond max_size bytes, see prune().
+    """
+
+    # response headers saved with the body, the body is saved decoded, so content-encoding/length are not.
+    saved_headers = ['content-type', 'etag', 'last-modified', 'date']
+
+    def __init__(self, cache_dir: str, ttl: float = 300, max_size: int = 0, max_age: float = 0):
+        """
+        :param cache_dir: directory to save the responses in.
+        :param ttl: seconds a response without an ETag / Last-Modified header is served from the cache, without
+        making a request.
+        :param max_size: total size in bytes of the entries kept by prune(), 0 for no limit.
+        :param max_age: seconds an entry is kept for since it was last saved / revalidated, 0 for no limit.
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = Lock()
+        self.stats = {
+            'hits': 0,              # served from the cache, without a request.
+            'revalidated': 0,       # served from the cache after a 304 response.
+            'misses': 0,            # full response from the server.
+        }
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(request: requests.PreparedRequest, user: str = None):
+        """
+        Cache key for the request. Responses are per user: keyed on the user (login email), which stays the same
+        across logins / token refreshes, or on the auth header if the user is not known.
+        """
+        if user:
+            key = '{} user:{}'.format(request.url, user)
+        else:
+            key = '{} {}'.format(request.url, request.headers.get('Authorization', ''))
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _filepaths(self, key: str):
+        return os.path.join(self.cache_dir, '{}.json'.format(key)), os.path.join(self.cache_dir, '{}.body'.format(key))
+
+    def count(self, name: str):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def load(self, key: str):
+        """
+        :return: (entry, body) for the key, (None, None) if not cached.
+        """
+        meta_filepath, body_filepath = self._filepaths(key)
+        try:
+            with open(meta_filepath, 'r') as fh:
+                entry = json.load(fh)
+            with open(body_filepath, 'rb') as fh:
+                body = fh.read()
+        except (OSError, ValueError):
+            return None, None
+        if len(body) != entry.get('length'):
+            return None, None
+        return entry, body
+
+    @staticmethod
+    def _write(filepath: str, data, mode: str):
+        # the cache is shared by the worker threads, a tmp file per thread so concurrent writes do not collide.
+        tmp_filepath = '{}.{}.{}.tmp'.format(filepath, os.getpid(), threading.get_ident())
+        with open(tmp_filepath, mode) as fh:
+            fh.write(data)
+        os.replace(tmp_filepath, filepath)
+
+    def save(self, key: str, response: requests.Response, body: bytes = None):
+        """
+        Save the response, or just refresh the time stored / validators if the body is given (304 response).
+        """
+        meta_filepath, body_filepath = self._filepaths(key)
+        if body is None:
+            body = response.content
+            self._write(body_filepath, body, 'wb')
+        headers = {name: response.headers[name] for name in self.saved_headers if name in response.headers}
+        entry = {
+            'url': response.url,
+            'status': 200,
+            'headers': headers,
+            'length': len(body),
+            'stored_at': time.time(),
+        }
+        self._write(meta_filepath, json.dumps(entry), 'w')
+
+    def is_fresh(self, entry: Dict):
+        return time.time() - entry['stored_at'] < self.ttl
+
+    @staticmethod
+    def has_validators(entry: Dict):
+        return 'etag' in entry['headers'] or 'last-modified' in entry['headers']
+
+    def prune(self):
+        """
+        Delete the entries older than max_age, then the least recently saved ones till the cache is within
+        max_size. Left over tmp files are deleted too.
+        :return: number of entries deleted.
+        """
+        entries = dict()    # key -> [mtime of the .json, total size]
+        now = time.time()
+        for filename in os.listdir(self.cache_dir):
+            filepath = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            if filename.endswith('.tmp'):
+                # written by a process / thread that did not get to finish.
+                if now - stat.st_mtime > 3600:
+                    self._remove([filepath])
+                continue
+            key, ext = os.path.splitext(filename)
+            if ext not in ['.json', '.body']:
+                continue
+            entry = entries.setdefault(key, [0, 0])
+            entry[1] += stat.st_size
+            if ext == '.json':
+                entry[0] = stat.st_mtime
+
+        deleted = 0
+        total_size = sum(size for _, size in entries.values())
+        for key, (mtime, size) in sorted(entries.items(), key=lambda x: x[1][0]):
+            expired = self.max_age and now - mtime > self.max_age
+            if not expired and (not self.max_size or total_size <= self.max_size):
+                break
+            self._remove(self._filepaths(key))
+            total_size -= size
+            deleted += 1
+        return deleted
+
+    @staticmethod
+    def _remove(filepaths):
+        for filepath in filepaths:
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+
+    def clear(self):
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.json') or filename.endswith('.body'):
+                os.remove(os.path.join(self.cache_dir, filename))
+
+
+class CachingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter serving GET requests for the matching urls from a ResponseCache.
+
+    Cached responses with an ETag / Last-Modified header are revalidated with a conditional request on every use,
+    a 304 response is served from the cache. Cached responses without validators are served as is, till they are
+    older than the cache ttl.
+    """
+
+    def __init__(self, cache: ResponseCache, url_patterns: List[str], user: str = None, **kwargs):
+        """
+        :param cache: cache to save the responses in.
+        :param url_patterns: regular expressions, matched against the url path, of the cacheable urls.
+        :param user: user the responses are for (login email), see ResponseCache.get_key().
+        """
+        self.cache = cache
+        self.user = user
+        self.url_patterns = [re.compile(pattern) for pattern in url_patterns]
+        super().__init__(**kwargs)
+
+    def is_cacheable(self, request: requests.PreparedRequest):
+        if request.method != 'GET':
+            return False
+        path = urlparse(request.url).path
+        return any(pattern.search(path) for pattern in self.url_patterns)
+
+    def _build_response(self, request: requests.PreparedRequest, entry: Dict, body: bytes):
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response._content = body
+        response.from_cache = True
+        return response
+
+    def send(self, request: requests.PreparedRequest, **kwargs):
+        if not self.is_cacheable(request):
+            return super().send(request, **kwargs)
+
+        key = self.cache.get_key(request, self.user)
+        entry, body = self.cache.load(key)
+        if entry and not self.cache.has_validators(entry) and self.cache.is_fresh(entry):
+            self.cache.count('hits')
+            return self._build_response(request, entry, body)
+
+        if entry and self.cache.has_validators(entry):
+            request = request.copy()
+            if 'etag' in entry['headers']:
+                request.headers['If-None-Match'] = entry['headers']['etag']
+            if 'last-modified' in entry['headers']:
+                request.headers['If-Modified-Since'] = entry['headers']['last-modified']
+
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and entry:
+            response.close()
+            self.cache.count('revalidated')
+            # the 304 response may carry updated validators.
+            for name in ['etag', 'last-modified', 'date']:
+                if name in response.headers:
+                    entry['headers'][name] = response.headers[name]
+            response.headers = CaseInsensitiveDict(entry['headers'])
+            self.cache.save(key, response, body)
+            return self._build_response(request, entry, body)
+
+        self.cache.count('misses')
+        if response.status_code == 200 and 'no-store' not in response.headers.get('cache-control', ''):
+            self.cache.save(key, response)
+        return response
@@ -0,0 +1,131 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Event
+from typing import Callable, List, Tuple
+
+from requests.exceptions import ChunkedEncodingError, ConnectTimeout, ConnectionError, Timeout
+
+from lib.instrumentation import Instrumentation
+
+
+class InvalidContentError(RuntimeError):
+    """
+    Raised by a save function for content failing its checks, to have it fetched again.
+    """
+    pass
+
+
+class SegmentDownloader:
+    """
+    Download media segments using a bounded pool of worker threads, see download_tasks().
+    The contents of each request are handed over to a save function, see save_to_file() for the simplest one,
+    or written straight to a file by the fetch callable.
+    """
+
+    def __init__(self, logger, workers: int = 4, retry_wait: float = 10,
+                 pause_ev: Event = None, resume_ev: Event = None, rf_id=None, limiter=None):
+        """
+        :param logger: logger object.
+        :param workers: max number of segments to be downloaded concurrently.
+        :param retry_wait: wait time in seconds before retrying a failed download.
+        :param pause_ev: when set, workers stop picking up new downloads ...
+        :param resume_ev: ... until this event is set.
+        :param rf_id: ttid / fcid of the video, used for logging.
+        :param limiter: FairLimiter shared across the videos being downloaded, to limit the total number of
+        requests in flight.
+        """
+        self.logger = logger
+        self.workers = max(1, int(workers))
+        self.retry_wait = retry_wait
+        self.pause_ev = pause_ev
+        self.resume_ev = resume_ev
+        self.rf_id = rf_id
+        self.limiter = limiter
+
+        # set when the download is cancelled, running workers give up on their retries.
+        self.stop_ev = Event()
+
+    def _wait_if_paused(self):
+        # pause / resume events are toggled together by the ui, so there is no need to clear
+        # resume_ev here, and all the workers waiting on it get to resume.
+        if self.pause_ev and self.pause_ev.is_set():
+            self.logger.info("[{}]: Pausing download.".format(self.rf_id))
+            self.resume_ev.wait()
+            self.logger.info("[{}]: Resuming download.".format(self.rf_id))
+
+    def _download(self, url: str, fetch: Callable, save_func: Callable = None):
+        while not self.stop_ev.is_set():
+            self._wait_if_paused()
+            try:
+                if self.limiter:
+                    # time spent waiting for a slot, while the requests of the other videos are in flight.
+                    with Instrumentation.span(self.rf_id, 'slot_wait'):
+                        self.limiter.acquire(self.rf_id)
+                    try:
+                        content = fetch()
+                    finally:
+                        self.limiter.release(self.rf_id)
+                else:
+                    content = fetch()
+            except (ConnectionError, Timeout, ConnectTimeout, ChunkedEncodingError):
+                self.logger.warning("[{}]: Timeout error. retrying download for {}...".format(self.rf_id, url))
+                Instrumentation.add_retries(self.rf_id, 'fetch')
+                self.stop_ev.wait(self.retry_wait)
+                continue
+            if save_func is None:
+                return content
+            try:
+                return save_func(content)
+            except InvalidContentError as ex:
+                self.logger.warning("[{}]: {}, retrying download for {}...".format(self.rf_id, ex, url))
+                Instrumentation.add_retries(self.rf_id, 'fetch')
+                self.stop_ev.wait(self.retry_wait)
+
+    @staticmethod
+    def is_downloaded(filepath: str):
+        # files written through a <filepath>.part file (save_to_file(), MediaTransport.download_to_file()) appear
+        # only once complete.
+        return os.path.exists(filepath) and os.path.getsize(filepath) > 0
+
+    @staticmethod
+    def save_to_file(filepath: str, content: bytes):
+        # through a .part file, so that is_downloaded() is not fooled by a file truncated by a crash.
+        part_filepath = '{}.part'.format(filepath)
+        with open(part_filepath, 'wb') as fh:
+            fh.write(content)
+        os.replace(part_filepath, filepath)
+
+    def download_tasks(self, tasks: List[Tuple[str, Callable, Callable, int]], progress_func: Callable = None,
+                       completed: int = 0):
+        """
+        Run the (url, fetch, save_func, segments) tasks, workers at a time. fetch() returns the content, which is
+        handed to save_func(content), called from the worker thread. fetch() is retried on connection errors / timeouts,
+        and when save_func raises InvalidContentError.
+        progress_func is called from the calling thread with the number of segments available so far,
+        so the values it receives are always increasing.
+        :param tasks: list of (url for logging, fetch callable, save_func or None, number of segments) tuples.
+        :param progress_func: progress callback, with the number of segments available so far.
+        :param completed: number of segments already available from an earlier run.
+        """
+        if progress_func and completed:
+            progress_func(completed)
+
+        if not tasks:
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._download, url, fetch, save_func): segments
+                       for url, fetch, save_func, segments in tasks}
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    completed += futures[future]
+                    if progress_func:
+                        progress_func(completed)
+            except BaseException:
+                # stop everything that has not started yet, and let the running ones finish.
+                self.stop_ev.set()
+                for future in futures:
+                    future.cancel()
+                raise
+        return True
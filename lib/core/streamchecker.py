@@ -0,0 +1,102 @@
+from threading import Lock
+
+from lib.core.segmentdownloader import InvalidContentError
+from lib.instrumentation import Instrumentation
+from lib.media.tsscanner import InvalidStreamError, TsInfo, TsScanner
+
+
+class StreamChecker:
+    """
+    Checks the streams of a video as they are downloaded, before they are written to the tracks:
+    MPEG-TS data (validate_streams), with timestamps covering the segment duration of the playlist
+    (check_track_durations). A stream failing the checks is fetched again, up to stream_refetches times, and then
+    kept with a warning, or fails the download if it is still not TS data and invalid_streams is 'fail'.
+    The scans of the streams are kept, to check the duration of the tracks once downloaded.
+    """
+
+    def __init__(self, conf, tracks_info, logger, rf_id=None):
+        """
+        :param conf: impartus config.
+        :param tracks_info: list of segments per track, from M3u8Parser.
+        :param logger: logger object.
+        :param rf_id: ttid / fcid of the video, used for logging.
+        """
+        self.logger = logger
+        self.rf_id = rf_id
+        self.validate_streams = conf.get('validate_streams', True)
+        self.check_durations = conf.get('check_track_durations', True)
+        self.segment_tolerance = conf.get('segment_duration_tolerance', 2)
+        self.track_tolerance = conf.get('track_duration_tolerance', 10)
+        self.refetches = conf.get('stream_refetches', 2)
+        self.fail_invalid = conf.get('invalid_streams', 'warn') == 'fail'
+
+        # scan of each stream, None for the streams not downloaded in this run.
+        self.scans = [[None] * len(track_info) for track_info in tracks_info]
+        # (track_index, stream_index) -> number of times the stream failed the checks.
+        self.failures = dict()
+        self.lock = Lock()
+
+    def enabled(self):
+        return self.validate_streams or self.check_durations
+
+    def _get_problem(self, item, info: TsInfo):
+        if self.validate_streams and not info.is_valid():
+            return 'not a valid TS stream: {}'.format(info)
+        if self.check_durations:
+            duration = info.duration()
+            if duration is None:
+                return 'no timestamps found'
+            if item.duration and duration < item.duration - self.segment_tolerance:
+                return 'timestamps cover {:.1f}s of the {}s in the playlist'.format(duration, item.duration)
+        return None
+
+    def check(self, track_index, stream_index, item, content=None, filepath=None):
+        """
+        Scan a downloaded (decrypted) stream, given its content or its file.
+        :raise InvalidContentError: to have the stream fetched again, see SegmentDownloader.
+        :raise InvalidStreamError: if the stream is still not TS data after the re-fetches, and invalid_streams
+        is 'fail'.
+        """
+        if not self.enabled():
+            return
+        with Instrumentation.span(self.rf_id, 'validate') as span:
+            info = TsScanner.scan_bytes(content) if filepath is None else TsScanner.scan_file(filepath)
+            span.add_bytes(info.packets * TsScanner.packet_size + info.trailing_bytes)
+        self.scans[track_index][stream_index] = info
+
+        problem = self._get_problem(item, info)
+        if problem is None:
+            return
+        with self.lock:
+            failures = self.failures.get((track_index, stream_index), 0)
+            self.failures[(track_index, stream_index)] = failures + 1
+        if failures < self.refetches:
+            raise InvalidContentError('{}: {}'.format(item.url, problem))
+        if self.fail_invalid and not info.is_valid():
+            raise InvalidStreamError('{}: {}'.format(item.url, problem))
+        self.logger.warning("[{}]: Keeping stream {} of track {} after {} re-fetches - {}".format(
+            self.rf_id, stream_index, track_index, failures, problem))
+
+    def check_track_durations(self, duration):
+        """
+        Log the duration of the tracks (from the timestamps of the streams), warn if it is off from the lecture
+        duration by more than track_duration_tolerance seconds.
+        Tracks with streams downloaded by an earlier run are not checked, those streams were not scanned.
+        """
+        if not self.check_durations:
+            return
+        for track_index, scans in enumerate(self.scans):
+            if not scans or any(scan is None for scan in scans):
+                self.logger.debug("[{}]: Track {} resumed, not checking its duration.".format(self.rf_id, track_index))
+                continue
+            info = TsInfo()
+            for scan in scans:
+                info.merge(scan)
+            track_duration = info.duration()
+            if track_duration is None:
+                self.logger.warning("[{}]: No timestamps found in track {}.".format(self.rf_id, track_index))
+            elif abs(track_duration - duration) > self.track_tolerance:
+                self.logger.warning("[{}]: Track {} is {:.1f}s long, lecture duration is {}s.".format(
+                    self.rf_id, track_index, track_duration, duration))
+            else:
+                self.logger.debug("[{}]: Track {} is {:.1f}s long.".format(self.rf_id, track_index, track_duration))
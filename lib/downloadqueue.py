@@ -0,0 +1,291 @@
+import enum
+import heapq
+import json
+import os
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import partial
+from itertools import count
+from threading import Condition, Event, Thread
+from typing import Callable, Dict
+
+
+class FairLimiter:
+    """
+    Limits the number of concurrent operations (segment requests) across all the lectures being downloaded.
+    When several lectures are waiting for a slot, the slot goes to the lecture with the fewest operations in
+    flight, so a lecture with thousands of segments cannot starve the others.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self.condition = Condition()
+        self.in_flight = dict()     # owner -> operations in flight.
+        self.waiting = dict()       # owner -> number of waiters, in order of arrival.
+
+    def _next_owner(self):
+        return min(self.waiting, key=lambda owner: self.in_flight.get(owner, 0))
+
+    def acquire(self, owner):
+        with self.condition:
+            self.waiting[owner] = self.waiting.get(owner, 0) + 1
+            while sum(self.in_flight.values()) >= self.limit or self._next_owner() != owner:
+                self.condition.wait()
+
+            self.waiting[owner] -= 1
+            if self.waiting[owner] == 0:
+                del self.waiting[owner]
+            self.in_flight[owner] = self.in_flight.get(owner, 0) + 1
+            self.condition.notify_all()
+
+    def release(self, owner):
+        with self.condition:
+            self.in_flight[owner] -= 1
+            if self.in_flight[owner] == 0:
+                del self.in_flight[owner]
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self, owner):
+        self.acquire(owner)
+        try:
+            yield
+        finally:
+            self.release(owner)
+
+
+class JobStatus(enum.Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    ENCODING = 'encoding'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+
+class DownloadJob:
+    """
+    A lecture video to be downloaded.
+    Higher priority jobs are started first, jobs with the same priority are started in the order they were added.
+    """
+
+    def __init__(self, rf_id, video_metadata: Dict, filepath: str, priority: int = 0, quality: str = 'highest',
+                 progress_func: Callable = None, finished_func: Callable = None):
+        self.rf_id = rf_id
+        self.video_metadata = video_metadata
+        self.filepath = filepath
+        self.priority = priority
+        self.quality = quality
+        self.status = JobStatus.QUEUED
+
+        # progress_func(percent), finished_func(job) are called from the queue worker threads.
+        self.progress_func = progress_func
+        self.finished_func = finished_func
+
+        self.pause_ev = Event()
+        self.resume_ev = Event()
+
+    def pause(self):
+        self.resume_ev.clear()
+        self.pause_ev.set()
+
+    def resume(self):
+        self.resume_ev.set()
+        self.pause_ev.clear()
+
+    def is_paused(self):
+        return self.pause_ev.is_set()
+
+    def to_dict(self):
+        return {
+            'rf_id': self.rf_id,
+            'video_metadata': self.video_metadata,
+            'filepath': self.filepath,
+            'priority': self.priority,
+            'quality': self.quality,
+        }
+
+    @classmethod
+    def from_dict(cls, job_dict: Dict):
+        return cls(job_dict['rf_id'], job_dict['video_metadata'], job_dict['filepath'],
+                   priority=job_dict.get('priority', 0), quality=job_dict.get('quality', 'highest'))
+
+
+class DownloadQueue:
+    """
+    Queue of lecture videos to be downloaded, with a limit on the number of lectures downloaded concurrently.
+    Queued and running jobs are saved to state_filepath (if given), so that they can be queued again later, see
+    load_saved_jobs().
+    """
+
+    def __init__(self, process_func: Callable, max_downloads: int = 2, state_filepath: str = None, logger=None):
+        """
+        :param process_func: callable taking a DownloadJob, returns True if the download succeeded, or a Future of
+        that status if the rest of the processing (encode) was handed off after downloading; the worker then moves
+        on to the next job, and the job is finished when the future completes.
+        :param max_downloads: max number of lectures downloaded concurrently.
+        :param state_filepath: json file to persist the queue to.
+        :param logger: logger object.
+        """
+        self.process_func = process_func
+        self.max_downloads = max(1, int(max_downloads))
+        self.state_filepath = state_filepath
+        self.logger = logger
+
+        self.condition = Condition()
+        self.heap = list()
+        self.jobs = dict()      # rf_id -> job, for all the jobs queued, running or encoding.
+        self.sequence = count()
+        self.threads = list()
+        self.shutdown_flag = False
+
+    def add(self, job: DownloadJob):
+        """
+        Queue a job. If the same video is already queued / running, the existing job is returned.
+        """
+        with self.condition:
+            if job.rf_id in self.jobs:
+                return self.jobs[job.rf_id]
+            job.status = JobStatus.QUEUED
+            self.jobs[job.rf_id] = job
+            heapq.heappush(self.heap, (-job.priority, next(self.sequence), job))
+            self._save()
+            self._start_workers()
+            self.condition.notify()
+        return job
+
+    def set_priority(self, rf_id, priority: int):
+        with self.condition:
+            job = self.jobs.get(rf_id)
+            if job and job.status == JobStatus.QUEUED and job.priority != priority:
+                # stale heap entries are skipped by the workers.
+                job.priority = priority
+                heapq.heappush(self.heap, (-job.priority, next(self.sequence), job))
+                self._save()
+                self.condition.notify()
+
+    def cancel(self, rf_id):
+        """
+        Cancel a queued job, jobs already running are not affected.
+        :return: True if the job was cancelled.
+        """
+        with self.condition:
+            job = self.jobs.get(rf_id)
+            if job and job.status == JobStatus.QUEUED:
+                job.status = JobStatus.CANCELLED
+                del self.jobs[rf_id]
+                self._save()
+                self.condition.notify_all()
+                return True
+        return False
+
+    def get(self, rf_id):
+        with self.condition:
+            return self.jobs.get(rf_id)
+
+    def pending(self):
+        """
+        Number of jobs queued or running.
+        """
+        with self.condition:
+            return len(self.jobs)
+
+    def wait(self, timeout: float = None):
+        """
+        Wait for all the jobs to finish.
+        :return: True if the queue is empty.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.jobs) == 0, timeout)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop the workers once the running jobs finish, queued jobs remain saved for a later run.
+        """
+        with self.condition:
+            self.shutdown_flag = True
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: not any(job.status == JobStatus.ENCODING for job in self.jobs.values()))
+
+    def load_saved_jobs(self):
+        """
+        Jobs saved by an earlier run, these can be queued again with add().
+        :return: list of jobs.
+        """
+        if not self.state_filepath or not os.path.exists(self.state_filepath):
+            return []
+        with open(self.state_filepath, 'r') as fh:
+            saved_jobs = json.load(fh)
+        return [DownloadJob.from_dict(job_dict) for job_dict in saved_jobs]
+
+    def _save(self):
+        if not self.state_filepath:
+            return
+        jobs = sorted(self.jobs.values(), key=lambda x: -x.priority)
+        os.makedirs(os.path.dirname(self.state_filepath), exist_ok=True)
+        tmp_filepath = '{}.tmp'.format(self.state_filepath)
+        with open(tmp_filepath, 'w') as fh:
+            json.dump([job.to_dict() for job in jobs], fh, indent=4)
+        os.replace(tmp_filepath, self.state_filepath)
+
+    def _start_workers(self):
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        while len(self.threads) < self.max_downloads:
+            thread = Thread(target=self._worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _next_job(self):
+        with self.condition:
+            while True:
+                if self.shutdown_flag:
+                    return None
+                while self.heap:
+                    neg_priority, _, job = heapq.heappop(self.heap)
+                    if job.status == JobStatus.QUEUED and -neg_priority == job.priority:
+                        job.status = JobStatus.RUNNING
+                        return job
+                self.condition.wait()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                status = self.process_func(job)
+            except Exception as ex:
+                if self.logger:
+                    self.logger.error("[{}]: Download failed: {}".format(job.rf_id, ex))
+                status = False
+
+            if isinstance(status, Future):
+                with self.condition:
+                    job.status = JobStatus.ENCODING
+                status.add_done_callback(partial(self._encode_done, job))
+            else:
+                self._finish(job, status)
+
+    def _encode_done(self, job: DownloadJob, future: Future):
+        try:
+            status = future.result()
+        except Exception as ex:
+            if self.logger:
+                self.logger.error("[{}]: Encode failed: {}".format(job.rf_id, ex))
+            status = False
+        self._finish(job, status)
+
+    def _finish(self, job: DownloadJob, status):
+        with self.condition:
+            job.status = JobStatus.DONE if status else JobStatus.FAILED
+            del self.jobs[job.rf_id]
+            self._save()
+            self.condition.notify_all()
+
+        if job.finished_func:
+            job.finished_func(job)
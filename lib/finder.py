@@ -3,11 +3,13 @@ import os
 import platform
 from datetime import datetime
 
-import enzyme
 from typing import Dict, List
 import random
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
 from lib.config import Config, ConfigType
+from lib.libraryindex import LibraryIndex
+from lib.media.mkvtags import MalformedMKVError, MkvTags
 from lib.metadataparser import MetadataFileParser, MetadataDictParser
 from lib.threadlogging import ThreadLogger
 from lib.data.labels import ConfigKeys
@@ -20,27 +22,140 @@ class Finder:
     Responsible for collecting data from previously downloaded videos, slides and chat/captions files,
     """
 
+    # kinds of items yielded by get_offline_content().
+    VIDEO = 'video'
+    DOCUMENT = 'document'
+
     def __init__(self):
         self.conf = Config.load(ConfigType.IMPARTUS)
         self.logger = ThreadLogger(self.__class__.__name__).logger
+        self.workers = max(1, int(self.conf.get('scan_workers', 8)))
         pass
 
+    def get_offline_content(self, mapping_by_subject_name=None):
+        """
+        Scan target_dir once for both videos and documents.
+        Yields (Finder.VIDEO, (rf_id, video_metadata, is_flipped, chats)) and
+        (Finder.DOCUMENT, (subject_metadata, backpack_slide)) items, as they are found.
+        """
+        yield from self._scan_offline_content(True, True, mapping_by_subject_name)
+
     def get_offline_videos(self):
-        count = 0
-        for dirpath, subdirs, files in os.walk(self.conf.get('target_dir').get(platform.system())):
-            for rf_id, video_metadata in self.get_offline_video_metadata(dirpath, files):
-                if rf_id:
-                    count += 1
-                    chats = self.get_offline_chats(dirpath, files)
-                    is_flipped = False
-                    yield rf_id, video_metadata, is_flipped, chats
-                    # offline_videos[rf_id] = {
-                    #     'chats': chats,
-                    #     **video_metadata,
-                    # }
-        # return offline_videos
-
-    def get_offline_video_metadata(self, path: str, files: List) -> (str, Dict):
+        for _, video in self._scan_offline_content(True, False):
+            yield video
+
+    def get_offline_backpack_slides(self, mapping_by_subject_name=None):
+        for _, document in self._scan_offline_content(False, True, mapping_by_subject_name):
+            yield document
+
+    def _scan_dirs(self, root_dir: str):
+        """
+        Single pass over the directory tree with os.scandir, classifying the files as it goes.
+        Yields (dirpath, mkv entries, captions filepath, document entries) for every directory.
+        """
+        allowed_ext = tuple(self.conf.get('allowed_ext'))
+        dirs = [root_dir]
+        while dirs:
+            dirpath = dirs.pop()
+            try:
+                with os.scandir(dirpath) as it:
+                    entries = list(it)
+            except OSError as ex:
+                self.logger.warning('error reading directory {}: {}'.format(dirpath, ex))
+                continue
+
+            videos, documents, chats = list(), list(), None
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        dirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+
+                if entry.name.endswith('.mkv'):
+                    videos.append(entry)
+                elif entry.name.endswith('.vtt'):
+                    chats = chats or entry.path
+                elif entry.name.endswith(allowed_ext):
+                    documents.append(entry)
+            yield dirpath, videos, chats, documents
+
+    def _scan_offline_content(self, videos: bool, documents: bool, mapping_by_subject_name=None):
+        """
+        Reading the mkv tags / metadata json files is fanned out to a thread pool, while the directory scan (and
+        the library index lookups) continue in the calling thread. Videos are yielded as they are loaded.
+        """
+        target_dir = self.conf.get('target_dir').get(platform.system())
+        config_dir = self.conf.get(ConfigKeys.CONFIG_DIR.value).get(platform.system())
+        index = None
+        if videos:
+            index = LibraryIndex(os.path.join(config_dir, 'library_index.db'),
+                                 self.conf.get(ConfigKeys.VIDEO_PATH.value))
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        pending = dict()    # future -> (filepath, stat_result, index entry, chats)
+        max_pending = 4 * self.workers
+        try:
+            for dirpath, video_entries, chats, document_entries in self._scan_dirs(target_dir):
+                for entry in video_entries if videos else []:
+                    try:
+                        stat_result = entry.stat()
+                    except OSError:
+                        continue
+                    cached = index.get(entry.path, stat_result)
+                    future = executor.submit(self._load_video, entry.path, cached)
+                    pending[future] = (entry.path, stat_result, cached, chats)
+
+                for entry in document_entries if documents else []:
+                    yield self.DOCUMENT, self._get_document(entry, mapping_by_subject_name)
+
+                for video in self._loaded_videos(pending, index, block=len(pending) >= max_pending):
+                    yield self.VIDEO, video
+
+            for video in self._loaded_videos(pending, index, wait_all=True):
+                yield self.VIDEO, video
+
+            # not reached if the caller stops early, entries are dropped only after a complete scan.
+            if index:
+                index.prune()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if index:
+                index.close()
+
+    def _loaded_videos(self, pending: Dict, index: LibraryIndex, block: bool = False, wait_all: bool = False):
+        """
+        Collect the videos loaded by the thread pool, and update the library index with these.
+        :param block: wait for at least one video to be loaded.
+        :param wait_all: wait for all the pending videos.
+        """
+        if not pending:
+            return
+        if wait_all:
+            done = as_completed(list(pending))
+        else:
+            done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            filepath, stat_result, cached, chats = pending.pop(future)
+            rf_id, flipped, video_metadata, metadata_mtime_ns = future.result()
+            if not rf_id:
+                if not cached:
+                    # malformed mkv, no need to parse it again till it changes.
+                    index.put(filepath, stat_result, None, None)
+                continue
+            if video_metadata is None:
+                continue
+            if not cached or cached['metadata'] is not video_metadata or cached['chats_path'] != chats:
+                index.put(filepath, stat_result, rf_id, flipped, video_metadata, metadata_mtime_ns, chats)
+            is_flipped = False
+            yield rf_id, video_metadata, is_flipped, chats
+
+    def _load_video(self, filepath: str, cached: Dict = None):
         """
         Collect the offline video data...
 
@@ -54,51 +169,56 @@ class Finder:
                 - Parse the actual file path to match the {video_path} format. This should provide some of the basic
                 fields (subject, topic, lecture #, professor name etc.
                 - Fill in the remaining fields with default values, or extract from the video file if possible.
-        """
 
-        for filename in files:
-            if not filename.endswith('.mkv'):
-                continue
-            filepath = os.path.join(path, filename)
-
-            flipped = False
+        Videos found in the library index (unchanged since they were last seen) are not opened at all.
+        :return: (rf_id, flipped, video_metadata, metadata_mtime_ns), video_metadata is None if it could not be
+        found.
+        """
+        flipped = False
+        if cached:
+            rf_id, flipped = cached['rf_id'], cached['flipped']
+        else:
             try:
                 rf_id, flipped = self._get_rfid(filepath)
             except TypeError:
                 rf_id = random.randint(1, int(1e6)) * -1
                 pass
 
-            if rf_id:
-                try:
-                    metadata_file = '{}/{}.json'.format(
-                        self.conf.get(ConfigKeys.CONFIG_DIR.value).get(platform.system()),
-                        rf_id
-                    )
-                    # if json file is present ...
-                    if os.path.exists(metadata_file):
-                        with open(metadata_file, 'r') as fh:
-                            video_metadata = json.load(fh)
-                    else:
-                        # parse from the file path.
-                        parsed_items = MetadataFileParser().parse_from_filepath(filepath, ConfigKeys.VIDEO_PATH.value)
-                        video_metadata = MetadataDictParser().sanitize(parsed_items)
-                        if flipped:
-                            video_metadata['fcid'] = rf_id
-                        else:
-                            video_metadata['ttid'] = rf_id
-                        video_metadata = MetadataDictParser().add_new_fields(video_metadata)
-
-                    video_metadata['offline_filepath'] = filepath
-                    yield rf_id, video_metadata
-
-                except NameError as ex:
-                    self.logger.warning('config_dir not found, or does not exist. error: {}'.format(ex))
-                except SyntaxError as ex:
-                    self.logger.warning('error reading metadata file: {}'.format(ex))
-                except KeyError as ex:
-                    self.logger.warning('error parsing offline filepath: {}'.format(ex))
-
-        return None, None
+        if not rf_id:
+            return None, None, None, 0
+
+        try:
+            metadata_file = '{}/{}.json'.format(
+                self.conf.get(ConfigKeys.CONFIG_DIR.value).get(platform.system()),
+                rf_id
+            )
+            metadata_mtime_ns = os.stat(metadata_file).st_mtime_ns if os.path.exists(metadata_file) else 0
+            if cached and cached['metadata'] and cached['metadata_mtime_ns'] == metadata_mtime_ns:
+                video_metadata = cached['metadata']
+            # if json file is present ...
+            elif metadata_mtime_ns:
+                with open(metadata_file, 'r') as fh:
+                    video_metadata = json.load(fh)
+            else:
+                # parse from the file path.
+                parsed_items = MetadataFileParser().parse_from_filepath(filepath, ConfigKeys.VIDEO_PATH.value)
+                video_metadata = MetadataDictParser().sanitize(parsed_items)
+                if flipped:
+                    video_metadata['fcid'] = rf_id
+                else:
+                    video_metadata['ttid'] = rf_id
+                video_metadata = MetadataDictParser().add_new_fields(video_metadata)
+
+            video_metadata['offline_filepath'] = filepath
+            return rf_id, flipped, video_metadata, metadata_mtime_ns
+
+        except NameError as ex:
+            self.logger.warning('config_dir not found, or does not exist. error: {}'.format(ex))
+        except SyntaxError as ex:
+            self.logger.warning('error reading metadata file: {}'.format(ex))
+        except KeyError as ex:
+            self.logger.warning('error parsing offline filepath: {}'.format(ex))
+        return rf_id, flipped, None, 0
 
     def get_offline_chats(self, path: str, files: List):  # noqa
         for filename in files:
@@ -107,47 +227,37 @@ class Finder:
 
     def _get_rfid(self, filepath: str):
         try:
-            with open(filepath, 'rb') as f:
-                mkv = enzyme.MKV(f)
-                if mkv.tags:
-                    for x in mkv.tags:
-                        for y in x.simpletags:
-                            if y.name == 'TTID':
-                                return int(y.string), False
-                            if y.name == 'FCID':
-                                return int(y.string), True
-        except enzyme.MalformedMKVError as ex:
+            rf_id, flipped = MkvTags.get_rfid(filepath)
+            if rf_id is not None:
+                return rf_id, flipped
+        except MalformedMKVError as ex:
             self.logger.warning("Exception while parsing file {}".format(str(filepath)))
             self.logger.warning("You may want to delete and re-download this file.")
             self.logger.warning("Exception: {}".format(ex))
             return None, None
 
-    def get_offline_backpack_slides(self, mapping_by_subject_name=None):
-        for dirpath, subdirs, files in os.walk(self.conf.get('target_dir').get(platform.system())):
-            for filename in files:
-                for ext in self.conf.get('allowed_ext'):
-                    if filename.endswith(ext):
-                        filepath = os.path.join(dirpath, filename)
-                        parsed_fields = MetadataFileParser().parse_from_filepath(
-                            filepath, ConfigKeys.DOCUMENTS_PATH.value)
-
-                        prof_name = None
-                        if parsed_fields.get('professorName'):
-                            prof_name = parsed_fields['professorName']
-
-                        subject_metadata = self._get_subject_info(parsed_fields, mapping_by_subject_name)
-                        backpack_slide = {
-                            'offline_filepath': filepath,
-                            'fileName': filename,
-                            'fileLength': os.path.getsize(filepath),
-                            'fileLengthKB': os.path.getsize(filepath) // 1024,
-                            'fileLengthMB': '{:.1f}'.format(os.path.getsize(filepath) / (1024 * 1024)),
-                            'fileDate': datetime.fromtimestamp(os.path.getmtime(filepath)).strftime("%Y-%m-%d"),
-                            'description': '',
-                            'professorName': prof_name,
-                            'ext': str.split(filepath, '.')[-1],
-                        }
-                        yield subject_metadata, backpack_slide
+    def _get_document(self, entry: os.DirEntry, mapping_by_subject_name=None):
+        filepath = entry.path
+        parsed_fields = MetadataFileParser().parse_from_filepath(filepath, ConfigKeys.DOCUMENTS_PATH.value)
+
+        prof_name = None
+        if parsed_fields.get('professorName'):
+            prof_name = parsed_fields['professorName']
+
+        subject_metadata = self._get_subject_info(parsed_fields, mapping_by_subject_name)
+        stat_result = entry.stat()
+        backpack_slide = {
+            'offline_filepath': filepath,
+            'fileName': entry.name,
+            'fileLength': stat_result.st_size,
+            'fileLengthKB': stat_result.st_size // 1024,
+            'fileLengthMB': '{:.1f}'.format(stat_result.st_size / (1024 * 1024)),
+            'fileDate': datetime.fromtimestamp(stat_result.st_mtime).strftime("%Y-%m-%d"),
+            'description': '',
+            'professorName': prof_name,
+            'ext': str.split(filepath, '.')[-1],
+        }
+        return subject_metadata, backpack_slide
 
     def _get_subject_info(self, metadata, subject_name_id_map=None):    # noqa
         subject_id = -1
@@ -0,0 +1,257 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+
+class StageStats:
+    """
+    Counters for a stage of the download pipeline: spans recorded, time taken, bytes processed, retries and errors.
+    """
+    __slots__ = ('count', 'seconds', 'max_seconds', 'bytes', 'retries', 'errors')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+
+    def add(self, seconds: float, num_bytes: int = 0, retries: int = 0, error: bool = False):
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes += num_bytes
+        self.retries += retries
+        self.errors += int(error)
+
+    def __repr__(self):
+        text = '{} in {:.1f}s'.format(self.count, self.seconds)
+        if self.bytes:
+            text += ', {:.1f} MB'.format(self.bytes / (1 << 20))
+            if self.seconds > 0:
+                text += ' ({:.1f} MB/s)'.format(self.bytes / (1 << 20) / self.seconds)
+        if self.retries:
+            text += ', {} retries'.format(self.retries)
+        if self.errors:
+            text += ', {} errors'.format(self.errors)
+        return text
+
+
+class Span:
+    """
+    A stage in progress, see Instrumentation.span().
+    """
+    __slots__ = ('bytes', 'retries')
+
+    def __init__(self):
+        self.bytes = 0
+        self.retries = 0
+
+    def add_bytes(self, num_bytes: int):
+        self.bytes += num_bytes
+
+    def add_retries(self, retries: int = 1):
+        self.retries += retries
+
+
+class Instrumentation:
+    """
+    Process wide timing / throughput counters for the stages of the download pipeline (fetch, key, decrypt, join,
+    split, encode ..), recorded per lecture (rf_id) and in total.
+
+    with Instrumentation.span(rf_id, 'decrypt') as span:
+        ...
+        span.add_bytes(len(plaintext))
+
+    Spans of a stage may run concurrently (say the fetches of a lecture), their seconds add up to more than the
+    wall clock time then. summary(rf_id) returns the counters of a lecture, write_metrics() writes the totals in
+    the Prometheus text format.
+
+    Once start_trace() is called, every span is also kept as a trace event, see write_trace().
+    """
+    lock = Lock()
+    lectures = dict()   # rf_id -> {stage -> StageStats}
+    totals = dict()     # stage -> StageStats
+
+    # chrome trace events of the spans, None if not tracing.
+    trace_events = None
+    trace_start = 0.0
+    trace_threads = dict()      # thread id -> thread name.
+    trace_lectures = set()
+
+    # events beyond this are dropped, to bound the memory held by a long session.
+    max_trace_events = 1000000
+
+    @classmethod
+    def record(cls, rf_id, stage: str, seconds: float, num_bytes: int = 0, retries: int = 0, error: bool = False):
+        with cls.lock:
+            if rf_id is not None:
+                cls.lectures.setdefault(rf_id, dict()).setdefault(stage, StageStats()).add(
+                    seconds, num_bytes, retries, error)
+            cls.totals.setdefault(stage, StageStats()).add(seconds, num_bytes, retries, error)
+
+    @classmethod
+    def add_retries(cls, rf_id, stage: str, retries: int = 1):
+        """
+        Count retries made outside of a span.
+        """
+        with cls.lock:
+            if rf_id is not None:
+                cls.lectures.setdefault(rf_id, dict()).setdefault(stage, StageStats()).retries += retries
+            cls.totals.setdefault(stage, StageStats()).retries += retries
+
+    @classmethod
+    @contextmanager
+    def span(cls, rf_id, stage: str, detail: str = None):
+        """
+        Time the block as a span of the stage, for the lecture rf_id (None to count in the totals only).
+        Yields a Span, to add the bytes processed / retries made. Exceptions are counted as errors.
+        :param detail: shown with the trace event (say, the url fetched), if tracing.
+        """
+        span = Span()
+        error = False
+        start = time.monotonic()
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            end = time.monotonic()
+            cls.record(rf_id, stage, end - start, span.bytes, span.retries, error)
+            if cls.trace_events is not None:
+                cls._trace(rf_id, stage, start, end, span, error, detail)
+
+    @staticmethod
+    def _trace_pid(rf_id):
+        # events are grouped by lecture in the trace viewer, the trace pid being the rf_id (0 if none).
+        try:
+            return int(rf_id or 0)
+        except ValueError:
+            return 0
+
+    @classmethod
+    def _trace(cls, rf_id, stage: str, start: float, end: float, span: Span, error: bool, detail: str):
+        args = {'bytes': span.bytes, 'retries': span.retries}
+        if error:
+            args['error'] = True
+        if detail:
+            args['detail'] = detail
+        thread = threading.current_thread()
+        event = {
+            'name': stage, 'cat': stage, 'ph': 'X',
+            'ts': round((start - cls.trace_start) * 1000000, 1), 'dur': round((end - start) * 1000000, 1),
+            'pid': cls._trace_pid(rf_id), 'tid': thread.ident, 'args': args,
+        }
+        with cls.lock:
+            if cls.trace_events is not None and len(cls.trace_events) < cls.max_trace_events:
+                cls.trace_events.append(event)
+                cls.trace_threads[thread.ident] = thread.name
+                cls.trace_lectures.add(rf_id)
+
+    @classmethod
+    def start_trace(cls):
+        """
+        Keep the spans from now on as trace events, see write_trace().
+        """
+        with cls.lock:
+            if cls.trace_events is None:
+                cls.trace_events = list()
+                cls.trace_start = time.monotonic()
+
+    @classmethod
+    def is_tracing(cls):
+        return cls.trace_events is not None
+
+    @classmethod
+    def get_trace(cls):
+        """
+        Trace events recorded so far, in the chrome trace event format (to open with chrome://tracing, or
+        https://ui.perfetto.dev): a process per lecture, with a row per thread.
+        """
+        with cls.lock:
+            events = list(cls.trace_events or [])
+            threads = dict(cls.trace_threads)
+            lectures = set(cls.trace_lectures)
+        metadata = list()
+        for rf_id in lectures:
+            metadata.append({'name': 'process_name', 'ph': 'M', 'pid': cls._trace_pid(rf_id),
+                             'args': {'name': 'lecture {}'.format(rf_id) if rf_id is not None else 'session'}})
+        pids = {event['pid'] for event in events}
+        for tid, name in threads.items():
+            metadata.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                            for pid in pids)
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    @classmethod
+    def write_trace(cls, filepath: str):
+        """
+        Write the trace events recorded so far to filepath, as chrome trace event json.
+        """
+        if cls.trace_events is None:
+            return
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        tmp_filepath = '{}.{}.{}.tmp'.format(filepath, os.getpid(), threading.get_ident())
+        with open(tmp_filepath, 'w') as fh:
+            json.dump(cls.get_trace(), fh)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def summary(cls, rf_id, clear: bool = True):
+        """
+        Counters recorded for a lecture, as 'stage: count in seconds, bytes (rate), retries, errors' text.
+        :param clear: forget the counters of the lecture, the totals are kept.
+        """
+        with cls.lock:
+            stages = cls.lectures.pop(rf_id, dict()) if clear else dict(cls.lectures.get(rf_id, dict()))
+            return '; '.join('{}: {}'.format(stage, stats) for stage, stats in stages.items())
+
+    @classmethod
+    def get_metrics(cls):
+        """
+        Totals of all the stages, in the Prometheus text exposition format.
+        """
+        metrics = [
+            ('spans_total', 'counter', 'Number of spans recorded for the stage.', 'count'),
+            ('seconds_total', 'counter', 'Time spent in the stage.', 'seconds'),
+            ('max_seconds', 'gauge', 'Longest span of the stage.', 'max_seconds'),
+            ('bytes_total', 'counter', 'Bytes processed by the stage.', 'bytes'),
+            ('retries_total', 'counter', 'Retries made by the stage.', 'retries'),
+            ('errors_total', 'counter', 'Spans of the stage that raised an error.', 'errors'),
+        ]
+        with cls.lock:
+            totals = sorted(cls.totals.items())
+            lines = list()
+            for name, metric_type, description, attribute in metrics:
+                lines.append('# HELP impartus_stage_{} {}'.format(name, description))
+                lines.append('# TYPE impartus_stage_{} {}'.format(name, metric_type))
+                for stage, stats in totals:
+                    lines.append('impartus_stage_{}{{stage="{}"}} {}'.format(name, stage, getattr(stats, attribute)))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def write_metrics(cls, filepath: str):
+        """
+        Write the totals to filepath in the Prometheus text format (say, for the node exporter textfile collector).
+        """
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        tmp_filepath = '{}.{}.{}.tmp'.format(filepath, os.getpid(), threading.get_ident())
+        with open(tmp_filepath, 'w') as fh:
+            fh.write(cls.get_metrics())
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def clear(cls):
+        """
+        Forget all the counters, and stop tracing.
+        """
+        with cls.lock:
+            cls.lectures = dict()
+            cls.totals = dict()
+            cls.trace_events = None
+            cls.trace_threads = dict()
+            cls.trace_lectures = set()
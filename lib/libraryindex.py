@@ -0,0 +1,113 @@
+import json
+import os
+import sqlite3
+from typing import Dict
+
+
+class LibraryIndex:
+    """
+    Persistent (sqlite) index of the lecture videos found on disk, so that the offline library does not have to
+    open and parse every mkv file on each scan.
+
+    Entries are keyed by the file path, and are valid as long as the file size and modification time match the
+    ones recorded. Each entry caches the rf_id (ttid/fcid) read from the mkv tags, the video metadata and the
+    companion captions (.vtt) file path.
+    """
+
+    # bump this whenever the table layout, or the contents cached change.
+    version = 1
+
+    def __init__(self, db_filepath: str, video_path_format: str = None):
+        """
+        :param db_filepath: sqlite database file.
+        :param video_path_format: video_path config value, metadata parsed from the file paths is discarded
+        when this changes.
+        """
+        self.db_filepath = db_filepath
+        self.video_path_format = video_path_format or ''
+        self.seen = set()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_filepath)), exist_ok=True)
+        self.db = sqlite3.connect(db_filepath)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.db:
+            if self.db.execute('PRAGMA user_version').fetchone()[0] != self.version:
+                self.db.execute('DROP TABLE IF EXISTS videos')
+                self.db.execute('DROP TABLE IF EXISTS settings')
+                self.db.execute('PRAGMA user_version = {:d}'.format(self.version))
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS videos ('
+                'filepath TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+                'rf_id INTEGER, flipped INTEGER, metadata TEXT, metadata_mtime_ns INTEGER, chats_path TEXT)'
+            )
+            self.db.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)')
+
+            row = self.db.execute("SELECT value FROM settings WHERE name = 'video_path'").fetchone()
+            if row is None or row[0] != self.video_path_format:
+                # metadata parsed from the file path (metadata_mtime_ns = 0) no longer applies.
+                self.db.execute('UPDATE videos SET metadata = NULL WHERE metadata_mtime_ns = 0')
+                self.db.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('video_path', ?)",
+                                (self.video_path_format,))
+
+    def get(self, filepath: str, stat_result: os.stat_result):
+        """
+        Cached entry for the file, if the file has not changed since it was indexed.
+        :return: dict with keys rf_id, flipped, metadata, metadata_mtime_ns, chats_path; None if not found.
+        """
+        self.seen.add(filepath)
+        row = self.db.execute(
+            'SELECT rf_id, flipped, metadata, metadata_mtime_ns, chats_path FROM videos '
+            'WHERE filepath = ? AND size = ? AND mtime_ns = ?',
+            (filepath, stat_result.st_size, stat_result.st_mtime_ns)
+        ).fetchone()
+        if row is None:
+            return None
+
+        rf_id, flipped, metadata, metadata_mtime_ns, chats_path = row
+        return {
+            'rf_id': rf_id,
+            'flipped': bool(flipped) if flipped is not None else None,
+            'metadata': json.loads(metadata) if metadata else None,
+            'metadata_mtime_ns': metadata_mtime_ns,
+            'chats_path': chats_path,
+        }
+
+    def put(self, filepath: str, stat_result: os.stat_result, rf_id, flipped, metadata: Dict = None,
+            metadata_mtime_ns: int = 0, chats_path: str = None):
+        """
+        Add / update the entry for the file.
+        :param metadata_mtime_ns: modification time of the metadata json file the metadata was read from,
+        0 if the metadata was parsed from the file path.
+        """
+        self.seen.add(filepath)
+        self.db.execute(
+            'INSERT OR REPLACE INTO videos '
+            '(filepath, size, mtime_ns, rf_id, flipped, metadata, metadata_mtime_ns, chats_path) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (filepath, stat_result.st_size, stat_result.st_mtime_ns, rf_id,
+             None if flipped is None else int(flipped),
+             json.dumps(metadata) if metadata is not None else None, metadata_mtime_ns, chats_path)
+        )
+
+    def prune(self):
+        """
+        Drop the entries for the files not looked up since the index was opened (deleted / moved files).
+        Call this only after a full scan.
+        """
+        indexed = {row[0] for row in self.db.execute('SELECT filepath FROM videos')}
+        self.db.executemany('DELETE FROM videos WHERE filepath = ?', [(x,) for x in indexed - self.seen])
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM videos').fetchone()[0]
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,17 +1,169 @@
 from Crypto.Cipher import AES   # noqa
+from Crypto.Util.strxor import strxor
+from threading import Lock
 from typing import Any
 import os
 
+from lib.instrumentation import Instrumentation
+
 
 class Decrypter:
     """
     Utility functions for decrypting AES-128 encrypted streams.
+
+    CBC decryption is done as an ECB decryption of all the blocks, followed by xor-ing every block with the
+    previous ciphertext block (the iv for the first block). The ECB cipher objects hold no state between calls,
+    so one is created per key and reused for all the streams encrypted with it.
     """
+    block_size = AES.block_size
+
+    # default size of the chunks read by decrypt_stream()
+    chunk_size = 1 << 20
+
+    _ciphers = dict()
+    _ciphers_lock = Lock()
+
     def __init__(self):
         pass
 
     @classmethod
-    def decrypt(cls, encryption_key: Any, in_filepath: str, out_dir: str) -> str:
+    def _get_key_bytes(cls, encryption_key: Any) -> bytes:
+        if type(encryption_key) == str:
+            return bytes(encryption_key, 'utf-8')
+        elif type(encryption_key) in [bytes, bytearray]:
+            return bytes(encryption_key)
+        else:
+            assert False, "Implement handling for type {}".format(type(encryption_key))
+
+    @classmethod
+    def get_cipher(cls, encryption_key: Any):
+        """
+        Cached ECB cipher object for the given key.
+        """
+        key_bytes = cls._get_key_bytes(encryption_key)
+        cipher = cls._ciphers.get(key_bytes)
+        if cipher is None:
+            with cls._ciphers_lock:
+                cipher = cls._ciphers.get(key_bytes)
+                if cipher is None:
+                    cipher = AES.new(key_bytes, AES.MODE_ECB)
+                    cls._ciphers[key_bytes] = cipher
+        return cipher
+
+    @classmethod
+    def unpadded_length(cls, plaintext, length: int = None) -> int:
+        """
+        Length of the plaintext without the PKCS7 padding. Plaintext with no valid padding is left as is.
+        :param plaintext: decrypted contents (bytes-like).
+        :param length: number of valid bytes in plaintext, defaults to len(plaintext).
+        """
+        if length is None:
+            length = len(plaintext)
+        if length < cls.block_size:
+            return length
+        pad = plaintext[length - 1]
+        if pad < 1 or pad > cls.block_size:
+            return length
+        for index in range(length - pad, length):
+            if plaintext[index] != pad:
+                return length
+        return length - pad
+
+    @classmethod
+    def decrypt_into(cls, encryption_key: Any, ciphertext, output, iv: bytes = None, unpad: bool = True) -> int:
+        """
+        Decrypt AES-128 (CBC) encrypted contents into a preallocated buffer.
+        :param encryption_key: Encryption key (string and bytes type supported)
+        :param ciphertext: bytes-like encrypted contents, length must be a multiple of the block size.
+        :param output: writable bytes-like buffer (bytearray / memoryview) at least as long as the ciphertext,
+        must not overlap with the ciphertext.
+        :param iv: initialization vector, all zeros by default.
+        :param unpad: strip PKCS7 padding off the last block.
+        :return: number of plaintext bytes written to the output.
+        """
+        ciphertext = memoryview(ciphertext)
+        output = memoryview(output)
+        length = len(ciphertext)
+        if length % cls.block_size:
+            raise ValueError("Data must be aligned to block boundary in CBC mode, got {} bytes.".format(length))
+        if length == 0:
+            return 0
+        if iv is None:
+            iv = bytes(cls.block_size)
+
+        out = output[:length]
+        cls.get_cipher(encryption_key).decrypt(ciphertext, output=out)
+        block = cls.block_size
+        strxor(out[:block], iv, output=out[:block])
+        if length > block:
+            strxor(out[block:], ciphertext[:length - block], output=out[block:])
+
+        return cls.unpadded_length(out, length) if unpad else length
+
+    @classmethod
+    def decrypt_bytes(cls, encryption_key: Any, ciphertext, iv: bytes = None, rf_id=None) -> bytearray:
+        """
+        Decrypt AES-128 encrypted stream contents in memory.
+        :param encryption_key: Encryption key (string and bytes type supported)
+        :param ciphertext: encrypted stream contents.
+        :param iv: initialization vector, all zeros by default.
+        :param rf_id: video the stream belongs to, for the instrumentation.
+        :return: decrypted contents, without padding.
+        """
+        with Instrumentation.span(rf_id, 'decrypt') as span:
+            output = bytearray(len(ciphertext))
+            length = cls.decrypt_into(encryption_key, ciphertext, output, iv)
+            del output[length:]
+            span.add_bytes(length)
+        return output
+
+    @classmethod
+    def decrypt_stream(cls, encryption_key: Any, in_fh, out_fh, iv: bytes = None, chunk_size: int = None) -> int:
+        """
+        Decrypt contents read from in_fh (file, socket, http response - anything with a readinto()) and write to
+        out_fh, a chunk at a time. Only two chunk sized buffers are allocated, whatever the size of the stream.
+        :param encryption_key: Encryption key (string and bytes type supported)
+        :param in_fh: input stream.
+        :param out_fh: output stream.
+        :param iv: initialization vector, all zeros by default.
+        :param chunk_size: size of the chunks read from the input (rounded up to the block size).
+        :return: number of plaintext bytes written.
+        """
+        block = cls.block_size
+        chunk_size = chunk_size or cls.chunk_size
+        chunk_size = max(block, chunk_size + (-chunk_size % block))
+        in_buffer = memoryview(bytearray(chunk_size + block))
+        out_buffer = memoryview(bytearray(chunk_size + block))
+
+        iv = bytes(iv) if iv else bytes(block)
+        carried = 0         # ciphertext bytes carried over from the last read, short of a full block.
+        held_back = None    # last plaintext block, written once we know if it is the final (padded) one.
+        written = 0
+        while True:
+            count = in_fh.readinto(in_buffer[carried:carried + chunk_size])
+            if not count:
+                break
+            available = carried + count
+            usable = available - available % block
+            if usable:
+                cls.decrypt_into(encryption_key, in_buffer[:usable], out_buffer, iv=iv, unpad=False)
+                iv = bytes(in_buffer[usable - block:usable])
+                if held_back:
+                    written += out_fh.write(held_back)
+                written += out_fh.write(out_buffer[:usable - block])
+                held_back = bytes(out_buffer[usable - block:usable])
+            carried = available - usable
+            if carried:
+                in_buffer[:carried] = in_buffer[usable:available]
+
+        if carried:
+            raise ValueError("Data must be aligned to block boundary in CBC mode, {} bytes left over.".format(carried))
+        if held_back:
+            written += out_fh.write(held_back[:cls.unpadded_length(held_back)])
+        return written
+
+    @classmethod
+    def decrypt(cls, encryption_key: Any, in_filepath: str, out_dir: str, iv: bytes = None, rf_id=None) -> str:
         """
         Given an encryption key and input filepath, decrypt the file using AES-128 bit decryption.
         Return filepath to the decrypted file.
@@ -19,24 +171,22 @@ class Decrypter:
         :param encryption_key: Encryption key (string and bytes type supported)
         :param in_filepath: Input file path.
         :param out_dir: Directory path where decrypted contents are to be saved.
+        :param iv: initialization vector, all zeros by default.
+        :param rf_id: video the stream belongs to, for the instrumentation.
         :Return : decrypted file path if key exists, input filepath otherwise.
         """
         out_filepath = os.path.join(out_dir, os.path.basename(in_filepath) + ".ts")  # default path
 
         if encryption_key:
-            if type(encryption_key) == str:
-                dec_key_bytes = bytes(encryption_key, 'utf-8')
-            elif type(encryption_key) == bytes:
-                dec_key_bytes = encryption_key
-            else:
-                assert False, "Implement handling for type {}".format(type(encryption_key))
-
-            iv = bytes('\0' * 16, 'utf-8')
-            with open(out_filepath, 'wb+') as out_fh:
-                with open(in_filepath, 'rb') as in_fh:
-                    ciphertext = in_fh.read()
-                    aes = AES.new(dec_key_bytes, AES.MODE_CBC, iv)
-                    out_fh.write(aes.decrypt(ciphertext))
+            # validate the key before creating the output file.
+            cls.get_cipher(encryption_key)
+            # written to a .part file first, so an interrupted run does not leave a truncated output file behind.
+            part_filepath = '{}.part'.format(out_filepath)
+            with Instrumentation.span(rf_id, 'decrypt') as span:
+                with open(part_filepath, 'wb+') as out_fh:
+                    with open(in_filepath, 'rb') as in_fh:
+                        span.add_bytes(cls.decrypt_stream(encryption_key, in_fh, out_fh, iv=iv))
+            os.replace(part_filepath, out_filepath)
         else:
             # nothing to be done.
             out_filepath = in_filepath
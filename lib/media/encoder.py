@@ -1,9 +1,12 @@
 import os
+import subprocess
 from shutil import move
 from typing import List
 
+from lib.instrumentation import Instrumentation
 from lib.utils import Utils
 from lib.threadlogging import ThreadLogger
+from lib.media.tsscanner import TsScanner
 
 
 class Encoder:
@@ -14,6 +17,19 @@ class Encoder:
     Utility functions to split, join, encode media streams using ffmpeg.
     """
 
+    # bytes at the start of a track file scanned to pick its probe window, see get_probe_window().
+    probe_head_size = 16 << 20
+
+    # ffmpeg defaults, probe windows are never larger than these, unless needed to reach the first timestamps.
+    max_probe_size = 5000000
+    max_analyze_duration = 5
+
+    # track files with streams starting further apart than this (seconds) are probed in full.
+    max_start_spread = 10
+
+    # probe size / analyze duration used for a full probe, int_max.
+    full_probe = '2147483647'
+
     @classmethod
     def split_track(cls, ts_files: List, duration: int, debug: bool = False, priority='normal'):
         """
@@ -52,7 +68,72 @@ class Encoder:
         move(tmp_file_path, ts_files[0])
 
     @classmethod
-    def encode_mkv(cls, rf_id, ts_files, filepath, duration, debug=False, flipped=False, priority='normal'):
+    def get_probe_window(cls, ts_file, first_segment=None):
+        """
+        Probe window for a track file: its first segment, up to the ffmpeg defaults, and in any case enough bytes
+        to reach the first timestamp of every audio / video stream twice over, from a scan of the start of the file.
+        :param first_segment: (size in bytes, duration in seconds) of the first segment of the track, the ffmpeg
+        defaults are used for the unknown (None) values.
+        :return: (probe size in bytes, analyze duration in microseconds), or None if the start of the file is
+        irregular (not TS data, no timestamps, streams starting far apart), such files are probed in full.
+        """
+        try:
+            info = TsScanner.scan_head(ts_file, cls.probe_head_size)
+        except OSError:
+            return None
+        if not info.is_valid() or not info.pts_offsets or info.start_spread() > cls.max_start_spread:
+            return None
+        segment_size, segment_duration = first_segment or (None, None)
+        probe_size = min(segment_size or cls.max_probe_size, cls.max_probe_size)
+        probe_size = max(probe_size, 2 * (max(info.pts_offsets.values()) + TsScanner.packet_size))
+        analyze_duration = min(segment_duration or cls.max_analyze_duration, cls.max_analyze_duration)
+        analyze_duration = max(analyze_duration, 2 * info.start_spread())
+        return probe_size, int(analyze_duration * 1000000)
+
+    @classmethod
+    def _encode_command(cls, rf_id, in_files, filepath, debug=False, flipped=False, piped=False, probe_windows=None):
+        """
+        ffmpeg command to encode the given track files (or fifos) into a multiview mkv file.
+        :param probe_windows: (probe size, analyze duration) per track file, see get_probe_window(); files without
+        one are probed in full.
+        """
+        # full probe is needed to lookup timestamp info in files where multiple tracks are
+        # joined in a single channel and possibly with incorrect timestamps.
+        # fifos are read as the tracks arrive, ffmpeg must not try to read one of them to the end before
+        # opening the others, so they are probed with the default probe size.
+        probe_windows = probe_windows or [None] * len(in_files)
+
+        # ffmpeg log_level.
+        log_level = "verbose" if debug else "quiet"
+
+        # ffmpeg command syntax we expect to run
+        # ffmpeg [global_flags] [in1_flags] -i in1.ts [in2_flags] -i in2.ts .. -c copy -map 0 -map 1 .. $outfile
+        command_args = ['ffmpeg', '-y', '-loglevel', log_level]
+        map_args = list()
+        for index, (in_file, probe_window) in enumerate(zip(in_files, probe_windows)):
+            if piped:
+                command_args.extend(['-f', 'mpegts', '-i', in_file])
+            elif probe_window:
+                probe_size, analyze_duration = probe_window
+                command_args.extend(['-analyzeduration', str(analyze_duration), '-probesize', str(probe_size),
+                                     '-i', in_file])
+            else:
+                command_args.extend(['-analyzeduration', cls.full_probe, '-probesize', cls.full_probe, '-i', in_file])
+            map_args.extend(['-map', str(index)])
+
+        # adding rf_id to metadata.
+        if flipped:
+            command_args.extend(['-metadata', 'fcid={}'.format(rf_id)])
+        else:
+            command_args.extend(['-metadata', 'ttid={}'.format(rf_id)])
+        command_args.extend(['-c', 'copy'])
+        command_args.extend(map_args)
+        command_args.append(filepath)
+        return command_args
+
+    @classmethod
+    def encode_mkv(cls, rf_id, ts_files, filepath, duration, debug=False, flipped=False, priority='normal',
+                   tight_probe=False, first_segments=None):
         """
         Encode to mkv using ffmpeg and create a multiview video file.
         :param rf_id: video ttid (for regular) or fcid (for flipped)
@@ -62,50 +143,43 @@ class Encoder:
         :param debug: debug flag, if True print verbose output from ffmpeg.
         :param flipped: Whether the video is a flipped video.
         :param priority: priority of the process launched via subprocess.run()
+        :param tight_probe: probe each track file in a window picked from a scan of its start (see
+        get_probe_window()), instead of reading the whole file. Tracks split by ffmpeg are always probed in full.
+        :param first_segments: (size in bytes, duration in seconds) of the first segment of each track, or None,
+        bounding the probe windows.
         :return: True if encode successful.
         """
-
-        # probe size is needed to lookup timestamp info in files where multiple tracks are
-        # joined in a single channel and possibly with incorrect timestamps.
-        probe_size = '2147483647'     # int_max
-
-        # ffmpeg log_level.
-        log_level = "verbose" if debug else "quiet"
         logger = Encoder.thread_logger.logger
 
         try:
-            # ffmpeg command syntax we expect to run
-            # ffmpeg [global_flags] [in1_flags] -i in1.ts [in2_flags] -i in2.ts .. -c copy -map 0 -map 1 .. $outfile
-            in_args = list()
-            map_args = list()
-
             split_flag = False
-            for index, ts_file in enumerate(ts_files):
-                in_args.extend(['-analyzeduration', probe_size, '-probesize', probe_size, '-i', ts_file])
-                map_args.extend(['-map', str(index)])
-
+            for ts_file in ts_files:
                 # if any of the ts_file is 0 sized, it's content exists in track 0
                 # split track 0, if that is the case.
+                # Impartus.process_video() splits such playlists at the segment boundaries before downloading,
+                # so this is only a fallback.
                 if os.stat(ts_file).st_size == 0:
                     split_flag = True
 
             if split_flag:
                 logger.info("[{}]: Splitting track 0 .. ".format(rf_id))
-                Encoder.split_track(ts_files, duration, debug=debug, priority=priority)
+                with Instrumentation.span(rf_id, 'split'):
+                    Encoder.split_track(ts_files, duration, debug=debug, priority=priority)
 
-            logger.info("[{}]: Encoding output file ..".format(rf_id))
-            command_args = ['ffmpeg', '-y', '-loglevel', log_level]
-            command_args.extend(in_args)
+            probe_windows = None
+            if tight_probe and not split_flag:
+                with Instrumentation.span(rf_id, 'probe'):
+                    first_segments = first_segments or [None] * len(ts_files)
+                    probe_windows = [cls.get_probe_window(ts_file, first_segment)
+                                     for ts_file, first_segment in zip(ts_files, first_segments)]
+                logger.debug("[{}]: Probe windows: {}".format(rf_id, probe_windows))
 
-            # adding rf_id to metadata.
-            if flipped:
-                command_args.extend(['-metadata', 'fcid={}'.format(rf_id)])
-            else:
-                command_args.extend(['-metadata', 'ttid={}'.format(rf_id)])
-            command_args.extend(['-c', 'copy'])
-            command_args.extend(map_args)
-            command_args.append(filepath)
-            Utils.run_with_priority(command_args, priority)
+            logger.info("[{}]: Encoding output file ..".format(rf_id))
+            command_args = cls._encode_command(rf_id, ts_files, filepath, debug=debug, flipped=flipped,
+                                               probe_windows=probe_windows)
+            with Instrumentation.span(rf_id, 'encode') as span:
+                span.add_bytes(sum(os.stat(ts_file).st_size for ts_file in ts_files))
+                Utils.run_with_priority(command_args, priority)
         except Exception as ex:
             logger.error("[{}]: ffmpeg exception: {}".format(rf_id, ex))
             logger.error("[{}]: Check the ts file(s) generated at location: {}".format(rf_id, ', '.join(ts_files)))
@@ -114,19 +188,78 @@ class Encoder:
         return True
 
     @classmethod
-    def join(cls, files_list, out_dirpath: str, track_number: int):
+    def can_pipe(cls):
+        """
+        Whether the tracks can be fed to ffmpeg using named pipes on this platform.
+        """
+        return hasattr(os, 'mkfifo')
+
+    @classmethod
+    def create_fifos(cls, out_dirpath: str, num_tracks: int):
+        """
+        Create a named pipe per track.
+        :return: list of fifo paths.
+        """
+        fifos = list()
+        for track_number in range(num_tracks):
+            fifo_path = os.path.join(out_dirpath, "track-{}.fifo".format(track_number))
+            if os.path.exists(fifo_path):
+                os.unlink(fifo_path)
+            os.mkfifo(fifo_path)
+            fifos.append(fifo_path)
+        return fifos
+
+    @classmethod
+    def start_encode_mkv(cls, rf_id, fifos, filepath, debug=False, flipped=False, priority='normal'):
+        """
+        Launch ffmpeg to encode the tracks fed through the given fifos, the tracks can be written to the fifos
+        while they are being downloaded.
+        :return: ffmpeg process, see finish_encode_mkv()
+        """
+        logger = Encoder.thread_logger.logger
+        logger.info("[{}]: Encoding output file from the tracks being downloaded ..".format(rf_id))
+        command_args = cls._encode_command(rf_id, fifos, filepath, debug=debug, flipped=flipped, piped=True)
+        return Utils.popen_with_priority(command_args, priority, stdin=subprocess.DEVNULL)
+
+    @classmethod
+    def finish_encode_mkv(cls, rf_id, process, abort=False):
+        """
+        Wait for an encode started with start_encode_mkv() to complete.
+        :param rf_id: video ttid / fcid.
+        :param process: ffmpeg process.
+        :param abort: terminate the encode, instead of waiting for it.
+        :return: True if encode successful.
+        """
+        logger = Encoder.thread_logger.logger
+        if abort:
+            process.kill()
+            process.wait()
+            return False
+
+        # time left to encode, once all the tracks are fed.
+        with Instrumentation.span(rf_id, 'encode'):
+            return_code = process.wait()
+        if return_code != 0:
+            logger.error("[{}]: ffmpeg exited with status {}".format(rf_id, return_code))
+            return False
+        return True
+
+    @classmethod
+    def join(cls, files_list, out_dirpath: str, track_number: int, rf_id=None):
         """
         Join individual stream files into a single track file.
         :param files_list: list of stream files.
         :param out_dirpath: output directory path.
         :param track_number: track number.
+        :param rf_id: video the track belongs to, for the instrumentation.
         :return: return a track file combining all the decrypted media files.
         """
         out_filename = "track-{}.ts".format(track_number)
         out_filepath = os.path.join(out_dirpath, out_filename)
-        with open(out_filepath, 'wb+') as out_fh:
-            for file in files_list:
-                with open(file, 'rb') as in_fh:
-                    out_fh.write(in_fh.read())
+        with Instrumentation.span(rf_id, 'join') as span:
+            with open(out_filepath, 'wb+') as out_fh:
+                for file in files_list:
+                    with open(file, 'rb') as in_fh:
+                        span.add_bytes(out_fh.write(in_fh.read()))
 
         return out_filepath
@@ -1,103 +1,359 @@
-from typing import List
+from array import array
+from typing import Iterable, List, Tuple
 import re
 
 
+class EncryptionKey:
+    """
+    Encryption key (EXT-X-KEY tag) of the media segments, one object shared by all the segments using the key.
+    """
+    __slots__ = ('method', 'url', 'key_id', 'iv')
+
+    def __init__(self, method: str, url: str = None, key_id: str = None, iv: bytes = None):
+        """
+        :param iv: the IV attribute, None if the segments use their media sequence number as the iv.
+        """
+        self.method = method
+        self.url = url
+        self.key_id = key_id
+        self.iv = iv
+
+    def __eq__(self, other):
+        return isinstance(other, EncryptionKey) and \
+            (self.method, self.url, self.key_id, self.iv) == (other.method, other.url, other.key_id, other.iv)
+
+    def __repr__(self):
+        return 'EncryptionKey({!r}, {!r}, {!r}, {!r})'.format(self.method, self.url, self.key_id, self.iv)
+
+
+class Segment:
+    """
+    A media segment (stream file) of a track.
+    """
+    __slots__ = ('file_number', 'duration', 'url', 'key', 'sequence', 'byte_range')
+
+    def __init__(self, file_number: int, duration: float, url: str, key: EncryptionKey = None, sequence: int = None,
+                 byte_range: Tuple[int, int] = None):
+        """
+        :param file_number: index of the segment in the playlist.
+        :param sequence: media sequence number, EXT-X-MEDIA-SEQUENCE + file_number.
+        :param byte_range: (offset, length) of the segment in the resource at url, None for the whole resource.
+        """
+        self.file_number = file_number
+        self.duration = duration
+        self.url = url
+        self.key = key
+        self.sequence = file_number if sequence is None else sequence
+        self.byte_range = byte_range
+
+    @property
+    def iv(self):
+        """
+        Initialization vector for decrypting the segment, the IV attribute of the key if given, the media sequence
+        number (as a 128 bit big endian integer) otherwise.
+        """
+        if self.key and self.key.iv:
+            return self.key.iv
+        return self.sequence.to_bytes(16, 'big')
+
+    @property
+    def encryption_method(self):
+        return self.key.method if self.key else 'NONE'
+
+    @property
+    def encryption_key_url(self):
+        return self.key.url if self.key else None
+
+    @property
+    def encryption_key_id(self):
+        return self.key.key_id if self.key else None
+
+    def __eq__(self, other):
+        return isinstance(other, Segment) and \
+            (self.file_number, self.duration, self.url, self.key, self.sequence, self.byte_range) == \
+            (other.file_number, other.duration, other.url, other.key, other.sequence, other.byte_range)
+
+    def __repr__(self):
+        return 'Segment({!r}, {!r}, {!r}, {!r}, {!r}, {!r})'.format(
+            self.file_number, self.duration, self.url, self.key, self.sequence, self.byte_range)
+
+
+class Track:
+    """
+    Media segments of a track, stored column wise in arrays, Segment objects are created as the items are accessed.
+    All the segments of a track share the base url, only the file names are stored per segment, packed in a
+    single buffer.
+    """
+
+    def __init__(self, keys: List[EncryptionKey], base_url: str = None, media_sequence: int = 0):
+        """
+        :param keys: encryption keys of the playlist, the segments refer to these by index.
+        :param base_url: url of the directory containing the segment files.
+        :param media_sequence: media sequence number of the first segment of the playlist.
+        """
+        self.keys = keys
+        self.base_url = base_url
+        self.media_sequence = media_sequence
+        self.names = bytearray()
+        self.name_offsets = array('i', [0])
+        self.file_numbers = array('i')
+        self.durations = array('d')
+        self.key_indexes = array('i')   # index in keys, -1 if the segment is not encrypted.
+        self.range_offsets = array('q')     # byte range of the segment, -1 if it is the whole resource.
+        self.range_lengths = array('q')
+
+    def append(self, file_number: int, duration: float, name: str, key_index: int, byte_range: Tuple = None):
+        self.file_numbers.append(file_number)
+        self.durations.append(duration)
+        self.names += name.encode('utf-8')
+        self.name_offsets.append(len(self.names))
+        self.key_indexes.append(key_index)
+        self.range_offsets.append(byte_range[0] if byte_range else -1)
+        self.range_lengths.append(byte_range[1] if byte_range else -1)
+
+    def __len__(self):
+        return len(self.file_numbers)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        key_index = self.key_indexes[index]
+        file_number = self.file_numbers[index]
+        byte_range = None
+        if self.range_offsets[index] >= 0:
+            byte_range = (self.range_offsets[index], self.range_lengths[index])
+        return Segment(file_number, self.durations[index],
+                       '{}/{}'.format(self.base_url, self.get_name(index)),
+                       self.keys[key_index] if key_index >= 0 else None,
+                       self.media_sequence + file_number, byte_range)
+
+    def get_name(self, index: int):
+        if index < 0:
+            index += len(self)
+        return self.names[self.name_offsets[index]:self.name_offsets[index + 1]].decode('utf-8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def duration(self):
+        return sum(self.durations)
+
+    def slice(self, start: int, stop: int):
+        """
+        Track with the segments [start, stop) of this track.
+        """
+        track = Track(self.keys, self.base_url, self.media_sequence)
+        name_offset = self.name_offsets[start]
+        track.names = self.names[name_offset:self.name_offsets[stop]]
+        track.name_offsets = array('i', [x - name_offset for x in self.name_offsets[start:stop + 1]])
+        track.file_numbers = self.file_numbers[start:stop]
+        track.durations = self.durations[start:stop]
+        track.key_indexes = self.key_indexes[start:stop]
+        track.range_offsets = self.range_offsets[start:stop]
+        track.range_lengths = self.range_lengths[start:stop]
+        return track
+
+    def __eq__(self, other):
+        if not isinstance(other, (Track, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(x == y for x, y in zip(self, other))
+
+    def __repr__(self):
+        return 'Track({!r}, {} segments)'.format(self.base_url, len(self))
+
+
 class M3u8Parser:
     """
     m3u8 parsing logic.
+    Lines are matched by prefix / sliced, and the attributes of the (rare) EXT-X-KEY lines by precompiled
+    patterns. The segments are stored in a compact Track per base url, see Track.
+    Supported tags: EXTINF, EXT-X-KEY (METHOD, URI, IV), EXT-X-MEDIA-SEQUENCE and EXT-X-BYTERANGE.
     """
 
-    def __init__(self, content_list: List = None, num_tracks=1):
+    # EXT-X-KEY attributes, and the key id in the key url.
+    key_method_pattern = re.compile(r'METHOD=([A-Z0-9-]+)')
+    key_uri_pattern = re.compile(r'URI="([^"]*)"')
+    key_iv_pattern = re.compile(r'IV=0[xX]([0-9a-fA-F]+)')
+    key_id_pattern = re.compile(r'keyid=([0-9]+)')
+
+    def __init__(self, content_list: Iterable = None, num_tracks=1):
+        """
+        :param content_list: lines of the playlist, any iterable (list, open file, response.iter_lines()) of str
+        or bytes, consumed by parse().
+        :param num_tracks: number of tracks expected.
+        """
         if content_list:
             self.m3u8_content = content_list
         else:
             self.m3u8_content = []
 
-        # Tracks object is a list of lists, example:
-        # [
-        #  [
-        #   { "file_number": 123, "duration": 7200, "encryption_key_file": "100",
-        #   "encryption_method": "AES-128", 'url": 'http://...' },
-        #   { "file_number": 456, "duration": 5400, "encryption_key_file": None,
-        #   "encryption_method": "NONE", 'url": 'http://...' },
-        #   ...
-        #  ],
-        #  [
-        #   { "file_number": 999, "duration": 7500, "encryption_key_file": "777",
-        #   "encryption_method": "AES-128", 'url": 'http://...' },
-        #   { "file_number": 888, "duration": 3600, "encryption_key_file": None,
-        #   "encryption_method": "NONE", 'url": 'http://...' },
-        #   ...
-        #  ],
-        # ]
-        #
-        # Above example is a 2-track file with track 0 consisting of stream files 123, 456, ...
-        # and track 1 consisting of stream files 999, 888, ...
-        # Of these, streams 123 and 999 are encrypted, encryption keys stored in file 100 and 777
-        # respectively.
-        self.tracks = [list() for x in range(num_tracks)]   # noqa
+        # Tracks, in the order of the base urls of the segments, example:
+        # track 0: segments .../854x480_30/..._0000_hls_0.ts, ..._0001_hls_0.ts, ...
+        # track 1: segments .../854x480_30_1/..._0000_hls_0.ts, ...
+        # Each segment (see Segment) has a file number (running count across the tracks), a duration, url and
+        # the encryption key (None if not encrypted).
+        self.keys = list()
+        self.tracks = [Track(self.keys) for x in range(num_tracks)]   # noqa
+        self.track_index = dict()   # base url -> track index.
 
         # Summary object to provide a summary of m3u8 parsed content.
         self.summary = dict()
 
+        # parse state.
+        self.media_sequence = 0
+        self.next_byte_range = None     # (offset, length) from EXT-X-BYTERANGE, for the next segment.
+        self.range_ends = dict()        # url -> end of the last byte range of the resource.
+        self.current_file_number = -1
+        self.current_file_duration = 0.0
+        self.current_key_index = -1
+        self.key_files = 0
+        self.total_duration = 0.0
+
+    def parse_key(self, line: str):
+        method_match = self.key_method_pattern.search(line)
+        method = method_match.group(1) if method_match else 'NONE'
+        if method == 'NONE':
+            self.current_key_index = -1
+            return
+
+        uri_match = self.key_uri_pattern.search(line)
+        url = uri_match.group(1) if uri_match else None
+        key_id_match = self.key_id_pattern.search(url) if url else None
+        iv_match = self.key_iv_pattern.search(line)
+        iv = int(iv_match.group(1), 16).to_bytes(16, 'big') if iv_match else None
+        self.keys.append(EncryptionKey(method, url, key_id_match.group(1) if key_id_match else url, iv))
+        self.current_key_index = len(self.keys) - 1
+        self.key_files += 1
+
+    def parse_byte_range(self, value: str):
+        # <length>[@<offset>], the offset defaults to the end of the previous byte range of the same resource.
+        length, _, offset = value.partition('@')
+        self.next_byte_range = (int(offset) if offset else None, int(length))
+
+    def add_segment(self, url: str):
+        self.current_file_number += 1
+        base_url, _, name = url.rpartition('/')
+        track_index = self.track_index.get(base_url)
+        if track_index is None:
+            track_index = self.track_index[base_url] = len(self.track_index)
+            if track_index == len(self.tracks):
+                self.tracks.append(Track(self.keys))
+            self.tracks[track_index].base_url = base_url
+            self.tracks[track_index].media_sequence = self.media_sequence
+
+        byte_range = self.next_byte_range
+        if byte_range:
+            offset, length = byte_range
+            if offset is None:
+                offset = self.range_ends.get(url, 0)
+            byte_range = (offset, length)
+            self.range_ends[url] = offset + length
+            self.next_byte_range = None
+        self.tracks[track_index].append(self.current_file_number, self.current_file_duration, name,
+                                        self.current_key_index, byte_range)
+
+    def feed(self, line):
+        """
+        Parse a line of the playlist, for parsing incrementally.
+        """
+        if type(line) == bytes:
+            line = line.decode('utf-8')
+        line = line.strip()
+        if line.startswith('#EXTINF:'):    # duration
+            self.current_file_duration = float(line[8:].partition(',')[0])
+            self.total_duration += self.current_file_duration
+        elif line.startswith('http'):       # media file
+            self.add_segment(line)
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            self.parse_byte_range(line[17:])
+        elif line.startswith('#EXT-X-KEY:'):   # encryption algorithm
+            self.parse_key(line)
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            self.media_sequence = int(line[22:])
+
     def parse(self):
         """
         Parse the m3u8 file and create mapping of stream files to their encryption algorithm and encryption key file.
         Also, populate the summary object listing total number of files, number of keys and total duration.
         """
+        for line in self.m3u8_content:
+            self.feed(line)
+        return self.get_summary(), self.tracks
 
-        url_maps = dict()
-
-        current_file_number = -1
-        current_file_duration = 0
-        current_encryption_method = "NONE"
-        current_encryption_key_url = None
-
-        key_id = 0
-        key_files = 0
-        media_files = 0
-        total_duration = 0
-        for index, token in enumerate(self.m3u8_content):
-            if str(token).startswith("#EXT-X-KEY:METHOD"):  # encryption algorithm
-                current_encryption_method = re.sub(r"^#EXT-X-KEY:METHOD=([A-Z0-9-]+).*$", r"\1", token)
-                if current_encryption_method == "NONE":
-                    current_encryption_key_url = None
-                else:
-                    current_encryption_key_url = re.sub(r"^#EXT-X-KEY:METHOD=([A-Z0-9-]+).*(http.*)\"$", r"\2", token)
-                    key_id = re.sub(r"^.*keyid=([0-9]+).*$", r"\1", current_encryption_key_url)
-                    key_files += 1
-
-            elif str(token).startswith("#EXTINF:"):  # duration
-                current_file_duration = float(re.sub(r'^#EXTINF:([0-9]+\.[0-9]+),.*', r"\1", token))
-                total_duration += current_file_duration
-            elif str(token).startswith("http"):  # media file
-                current_file_number += 1
-                media_files += 1
-
-                url = str(token).strip()
-                base_url = self.get_base_url(url)
-                if url_maps.get(base_url) is None:
-                    url_maps[base_url] = len(url_maps.keys())
-
-                current_track = url_maps[base_url]
-                self.tracks[current_track].append({
-                    "file_number": current_file_number,
-                    "duration": current_file_duration,
-                    "encryption_key_url": current_encryption_key_url,
-                    "encryption_key_id": key_id,
-                    "encryption_method": current_encryption_method,
-                    "url": url,
-                })
-            else:
-                continue
-
+    def get_summary(self):
+        media_files = self.current_file_number + 1
         self.summary = {
-            "key_files": key_files,
+            "key_files": self.key_files,
             "media_files": media_files,
-            "total_files": key_files + media_files,
-            "total_duration": round(total_duration),   # combined of all tracks.
+            "total_files": self.key_files + media_files,
+            "total_duration": round(self.total_duration),   # combined of all tracks.
         }
-        return self.summary, self.tracks
+        return self.summary
+
+    @staticmethod
+    def get_base_url(url: str):
+        return url.rpartition('/')[0]
+
+    @staticmethod
+    def needs_split(tracks: List[Track]):
+        """
+        Impartus platform has some m3u8 streams that are badly coded, and put all the stream contents to a single
+        track, despite the metadata claiming to have more than 1 tracks. Whether the tracks are such.
+        """
+        return len(tracks) > 1 and len(tracks[0]) > 0 and all(len(track) == 0 for track in tracks[1:])
+
+    @staticmethod
+    def split_track(tracks: List[Track], duration: float):
+        """
+        Split the content of track 0 across all the tracks, at the segment boundaries, by the cumulative duration of
+        the segments. A segment goes to the track its mid point falls in, track n covering [n * duration,
+        (n + 1) * duration), any excess goes to the last track.
+        :param tracks: tracks, all the segments in track 0, see needs_split().
+        :param duration: duration of a track (actualDuration of the lecture), even split of the total if 0.
+        :return: list of tracks.
+        """
+        track = tracks[0]
+        num_tracks = len(tracks)
+        even_duration = track.duration() / num_tracks
+        if not duration or duration <= 0:
+            duration = even_duration
+
+        boundaries = [0]
+        elapsed = 0.0
+        for index, segment_duration in enumerate(track.durations):
+            track_index = min(int((elapsed + segment_duration / 2) // duration), num_tracks - 1)
+            while len(boundaries) <= track_index:
+                boundaries.append(index)
+            elapsed += segment_duration
+        while len(boundaries) <= num_tracks:
+            boundaries.append(len(track))
+        if duration != even_duration and len(set(boundaries)) < len(boundaries):
+            # duration does not fit the content, and a track would be left empty, split evenly instead.
+            return M3u8Parser.split_track(tracks, even_duration)
+        return [track.slice(boundaries[index], boundaries[index + 1]) for index in range(num_tracks)]
 
-    def get_base_url(self, url: str):
-        return re.sub('/[^/]+\.[a-zA-Z0-9]{2,3}$', '', url)
\ No newline at end of file
+    @staticmethod
+    def coalesce_byte_ranges(indexed_segments: Iterable[Tuple[int, Segment]], max_length: int):
+        """
+        Group the segments that can be fetched with a single range request - consecutive segments of a track,
+        with adjacent byte ranges of the same resource, up to max_length bytes per group.
+        :param indexed_segments: (stream index, segment) tuples of a track, in order.
+        :param max_length: max number of bytes in a group, segments longer than this are grouped by themselves.
+        :return: generator of lists of (stream index, segment) tuples.
+        """
+        group = list()
+        group_length = 0
+        for stream_index, segment in indexed_segments:
+            if group:
+                last_index, last = group[-1]
+                if segment.byte_range is None or last.byte_range is None or stream_index != last_index + 1 \
+                        or segment.url != last.url or segment.byte_range[0] != sum(last.byte_range) \
+                        or group_length + segment.byte_range[1] > max_length:
+                    yield group
+                    group = list()
+                    group_length = 0
+            group.append((stream_index, segment))
+            group_length += segment.byte_range[1] if segment.byte_range else 0
+        if group:
+            yield group
@@ -0,0 +1,220 @@
+import os
+import struct
+from typing import BinaryIO, Dict
+
+
+class MalformedMKVError(Exception):
+    pass
+
+
+class MkvTags:
+    """
+    Minimal EBML reader for the (global) tags of a matroska file.
+
+    Only the elements on the way to the Tags element are read: the EBML header, the Segment header and the
+    SeekHead, which points at the Tags element (ffmpeg writes the tags at the end of the file). If there is no
+    SeekHead entry for the Tags, the top level elements are walked over (a seek per element, cluster contents
+    are never read), and as a last resort the tail end of the file is scanned for the Tags element id.
+    """
+
+    EBML = 0x1A45DFA3
+    SEGMENT = 0x18538067
+    SEEK_HEAD = 0x114D9B74
+    SEEK = 0x4DBB
+    SEEK_ID = 0x53AB
+    SEEK_POSITION = 0x53AC
+    TAGS = 0x1254C367
+    TAG = 0x7373
+    SIMPLE_TAG = 0x67C8
+    TAG_NAME = 0x45A3
+    TAG_STRING = 0x4487
+
+    # bounds for the fallback scans.
+    max_elements = 100000
+    tail_scan_size = 1 << 20
+
+    def __init__(self, fh: BinaryIO):
+        self.fh = fh
+        self.file_size = fh.seek(0, os.SEEK_END)
+        fh.seek(0)
+
+    @staticmethod
+    def _vint(data: bytes, offset: int, keep_marker: bool):
+        """
+        Decode the variable length integer at data[offset].
+        :return: (value, length), value is None for the reserved 'unknown' (all ones) value.
+        """
+        first = data[offset]
+        length = 1
+        mask = 0x80
+        while length <= 8 and not first & mask:
+            length += 1
+            mask >>= 1
+        if length > 8:
+            raise MalformedMKVError('Bad variable length integer at {}'.format(offset))
+        if offset + length > len(data):
+            raise MalformedMKVError('Truncated variable length integer at {}'.format(offset))
+
+        value = first if keep_marker else first & (mask - 1)
+        all_ones = value == mask - 1
+        for byte in data[offset + 1:offset + length]:
+            value = (value << 8) | byte
+            all_ones = all_ones and byte == 0xFF
+        if all_ones and not keep_marker:
+            return None, length
+        return value, length
+
+    def _read_element_header(self, position: int):
+        """
+        :return: (element id, data size, data position), data size is None for elements of unknown size.
+        """
+        self.fh.seek(position)
+        header = self.fh.read(12)
+        if not header:
+            raise EOFError()
+        element_id, id_length = self._vint(header, 0, keep_marker=True)
+        size, size_length = self._vint(header, id_length, keep_marker=False)
+        return element_id, size, position + id_length + size_length
+
+    def _children(self, data: bytes):
+        """
+        Iterate over the (element id, contents) of the elements in the master element contents.
+        """
+        offset = 0
+        while offset < len(data):
+            element_id, id_length = self._vint(data, offset, keep_marker=True)
+            size, size_length = self._vint(data, offset + id_length, keep_marker=False)
+            start = offset + id_length + size_length
+            if size is None or start + size > len(data):
+                raise MalformedMKVError('Bad element size at {}'.format(offset))
+            yield element_id, data[start:start + size]
+            offset = start + size
+
+    def _read_master(self, position: int, expected_id: int):
+        element_id, size, data_position = self._read_element_header(position)
+        if element_id != expected_id or size is None or data_position + size > self.file_size:
+            raise MalformedMKVError('Expected element {:X} at {}'.format(expected_id, position))
+        self.fh.seek(data_position)
+        return self.fh.read(size)
+
+    def _segment_data_position(self):
+        element_id, size, data_position = self._read_element_header(0)
+        if element_id != self.EBML:
+            raise MalformedMKVError('Not a matroska file.')
+        element_id, _, segment_position = self._read_element_header(data_position + size)
+        if element_id != self.SEGMENT:
+            raise MalformedMKVError('No Segment found.')
+        return segment_position
+
+    def _find_in_seek_head(self, segment_position: int, seek_head_position: int, depth: int = 0):
+        seek_heads = list()
+        for element_id, data in self._children(self._read_master(seek_head_position, self.SEEK_HEAD)):
+            if element_id != self.SEEK:
+                continue
+            seek = dict(self._children(data))
+            if self.SEEK_ID not in seek or self.SEEK_POSITION not in seek:
+                continue
+            target_id = int.from_bytes(seek[self.SEEK_ID], 'big')
+            target_position = segment_position + int.from_bytes(seek[self.SEEK_POSITION], 'big')
+            if target_id == self.TAGS:
+                return target_position
+            if target_id == self.SEEK_HEAD and target_position != seek_head_position:
+                seek_heads.append(target_position)
+
+        # a SeekHead may point to another SeekHead (usually at the end of the file).
+        if depth < 2:
+            for position in seek_heads:
+                tags_position = self._find_in_seek_head(segment_position, position, depth + 1)
+                if tags_position is not None:
+                    return tags_position
+        return None
+
+    def _find_tags(self):
+        """
+        :return: position of the Tags element, None if there is none.
+        """
+        segment_position = self._segment_data_position()
+        position = segment_position
+        for _ in range(self.max_elements):
+            if position >= self.file_size:
+                return None
+            element_id, size, data_position = self._read_element_header(position)
+            if element_id == self.TAGS:
+                return position
+            if element_id == self.SEEK_HEAD:
+                tags_position = self._find_in_seek_head(segment_position, position)
+                if tags_position is not None:
+                    return tags_position
+            if size is None:
+                # live streams have clusters of unknown size, these cannot be skipped.
+                break
+            position = data_position + size
+        return self._scan_tail()
+
+    def _scan_tail(self):
+        start = max(0, self.file_size - self.tail_scan_size)
+        self.fh.seek(start)
+        data = self.fh.read()
+        tags_id = struct.pack('>I', self.TAGS)
+        index = data.rfind(tags_id)
+        while index >= 0:
+            try:
+                self._read_master(start + index, self.TAGS)
+                return start + index
+            except (MalformedMKVError, EOFError):
+                index = data.rfind(tags_id, 0, index)
+        return None
+
+    def _simple_tags(self, data: bytes, tags: Dict):
+        name = value = None
+        nested = list()
+        for element_id, contents in self._children(data):
+            if element_id == self.TAG_NAME:
+                name = contents.decode('utf-8', 'replace')
+            elif element_id == self.TAG_STRING:
+                value = contents.decode('utf-8', 'replace').rstrip('\0')
+            elif element_id == self.SIMPLE_TAG:
+                nested.append(contents)
+        if name is not None and value is not None:
+            tags.setdefault(name, value)
+        for contents in nested:
+            self._simple_tags(contents, tags)
+
+    def read(self) -> Dict:
+        """
+        Read the tags, names are as written in the file (ffmpeg upper cases them).
+        :return: dict of tag name to tag value, if a tag appears more than once the first one is returned.
+        """
+        try:
+            position = self._find_tags()
+            tags = dict()
+            if position is None:
+                return tags
+            for element_id, data in self._children(self._read_master(position, self.TAGS)):
+                if element_id != self.TAG:
+                    continue
+                for child_id, contents in self._children(data):
+                    if child_id == self.SIMPLE_TAG:
+                        self._simple_tags(contents, tags)
+            return tags
+        except (EOFError, IndexError) as ex:
+            raise MalformedMKVError('Truncated file: {}'.format(ex))
+
+    @classmethod
+    def get_tags(cls, filepath: str) -> Dict:
+        with open(filepath, 'rb') as fh:
+            return cls(fh).read()
+
+    @classmethod
+    def get_rfid(cls, filepath: str):
+        """
+        ttid / fcid saved in the mkv tags by Encoder.
+        :return: (rf_id, is_flipped), (None, None) if the file has neither.
+        """
+        tags = cls.get_tags(filepath)
+        for name, value in tags.items():
+            if name.upper() == 'TTID':
+                return int(value), False
+            if name.upper() == 'FCID':
+                return int(value), True
+        return None, None
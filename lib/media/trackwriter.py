@@ -0,0 +1,198 @@
+import errno
+import os
+import time
+from queue import Queue
+from threading import Condition, Event, Thread
+
+
+class TrackWriter:
+    """
+    Appends (decrypted) stream contents to a track file, in playlist order.
+
+    Streams may arrive out of order when downloaded concurrently, these are held in memory till all the streams
+    preceding them have been written. The number of streams waiting in memory is capped to max_pending, writers
+    of later streams block till the earlier ones arrive.
+
+    Every stream written is recorded in a journal file (<track file>.journal) as a line '<index> <offset>',
+    on a restart the track file is truncated to the last journaled offset and the download resumes from the
+    next stream.
+    """
+
+    def __init__(self, filepath: str, max_pending: int = 16):
+        self.filepath = filepath
+        self.journal_filepath = '{}.journal'.format(filepath)
+        self.max_pending = max(1, max_pending)
+
+        self.next_index, offset, journal_size = self._read_journal()
+        self.pending = dict()
+        self.condition = Condition()
+
+        # discard any content written past the last journal entry.
+        self.fh = self._open_truncated(filepath, offset)
+        self.journal_fh = self._open_truncated(self.journal_filepath, journal_size)
+
+    @staticmethod
+    def _open_truncated(filepath, size):
+        mode = 'r+b' if os.path.exists(filepath) else 'w+b'
+        fh = open(filepath, mode)
+        fh.truncate(size)
+        fh.seek(size)
+        return fh
+
+    def _read_journal(self):
+        index, offset, journal_size = 0, 0, 0
+        if os.path.exists(self.journal_filepath):
+            with open(self.journal_filepath, 'rb') as fh:
+                for line in fh:
+                    # a partially written last line is ignored.
+                    if not line.endswith(b'\n'):
+                        break
+                    last_index, last_offset = line.split()
+                    index, offset = int(last_index) + 1, int(last_offset)
+                    journal_size += len(line)
+        return index, offset, journal_size
+
+    def completed(self):
+        """
+        Number of streams written to the track file so far.
+        """
+        with self.condition:
+            return self.next_index
+
+    def _append(self, data: bytes):
+        self.fh.write(data)
+        self.fh.flush()
+
+        # journal the stream only once its contents have reached the track file.
+        self.journal_fh.write('{} {}\n'.format(self.next_index, self.fh.tell()).encode())
+        self.journal_fh.flush()
+
+    def _backlogged(self):
+        # True to hold the writers back, till the contents written so far are consumed.
+        return False
+
+    def _flush_pending(self):
+        while self.next_index in self.pending:
+            self._append(self.pending.pop(self.next_index))
+            self.next_index += 1
+        self.condition.notify_all()
+
+    def write(self, index: int, data: bytes, abort_ev: Event = None):
+        """
+        Queue the contents of stream number [index] for the track.
+        :param index: position of the stream in the track (0 based).
+        :param data: stream contents.
+        :param abort_ev: if set, stop waiting for the earlier streams and return without writing.
+        :return: True if the stream was accepted.
+        """
+        with self.condition:
+            if index < self.next_index:
+                return True
+            while index - self.next_index >= self.max_pending or self._backlogged():
+                if abort_ev and abort_ev.is_set():
+                    return False
+                self.condition.wait(timeout=1.0)
+            self.pending[index] = data
+            self._flush_pending()
+            return True
+
+    def close(self):
+        with self.condition:
+            self.fh.close()
+            self.journal_fh.close()
+
+
+class PipedTrackWriter(TrackWriter):
+    """
+    TrackWriter variant that feeds the track to a named pipe (fifo) read by another process (ffmpeg),
+    instead of a track file.
+    The fifo is opened and written to from a dedicated thread, so the download workers never block on
+    the reading process. There is no journal, as the contents sent down the pipe cannot be resumed.
+
+    Streams handed to the thread are queued without blocking, writers wait (on the condition, abortable) while
+    max_pending streams are queued. If the reader stops reading, the thread stays blocked on the pipe: kill the
+    reader before close(abort=True).
+    """
+
+    def __init__(self, fifo_path: str, max_pending: int = 16, reader_alive=None):
+        """
+        :param fifo_path: path of an existing fifo.
+        :param max_pending: max number of streams held in memory.
+        :param reader_alive: callable returning False once the reading process has exited.
+        """
+        self.filepath = fifo_path
+        self.journal_filepath = None
+        self.max_pending = max(1, max_pending)
+        self.next_index = 0
+        self.pending = dict()
+        self.condition = Condition()
+
+        self.reader_alive = reader_alive
+        self.error = None
+        self.abort_ev = Event()
+        self.queue = Queue()
+        self.thread = Thread(target=self._pipe_writer, daemon=True)
+        self.thread.start()
+
+    def _open_fifo(self):
+        # opening a fifo for writing blocks till the reader opens its end, ffmpeg opens its inputs one after
+        # the other, so poll in non-blocking mode (and give up if the reader goes away).
+        while True:
+            try:
+                fd = os.open(self.filepath, os.O_WRONLY | os.O_NONBLOCK)
+                os.set_blocking(fd, True)
+                return os.fdopen(fd, 'wb')
+            except OSError as ex:
+                if ex.errno != errno.ENXIO:
+                    raise
+            if self.reader_alive and not self.reader_alive():
+                raise BrokenPipeError('reader for {} exited.'.format(self.filepath))
+            time.sleep(0.1)
+
+    def _pipe_writer(self):
+        fh = None
+        try:
+            fh = self._open_fifo()
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                if not self.abort_ev.is_set():
+                    fh.write(data)
+                with self.condition:
+                    self.condition.notify_all()
+        except OSError as ex:
+            self.error = ex
+            # keep draining, so that the queued streams are not held in memory.
+            while self.queue.get() is not None:
+                pass
+        finally:
+            if fh:
+                try:
+                    fh.close()
+                except OSError:
+                    pass
+
+    def _backlogged(self):
+        return self.queue.qsize() >= self.max_pending and self.thread.is_alive() and not self.abort_ev.is_set()
+
+    def _append(self, data: bytes):
+        # never blocks, the writers are held back by _backlogged() instead.
+        self.queue.put_nowait(data)
+
+    def write(self, index: int, data: bytes, abort_ev: Event = None):
+        if self.abort_ev.is_set():
+            return False
+        return super().write(index, data, abort_ev)
+
+    def close(self, abort: bool = False):
+        """
+        Feed the streams queued so far to the pipe and close it.
+        :param abort: discard the streams queued instead, the reading process is expected to have been killed.
+        """
+        if abort:
+            self.abort_ev.set()
+        with self.condition:
+            self.queue.put_nowait(None)
+            self.condition.notify_all()
+        self.thread.join()
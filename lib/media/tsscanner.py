@@ -0,0 +1,189 @@
+from typing import Tuple
+
+import numpy as np
+
+
+class InvalidStreamError(RuntimeError):
+    """
+    Downloaded stream is not MPEG-TS data (error page, truncated / corrupted content, or decrypted with a wrong key).
+    """
+    pass
+
+
+class TsInfo:
+    """
+    Summary of the MPEG-TS packets scanned by TsScanner.
+    """
+
+    def __init__(self):
+        self.packets = 0
+        self.sync_errors = 0            # packets not starting with the sync byte.
+        self.trailing_bytes = 0         # bytes left over after the last full packet.
+        self.pid_packets = dict()       # pid -> number of packets.
+        self.pcr_range = None           # (first, last) program clock reference, in seconds.
+        self.pts_ranges = dict()        # pid -> (min, max) presentation timestamp of the audio / video PES, seconds.
+        self.pts_offsets = dict()       # pid -> byte offset of the first packet with a PTS.
+
+    @staticmethod
+    def _merge_range(current: Tuple, other: Tuple, first_last: bool = False):
+        if current is None:
+            return other
+        if other is None:
+            return current
+        if first_last:
+            return current[0], other[1]
+        return min(current[0], other[0]), max(current[1], other[1])
+
+    def merge(self, other):
+        """
+        Add the packets of other, coming after the packets of this one.
+        """
+        for pid, offset in other.pts_offsets.items():
+            self.pts_offsets.setdefault(pid, self.packets * TsScanner.packet_size + offset)
+        self.packets += other.packets
+        self.sync_errors += other.sync_errors
+        self.trailing_bytes = other.trailing_bytes
+        for pid, count in other.pid_packets.items():
+            self.pid_packets[pid] = self.pid_packets.get(pid, 0) + count
+        self.pcr_range = self._merge_range(self.pcr_range, other.pcr_range, first_last=True)
+        for pid, pts_range in other.pts_ranges.items():
+            self.pts_ranges[pid] = self._merge_range(self.pts_ranges.get(pid), pts_range)
+        return self
+
+    def is_valid(self):
+        return self.packets > 0 and self.sync_errors == 0 and self.trailing_bytes == 0
+
+    def duration(self):
+        """
+        Duration in seconds, from the timestamps of the longest audio / video stream, or the PCR if there are none.
+        Frame duration of the last frame is not included. None if there are no timestamps.
+        """
+        if self.pts_ranges:
+            return max(last - first for first, last in self.pts_ranges.values())
+        if self.pcr_range:
+            return self.pcr_range[1] - self.pcr_range[0]
+        return None
+
+    def start_spread(self):
+        """
+        Seconds between the first timestamps of the audio / video streams, 0 if there are less than two streams.
+        """
+        starts = [first for first, _ in self.pts_ranges.values()]
+        return max(starts) - min(starts) if starts else 0
+
+    def __repr__(self):
+        return 'TsInfo(packets={}, sync_errors={}, trailing_bytes={}, duration={})'.format(
+            self.packets, self.sync_errors, self.trailing_bytes, self.duration())
+
+
+class TsScanner:
+    """
+    Scans MPEG-TS data with numpy, a chunk of packets at a time: sync bytes, packets per PID, PCR range and the PTS
+    range of the audio / video streams. Used to validate the downloaded streams, and find the duration of the tracks.
+    """
+    packet_size = 188
+    sync_byte = 0x47
+
+    # packets scanned at a time by scan_file(), 12 MB.
+    chunk_packets = 1 << 16
+
+    # PES header bytes read: start code (3), stream id, length (2), flags (2), header length, PTS (5).
+    pes_header_size = 14
+
+    @classmethod
+    def _timestamp_ranges(cls, packets: np.ndarray, pids: np.ndarray, valid: np.ndarray, info: TsInfo):
+        adaptation_field = (packets[:, 3] & 0x20) != 0
+        has_payload = (packets[:, 3] & 0x10) != 0
+        adaptation_length = np.where(adaptation_field, packets[:, 4], 0).astype(np.int32)
+
+        # PCR, 33 bit base at 90 kHz followed by a 9 bit extension at 27 MHz.
+        has_pcr = valid & adaptation_field & (adaptation_length >= 7) & ((packets[:, 5] & 0x10) != 0)
+        if has_pcr.any():
+            pcr_bytes = packets[has_pcr][:, 6:12].astype(np.uint64)
+            base = (pcr_bytes[:, 0] << 25) | (pcr_bytes[:, 1] << 17) | (pcr_bytes[:, 2] << 9) | \
+                   (pcr_bytes[:, 3] << 1) | (pcr_bytes[:, 4] >> 7)
+            extension = ((pcr_bytes[:, 4] & 1) << 8) | pcr_bytes[:, 5]
+            pcr = (base * 300 + extension) / 27e6
+            info.pcr_range = (float(pcr[0]), float(pcr[-1]))
+
+        # PTS, from the PES headers at the start of the payloads.
+        payload_start = 4 + np.where(adaptation_field, adaptation_length + 1, 0)
+        starts_pes = valid & ((packets[:, 1] & 0x40) != 0) & has_payload & \
+            (payload_start + cls.pes_header_size <= cls.packet_size)
+        if not starts_pes.any():
+            return
+        offsets = payload_start[starts_pes][:, None] + np.arange(cls.pes_header_size)
+        pes = np.take_along_axis(packets[starts_pes], offsets, axis=1).astype(np.uint64)
+        # audio (0xc0 - 0xdf) and video (0xe0 - 0xef) streams, with a PTS.
+        has_pts = (pes[:, 0] == 0) & (pes[:, 1] == 0) & (pes[:, 2] == 1) & \
+            (pes[:, 3] >= 0xc0) & (pes[:, 3] <= 0xef) & ((pes[:, 6] & 0xc0) == 0x80) & ((pes[:, 7] & 0x80) != 0)
+        if not has_pts.any():
+            return
+        pes = pes[has_pts]
+        pts = (((pes[:, 9] >> 1) & 7) << 30) | (pes[:, 10] << 22) | ((pes[:, 11] >> 1) << 15) | \
+              (pes[:, 12] << 7) | (pes[:, 13] >> 1)
+        pts = pts / 90000.0
+        pes_pids = pids[starts_pes][has_pts]
+        pes_packets = np.flatnonzero(starts_pes)[has_pts]
+        for pid in np.unique(pes_pids):
+            pid_pes = pes_pids == pid
+            pid_pts = pts[pid_pes]
+            info.pts_ranges[int(pid)] = (float(pid_pts.min()), float(pid_pts.max()))
+            info.pts_offsets[int(pid)] = int(pes_packets[pid_pes][0]) * cls.packet_size
+
+    @classmethod
+    def scan_bytes(cls, content) -> TsInfo:
+        """
+        Scan the TS packets in content (bytes-like).
+        """
+        info = TsInfo()
+        data = np.frombuffer(content, dtype=np.uint8)
+        count = len(data) // cls.packet_size
+        info.packets = count
+        info.trailing_bytes = len(data) - count * cls.packet_size
+        if count == 0:
+            return info
+
+        packets = data[:count * cls.packet_size].reshape(count, cls.packet_size)
+        valid = packets[:, 0] == cls.sync_byte
+        info.sync_errors = int(count - np.count_nonzero(valid))
+
+        pids = ((packets[:, 1].astype(np.uint16) & 0x1f) << 8) | packets[:, 2]
+        pid_values, pid_counts = np.unique(pids[valid], return_counts=True)
+        info.pid_packets = {int(pid): int(pid_count) for pid, pid_count in zip(pid_values, pid_counts)}
+
+        cls._timestamp_ranges(packets, pids, valid, info)
+        return info
+
+    @classmethod
+    def scan_file(cls, filepath: str) -> TsInfo:
+        """
+        Scan the TS packets of a file, chunk_packets at a time.
+        """
+        info = TsInfo()
+        chunk_size = cls.chunk_packets * cls.packet_size
+        with open(filepath, 'rb') as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                info.merge(cls.scan_bytes(chunk))
+        return info
+
+    @classmethod
+    def scan_head(cls, filepath: str, size: int) -> TsInfo:
+        """
+        Scan the TS packets in the first size bytes of a file.
+        """
+        with open(filepath, 'rb') as fh:
+            return cls.scan_bytes(fh.read(size - size % cls.packet_size))
+
+    @classmethod
+    def validate(cls, content, name: str):
+        """
+        :raise InvalidStreamError: if content is not a whole number of TS packets, all starting with the sync byte.
+        """
+        info = cls.scan_bytes(content)
+        if not info.is_valid():
+            raise InvalidStreamError('{} is not a valid TS stream: {}'.format(name, info))
+        return info
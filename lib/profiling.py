@@ -0,0 +1,161 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from threading import Lock
+from typing import Callable
+
+from lib.threadlogging import ThreadLogger
+
+
+class Profiler:
+    """
+    Profile a block of code with cProfile and / or tracemalloc, and dump the results to out_dir:
+    <name>-<timestamp>.pstats            cProfile stats, of all the threads run meanwhile (open with pstats / snakeviz).
+    <name>-<timestamp>.profile.txt       top functions by cumulative time.
+    <name>-<timestamp>.tracemalloc       tracemalloc snapshot (tracemalloc.Snapshot.load(), to compare with another).
+    <name>-<timestamp>.memory.txt        top allocations by line, with the current / peak traced memory.
+
+    with Profiler('sync', config_dir, profile=True, trace_memory=True):
+        ...
+
+    Before python 3.12, cProfile only sees the thread enabling it. Threads started while profiling are given a
+    profiler of their own, which switches itself off on the first event in its thread after the Profiler exits
+    (a profiler can only be disabled from its own thread); threads running from before are not seen.
+    """
+    thread_logger = ThreadLogger(__name__)
+
+    # frames kept per allocation traced.
+    memory_frames = 10
+
+    def __init__(self, name: str, out_dir: str, profile: bool = True, trace_memory: bool = False, top: int = 30):
+        """
+        :param name: prefix of the files written.
+        :param out_dir: directory to write the files to.
+        :param profile: profile with cProfile.
+        :param trace_memory: trace the memory allocations with tracemalloc.
+        :param top: number of functions / allocation sites listed in the text reports.
+        """
+        self.name = name
+        self.out_dir = out_dir
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.top = top
+        self.logger = self.__class__.thread_logger.logger
+
+        self.profiler = None
+        self.thread_profilers = list()
+        self.lock = Lock()
+        self.stopped = False
+        self.previous_thread_hook = None
+        self.started_tracemalloc = False
+        self.files = list()     # files written.
+
+    def _profile_thread(self, *args):   # noqa
+        # installed by threading.setprofile(), runs once in each new thread and hands over to a cProfile profiler.
+        profiler = cProfile.Profile(self._thread_timer)
+        with self.lock:
+            if self.stopped:
+                sys.setprofile(None)
+                return
+            self.thread_profilers.append(profiler)
+        profiler.enable()
+
+    def _thread_timer(self):
+        # timer of the thread profilers, called on every profiled event: once the Profiler has exited, the thread
+        # unhooks its profiler, so long lived threads (worker pools) do not keep paying for it.
+        if self.stopped:
+            sys.setprofile(None)
+        return time.perf_counter()
+
+    @staticmethod
+    def _get_thread_hook():
+        # threading.getprofile() is python 3.10+.
+        if hasattr(threading, 'getprofile'):
+            return threading.getprofile()
+        return getattr(threading, '_profile_hook', None)
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+            self.started_tracemalloc = True
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            if sys.version_info < (3, 12):
+                self.previous_thread_hook = self._get_thread_hook()
+                threading.setprofile(self._profile_thread)
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        filepath_prefix = os.path.join(self.out_dir, '{}-{}'.format(self.name, timestamp))
+        os.makedirs(self.out_dir, exist_ok=True)
+        if self.profiler:
+            self.profiler.disable()
+            if sys.version_info < (3, 12):
+                threading.setprofile(self.previous_thread_hook)
+            with self.lock:
+                self.stopped = True
+        # memory first, so that the allocations made dumping the profile are not counted.
+        if self.trace_memory and tracemalloc.is_tracing():
+            self._dump_memory(filepath_prefix)
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+        if self.profiler:
+            self._dump_profile(filepath_prefix)
+        if self.files:
+            self.logger.info("Profile of {} written to {}".format(self.name, ', '.join(self.files)))
+        return False
+
+    def _dump_profile(self, filepath_prefix: str):
+        stats = pstats.Stats(self.profiler)
+        with self.lock:
+            thread_profilers = list(self.thread_profilers)
+        for profiler in thread_profilers:
+            stats.add(profiler)
+
+        stats.dump_stats('{}.pstats'.format(filepath_prefix))
+        self.files.append('{}.pstats'.format(filepath_prefix))
+
+        report = io.StringIO()
+        stats.stream = report
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        with open('{}.profile.txt'.format(filepath_prefix), 'w') as fh:
+            fh.write(report.getvalue())
+        self.files.append('{}.profile.txt'.format(filepath_prefix))
+
+    def _dump_memory(self, filepath_prefix: str):
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ])
+        snapshot.dump('{}.tracemalloc'.format(filepath_prefix))
+        self.files.append('{}.tracemalloc'.format(filepath_prefix))
+
+        with open('{}.memory.txt'.format(filepath_prefix), 'w') as fh:
+            fh.write('traced memory: current {:.1f} MB, peak {:.1f} MB\n\n'.format(
+                current / (1 << 20), peak / (1 << 20)))
+            fh.write('top {} allocations by line:\n'.format(self.top))
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                fh.write('{}\n'.format(stat))
+        self.files.append('{}.memory.txt'.format(filepath_prefix))
+
+    @classmethod
+    def wrap(cls, func: Callable, name: str, out_dir: str, **kwargs):
+        """
+        func, profiled on every call, see Profiler() for the kwargs.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **func_kwargs):
+            with cls(name, out_dir, **kwargs):
+                return func(*args, **func_kwargs)
+        return wrapper
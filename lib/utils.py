@@ -34,6 +34,16 @@ class Utils:
             if os.path.exists(tmp_path):
                 return tmp_path
 
+    @staticmethod
+    def get_device(path):
+        """
+        Device id of the filesystem holding path, or the nearest existing parent directory of path.
+        """
+        path = os.path.abspath(path)
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        return os.stat(path).st_dev
+
     @staticmethod
     def open_file(path, event=None):   # noqa
 
@@ -126,7 +136,7 @@ class Utils:
         return False, path
 
     @classmethod
-    def run_with_priority(cls, command_args: List, priority='normal'):
+    def popen_with_priority(cls, command_args: List, priority='normal', **kwargs):
         if platform.system() == 'Windows':
             priorities = {
                 'normal': subprocess.NORMAL_PRIORITY_CLASS,
@@ -134,7 +144,7 @@ class Utils:
                 'lowest': subprocess.IDLE_PRIORITY_CLASS
             }
             priority_class = priorities[priority] if priorities.get(priority) else subprocess.NORMAL_PRIORITY_CLASS
-            process = subprocess.Popen(command_args, creationflags=priority_class)
+            return subprocess.Popen(command_args, creationflags=priority_class, **kwargs)
         else:
             nice_values = {
                 'normal': 0,
@@ -142,8 +152,16 @@ class Utils:
                 'lowest': 20,
             }
             nice_value = nice_values[priority] if nice_values.get(priority) else 0
-            process = subprocess.Popen(command_args, preexec_fn=lambda: os.nice(nice_value))
-        return process.wait()
+            return subprocess.Popen(command_args, preexec_fn=lambda: os.nice(nice_value), **kwargs)
+
+    @classmethod
+    def run_with_priority(cls, command_args: List, priority='normal'):
+        return cls.popen_with_priority(command_args, priority).wait()
+
+    @classmethod
+    def get_config_dir(cls):
+        conf = cls.conf
+        return conf.get(ConfigKeys.CONFIG_DIR.value).get(platform.system())
 
     @classmethod
     def strip_root_dir(cls, filepath: str):
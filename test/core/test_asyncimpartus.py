@@ -0,0 +1,89 @@
+import asyncio
+
+from aiohttp import web
+
+# path -> number of requests, for the /media/retry urls.
+_attempts = dict()
+
+
+async def _handler(request):
+    path = request.path
+    if path == '/api/auth/signin':
+        return web.json_response({'token': 'xyz'})
+    if path.startswith('/api/') and request.headers.get('Authorization') != 'Bearer xyz':
+        return web.Response(status=401)
+
+    if path == '/api/subjects':
+        return web.json_response([{'subjectId': 1, 'sessionId': 2, 'subjectName': 'Maths', 'professorName': 'Prof'}])
+    if path == '/api/subjects/1/lectures/2':
+        return web.json_response([{'ttid': 10, 'topic': 'Intro', 'seqNo': 1, 'subjectName': 'Maths',
+                                   'professorName': 'Prof', 'startTime': '2021-01-01 10:00:00',
+                                   'endTime': '2021-01-01 11:00:00'}])
+    if path == '/api/subjects/flipped/1/2':
+        return web.json_response([])
+    if path == '/api/subjects/backpack/1/sessions/2':
+        return web.json_response([{'filePath': 'docs/notes.pdf', 'fileName': 'notes.pdf'}])
+    if path.startswith('/media/retry'):
+        # fail the first request for each segment.
+        _attempts[path] = _attempts.get(path, 0) + 1
+        if _attempts[path] == 1:
+            return web.Response(status=503)
+    if path.startswith('/media/'):
+        return web.Response(body=path.encode())
+    if path == '/key':
+        return web.Response(body=b'xx' + bytes(range(16)))
+    return web.Response(status=404)
+
+
+def run_with_server(test_func):
+    async def run():
+        app = web.Application()
+        _attempts.clear()
+        app.router.add_route('*', '/{tail:.*}', _handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]   # noqa
+        try:
+            await test_func('http://127.0.0.1:{}'.format(port))
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_catalog():
+    from lib.core.asyncimpartus import AsyncImpartus
+    from lib.variables import Variables
+
+    async def test(server_url):
+        Variables().set_login_url(server_url)
+        async with AsyncImpartus() as imp:
+            assert await imp.login('user@example.com', 'password')
+            subjects = await imp.get_subjects()
+            assert [x['subjectId'] for x in subjects] == [1]
+
+            videos = [x async for x in imp.get_lecture_videos(subjects)]
+            assert [(video_id, is_flipped) for video_id, _, is_flipped in videos] == [(10, False)]
+
+            slides = [x async for x in imp.get_slides(subjects)]
+            assert [x['fileName'] for x in slides[0][1]] == ['notes']
+
+    run_with_server(test)
+
+
+def test_download_streams():
+    from lib.core.asyncimpartus import AsyncImpartus
+
+    async def test(server_url):
+        async with AsyncImpartus('xyz') as imp:
+            imp.max_retries = 1
+            urls = ['{}/media/{}.ts'.format(server_url, i) for i in range(500)]
+            urls.append('{}/media/retry.ts'.format(server_url))
+            streams = await imp.download_streams(urls)
+            assert streams == [url[len(server_url):].encode() for url in urls]
+
+            assert await imp.download_encryption_key(server_url + '/key') == bytes(reversed(range(16)))
+
+    run_with_server(test)
@@ -0,0 +1,80 @@
+import logging
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+import pytest
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    lock = Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_GET(self):   # noqa
+        with self.lock:
+            _Handler.in_flight += 1
+            _Handler.max_in_flight = max(_Handler.max_in_flight, _Handler.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            _Handler.in_flight -= 1
+
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.path.encode() * 1000
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    _Handler.max_in_flight = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_batch(server_url, tmp_path):
+    from lib.core.backpackslides import BackpackSlides
+    from lib.core.mediatransport import MediaTransport
+
+    conf = {'max_retries': 0, 'allowed_ext': ['pdf']}
+    slides = BackpackSlides(MediaTransport(conf, (5.0, 5.0)), logging.getLogger(), conf)
+    items = [('{}/{}.pdf'.format(server_url, i), str(tmp_path / 'docs' / '{}.pdf'.format(i))) for i in range(8)]
+    items.append(('{}/missing.pdf'.format(server_url), str(tmp_path / 'docs' / 'missing.pdf')))
+
+    finished = list()
+    statuses = slides.download_batch(items, workers=3, finished_func=lambda *args: finished.append(args))
+
+    assert _Handler.max_in_flight == 3
+    assert statuses == {filepath: 'missing' not in filepath for _, filepath in items}
+    assert sorted(finished) == sorted((url, filepath, statuses[filepath]) for url, filepath in items)
+    for i in range(8):
+        assert (tmp_path / 'docs' / '{}.pdf'.format(i)).read_bytes() == '/{}.pdf'.format(i).encode() * 1000
+    assert not (tmp_path / 'docs' / 'missing.pdf').exists()
+
+
+def test_is_impartus_url():
+    from lib.core.backpackslides import BackpackSlides
+    from lib.variables import Variables
+
+    login_url = Variables().login_url()
+    try:
+        Variables().set_login_url('https://a.impartus.com')
+        assert BackpackSlides.is_impartus_url('https://a.impartus.com/download1/embed/1.pdf')
+        assert not BackpackSlides.is_impartus_url('https://docs.example.com/a.impartus.com/1.pdf')
+        assert not BackpackSlides.is_impartus_url('https://a.impartus.com.example.com/1.pdf')
+    finally:
+        Variables().set_login_url(login_url)
@@ -0,0 +1,50 @@
+import time
+from functools import partial
+from threading import Lock
+
+import pytest
+
+
+def test_fetch_concurrently():
+    from lib.core.catalog import Catalog
+
+    lock = Lock()
+    in_flight = list()
+    max_in_flight = list()
+
+    def fetch(subject_id, delay):
+        with lock:
+            in_flight.append(subject_id)
+            max_in_flight.append(len(in_flight))
+        time.sleep(delay)
+        with lock:
+            in_flight.remove(subject_id)
+        return [subject_id]
+
+    # subject 0 is the slowest, and arrives last.
+    tasks = [(Catalog.VIDEOS, partial(fetch, 0, 0.3))]
+    tasks += [(Catalog.DOCUMENTS, partial(fetch, i, 0.05)) for i in range(1, 7)]
+
+    start = time.monotonic()
+    results = list(Catalog(workers=3).fetch(tasks))
+    assert time.monotonic() - start < 0.3 + 0.05 * 6
+
+    assert max(max_in_flight) == 3
+    assert sorted(results) == sorted([(Catalog.VIDEOS, [0])] + [(Catalog.DOCUMENTS, [i]) for i in range(1, 7)])
+    assert results[-1] == (Catalog.VIDEOS, [0])
+
+
+def test_fetch_failure():
+    from lib.core.catalog import Catalog
+
+    def fail():
+        raise ConnectionError('failed')
+
+    with pytest.raises(ConnectionError):
+        list(Catalog(workers=2).fetch([(Catalog.VIDEOS, lambda: [1]), (Catalog.VIDEOS, fail)]))
+
+
+def test_fetch_nothing():
+    from lib.core.catalog import Catalog
+
+    assert list(Catalog().fetch([])) == []
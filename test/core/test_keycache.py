@@ -0,0 +1,104 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import pytest
+
+
+def test_single_flight():
+    from lib.core.keycache import KeyCache
+
+    lock = Lock()
+    fetches = list()
+
+    def fetch(key_id):
+        with lock:
+            fetches.append(key_id)
+        time.sleep(0.1)
+        return bytes([key_id] * 16)
+
+    cache = KeyCache()
+    key_ids = [1, 2] * 10
+    with ThreadPoolExecutor(max_workers=len(key_ids)) as executor:
+        keys = list(executor.map(lambda key_id: cache.get(key_id, lambda: fetch(key_id)), key_ids))
+
+    assert keys == [bytes([key_id] * 16) for key_id in key_ids]
+    assert sorted(fetches) == [1, 2]
+    stats = cache.get_stats()
+    assert stats['fetches'] == 2 and stats['hits'] + stats['shared'] == 18
+    assert stats['max_fetch_seconds'] >= 0.1
+
+
+def test_fetch_failure():
+    from lib.core.keycache import KeyCache
+
+    def fail():
+        raise ConnectionError('failed')
+
+    cache = KeyCache()
+    with pytest.raises(ConnectionError):
+        cache.get(1, fail)
+    # not cached, fetched again.
+    assert cache.get(1, lambda: b'k' * 16) == b'k' * 16
+
+
+def test_persistence(tmp_path):
+    from lib.core.keycache import KeyCache
+
+    filepath = str(tmp_path / 'keys.json')
+    cache = KeyCache(filepath, secret='password')
+    cache.get(100, lambda: b'0123456789abcdef')
+    assert b'0123456789abcdef' not in open(filepath, 'rb').read()
+
+    def fail():
+        raise AssertionError('should not be fetched')
+
+    assert KeyCache(filepath, secret='password').get('100', fail) == b'0123456789abcdef'
+
+    # can not be decrypted with a different secret.
+    assert KeyCache(filepath, secret='changed').get(100, lambda: b'x' * 16) == b'x' * 16
+
+    # not persisted without a secret.
+    KeyCache(str(tmp_path / 'other.json')).get(1, lambda: b'x' * 16)
+    assert not (tmp_path / 'other.json').exists()
+
+
+def test_save_failure(tmp_path):
+    from lib.core.keycache import KeyCache
+
+    # the file can not be written, a directory is in the way.
+    filepath = tmp_path / 'keys.json'
+    filepath.mkdir()
+    cache = KeyCache(str(filepath), secret='password')
+
+    def fetch():
+        time.sleep(0.1)
+        return b'k' * 16
+
+    # the fetching caller and the ones waiting on it get the key all the same.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(cache.get, 1, fetch) for _ in range(4)]
+        assert [future.result(timeout=5) for future in futures] == [b'k' * 16] * 4
+    assert cache.get_stats()['fetches'] == 1
+
+
+def test_file_key_derived_once(tmp_path, monkeypatch):
+    import hashlib
+    from lib.core import keycache
+
+    derivations = list()
+    pbkdf2_hmac = hashlib.pbkdf2_hmac
+
+    def counting_pbkdf2_hmac(*args):
+        derivations.append(args)
+        return pbkdf2_hmac(*args)
+
+    monkeypatch.setattr(keycache.hashlib, 'pbkdf2_hmac', counting_pbkdf2_hmac)
+    filepath = str(tmp_path / 'keys.json')
+    cache = keycache.KeyCache(filepath, secret='password')
+    for key_id in range(5):
+        cache.get(key_id, lambda: bytes([key_id] * 16))
+    assert len(derivations) == 1
+
+    assert keycache.KeyCache(filepath, secret='password').get(4, lambda: b'x' * 16) == bytes([4] * 16)
+    assert len(derivations) == 2
@@ -0,0 +1,134 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):   # noqa
+        body = self.headers.get('Authorization', 'anonymous').encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def conf():
+    return {'max_retries': 1, 'pool_connections': 2, 'pool_maxsize': 2}
+
+
+def test_connections_reused(server_url, conf):
+    from lib.core.mediatransport import MediaTransport
+
+    transport = MediaTransport(conf, (5.0, 5.0))
+    for i in range(5):
+        assert transport.get('{}/{}.ts'.format(server_url, i)).content == b'anonymous'
+
+    assert transport.get_stats() == {'requests': 5, 'connections_opened': 1, 'connections_reused': 4}
+
+
+def test_authenticated_request(server_url, conf):
+    from lib.core.mediatransport import MediaTransport
+
+    transport = MediaTransport(conf, (5.0, 5.0), token='xyz')
+    assert transport.get('{}/key'.format(server_url), authenticated=True).content == b'Bearer xyz'
+    assert transport.get('{}/0.ts'.format(server_url)).content == b'anonymous'
+
+    transport.set_token(None)
+    assert transport.get('{}/key'.format(server_url), authenticated=True).content == b'anonymous'
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    content = bytes(range(256)) * 400
+
+    # ranges requested.
+    ranges = list()
+
+    def do_GET(self):   # noqa
+        content = self.content
+        start = 0
+        range_header = self.headers.get('Range')
+        _RangeHandler.ranges.append(range_header)
+        if range_header and not self.path.startswith('/norange'):
+            start = int(range_header[len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        if self.path.startswith('/truncate') and not range_header:
+            # close the connection half way through.
+            self.wfile.write(content[:len(content) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def range_server_url():
+    _RangeHandler.ranges = list()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_to_file_resumes(range_server_url, conf, tmp_path):
+    from requests.exceptions import ChunkedEncodingError, ConnectionError
+    from lib.core.mediatransport import MediaTransport
+
+    transport = MediaTransport(conf, (5.0, 5.0))
+    filepath = str(tmp_path / 'stream')
+    with pytest.raises((ChunkedEncodingError, ConnectionError)):
+        transport.download_to_file(range_server_url + '/truncate.ts', filepath, chunk_size=1024)
+    assert not (tmp_path / 'stream').exists()
+    # the chunk being read when the connection closed is lost.
+    part_size = (tmp_path / 'stream.part').stat().st_size
+    assert 0 < part_size <= len(_RangeHandler.content) // 2
+
+    assert transport.download_to_file(range_server_url + '/truncate.ts', filepath).ok
+    assert (tmp_path / 'stream').read_bytes() == _RangeHandler.content
+    assert not (tmp_path / 'stream.part').exists()
+    assert _RangeHandler.ranges == [None, 'bytes={}-'.format(part_size)]
+
+
+def test_download_to_file_without_range_support(range_server_url, conf, tmp_path):
+    from lib.core.mediatransport import MediaTransport
+
+    transport = MediaTransport(conf, (5.0, 5.0))
+    (tmp_path / 'stream.part').write_bytes(b'partial')
+    assert transport.download_to_file(range_server_url + '/norange.ts', str(tmp_path / 'stream')).ok
+    assert (tmp_path / 'stream').read_bytes() == _RangeHandler.content
+
+
+def test_get_backoff_time(conf):
+    from urllib3.util.retry import RequestHistory
+    from lib.core.mediatransport import get_backoff_time, get_retry
+
+    retry = get_retry(conf)
+    for retries in range(1, 10):
+        history = tuple(RequestHistory('GET', '/', None, 503, None) for _ in range(retries))
+        assert get_backoff_time(retry, retries) == retry.new(history=history).get_backoff_time()
@@ -0,0 +1,156 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+import requests
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # path -> body, and number of full responses sent.
+    bodies = dict()
+    full_responses = 0
+
+    def do_GET(self):   # noqa
+        body = json.dumps(self.bodies.get(self.path, [])).encode()
+        etag = '"{}"'.format(hash(body))
+        if self.path.startswith('/api/etag') and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        _Handler.full_responses += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path.startswith('/api/etag'):
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    _Handler.bodies = dict()
+    _Handler.full_responses = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def get_session(cache_dir, ttl=300, user=None):
+    from lib.core.responsecache import CachingHTTPAdapter, ResponseCache
+
+    cache = ResponseCache(str(cache_dir), ttl=ttl)
+    session = requests.Session()
+    session.mount('http://', CachingHTTPAdapter(cache, ['^/api/'], user=user))
+    return session, cache
+
+
+def test_conditional_requests(server_url, tmp_path):
+    _Handler.bodies['/api/etag/lectures'] = [{'ttid': 1}]
+    session, cache = get_session(tmp_path)
+
+    assert session.get(server_url + '/api/etag/lectures').json() == [{'ttid': 1}]
+    response = session.get(server_url + '/api/etag/lectures')
+    assert response.status_code == 200 and response.json() == [{'ttid': 1}]
+    assert response.from_cache
+    assert _Handler.full_responses == 1
+
+    # changed on the server.
+    _Handler.bodies['/api/etag/lectures'] = [{'ttid': 1}, {'ttid': 2}]
+    assert session.get(server_url + '/api/etag/lectures').json() == [{'ttid': 1}, {'ttid': 2}]
+    assert _Handler.full_responses == 2
+    assert cache.get_stats() == {'hits': 0, 'revalidated': 1, 'misses': 2}
+
+
+@pytest.mark.parametrize('ttl, full_responses', [(300, 1), (0, 2)])
+def test_ttl(server_url, tmp_path, ttl, full_responses):
+    _Handler.bodies['/api/subjects'] = [{'subjectId': 1}]
+    session, cache = get_session(tmp_path, ttl=ttl)
+
+    for _ in range(2):
+        assert session.get(server_url + '/api/subjects').json() == [{'subjectId': 1}]
+    assert _Handler.full_responses == full_responses
+
+    # the cache is persistent.
+    session, cache = get_session(tmp_path, ttl=ttl)
+    assert session.get(server_url + '/api/subjects').json() == [{'subjectId': 1}]
+    assert _Handler.full_responses == full_responses + (ttl == 0)
+
+
+def test_not_cached(server_url, tmp_path):
+    session, cache = get_session(tmp_path)
+
+    for _ in range(2):
+        session.get(server_url + '/other')
+    assert _Handler.full_responses == 2
+    assert cache.get_stats() == {'hits': 0, 'revalidated': 0, 'misses': 0}
+
+
+def test_per_user(server_url, tmp_path):
+    _Handler.bodies['/api/subjects'] = [{'subjectId': 1}]
+    session, cache = get_session(tmp_path)
+
+    session.get(server_url + '/api/subjects', headers={'Authorization': 'Bearer a'})
+    session.get(server_url + '/api/subjects', headers={'Authorization': 'Bearer b'})
+    assert _Handler.full_responses == 2
+
+    # keyed on the user if known, a new token (login) reuses the entries of the user.
+    session, cache = get_session(tmp_path, user='a@example.com')
+    session.get(server_url + '/api/subjects', headers={'Authorization': 'Bearer a'})
+    session.get(server_url + '/api/subjects', headers={'Authorization': 'Bearer c'})
+    assert _Handler.full_responses == 3
+    assert cache.get_stats()['hits'] == 1
+
+    session, cache = get_session(tmp_path, user='b@example.com')
+    session.get(server_url + '/api/subjects', headers={'Authorization': 'Bearer c'})
+    assert _Handler.full_responses == 4
+
+
+def test_prune(tmp_path):
+    import os
+    import time
+    from lib.core.responsecache import ResponseCache
+
+    cache = ResponseCache(str(tmp_path), max_size=2500, max_age=3600)
+    now = time.time()
+    # key -> seconds since saved.
+    ages = {'old': 7200, 'a': 300, 'b': 200, 'c': 100}
+    for key, age in ages.items():
+        for filepath in cache._filepaths(key):
+            with open(filepath, 'wb') as fh:
+                fh.write(b'x' * 500)
+            os.utime(filepath, (now - age, now - age))
+    with open(str(tmp_path / 'd.body.1.2.tmp'), 'wb') as fh:
+        fh.write(b'x')
+    os.utime(str(tmp_path / 'd.body.1.2.tmp'), (now - 7200, now - 7200))
+
+    # 'old' has expired, and 'a' is the least recently saved of the rest, beyond max_size.
+    assert cache.prune() == 2
+    assert sorted(os.listdir(str(tmp_path))) == ['b.body', 'b.json', 'c.body', 'c.json']
+
+
+def test_concurrent_writes(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from lib.core.responsecache import ResponseCache
+
+    filepath = str(tmp_path / 'entry.body')
+    bodies = [bytes([index]) * 100000 for index in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(10):
+            list(executor.map(lambda body: ResponseCache._write(filepath, body, 'wb'), bodies))
+
+    with open(filepath, 'rb') as fh:
+        assert fh.read() in bodies
+    assert [path.name for path in tmp_path.iterdir()] == ['entry.body']
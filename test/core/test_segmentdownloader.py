@@ -0,0 +1,157 @@
+import logging
+import os
+from functools import partial
+from threading import Event, Lock, Thread
+
+import pytest
+from requests.exceptions import ConnectionError
+
+
+@pytest.fixture
+def items(tmp_path):
+    from lib.core.segmentdownloader import SegmentDownloader
+
+    return [('http://foo/{}.ts'.format(i), partial(SegmentDownloader.save_to_file, str(tmp_path / str(i))))
+            for i in range(20)]
+
+
+def _tasks(fetch, items):
+    # a task per (url, save_func) item, fetching a single segment.
+    return [(url, partial(fetch, url), save_func, 1) for url, save_func in items]
+
+
+def test_download(items):
+    from lib.core.segmentdownloader import SegmentDownloader
+
+    progress = list()
+    downloader = SegmentDownloader(logging.getLogger(), workers=4)
+    assert downloader.download_tasks(_tasks(lambda url: url.encode(), items), progress.append) is True
+    assert progress == list(range(1, len(items) + 1))
+    for url, save_func in items:
+        with open(save_func.args[0], 'rb') as fh:
+            assert fh.read() == url.encode()
+
+
+def test_download_with_completed_items(items):
+    from lib.core.segmentdownloader import SegmentDownloader
+
+    fetched = list()
+    lock = Lock()
+
+    def fetch(url):
+        with lock:
+            fetched.append(url)
+        return b'y'
+
+    progress = list()
+    SegmentDownloader(logging.getLogger(), workers=3).download_tasks(_tasks(fetch, items[5:]), progress.append,
+                                                                    completed=5)
+    assert sorted(fetched) == sorted(url for url, _ in items[5:])
+    assert progress == list(range(5, len(items) + 1))
+
+
+def test_is_downloaded(tmp_path):
+    from lib.core.segmentdownloader import SegmentDownloader
+
+    filepath = str(tmp_path / 'stream')
+    assert not SegmentDownloader.is_downloaded(filepath)
+    open(filepath, 'wb').close()
+    assert not SegmentDownloader.is_downloaded(filepath)
+    SegmentDownloader.save_to_file(filepath, b'x')
+    assert SegmentDownloader.is_downloaded(filepath)
+
+
+def test_download_retries_on_connection_error(items):
+    from lib.core.segmentdownloader import SegmentDownloader
+
+    failures = {'count': 0}
+
+    def fetch(url):
+        if failures['count'] < 3:
+            failures['count'] += 1
+            raise ConnectionError()
+        return b'z'
+
+    downloader = SegmentDownloader(logging.getLogger(), workers=1, retry_wait=0)
+    assert downloader.download_tasks(_tasks(fetch, items[:2])) is True
+    assert failures['count'] == 3
+
+
+def test_download_refetches_invalid_content(items):
+    from lib.core.segmentdownloader import InvalidContentError, SegmentDownloader
+
+    fetches = {'count': 0}
+    saved = list()
+
+    def fetch(url):
+        fetches['count'] += 1
+        return b'bad' if fetches['count'] < 3 else b'good'
+
+    def save(content):
+        if content == b'bad':
+            raise InvalidContentError('bad content')
+        saved.append(content)
+
+    downloader = SegmentDownloader(logging.getLogger(), workers=1, retry_wait=0)
+    assert downloader.download_tasks([('http://foo/0.ts', partial(fetch, 'http://foo/0.ts'), save, 1)]) is True
+    assert fetches['count'] == 3
+    assert saved == [b'good']
+
+
+def test_download_tasks_to_files(tmp_path):
+    from lib.core.segmentdownloader import SegmentDownloader
+
+    attempts = list()
+
+    def fetch_to_file(url, filepath):
+        # the first attempt for each file fails half way, the next one continues from there.
+        attempts.append(url)
+        part_filepath = '{}.part'.format(filepath)
+        with open(part_filepath, 'ab') as fh:
+            if attempts.count(url) == 1:
+                fh.write(url[:5].encode())
+                raise ConnectionError()
+            fh.write(url[fh.tell():].encode())
+        os.replace(part_filepath, filepath)
+
+    items = [('http://foo/{}.ts'.format(i), str(tmp_path / str(i))) for i in range(5)]
+    tasks = [(url, partial(fetch_to_file, url, filepath), None, 1) for url, filepath in items]
+    downloader = SegmentDownloader(logging.getLogger(), workers=2, retry_wait=0)
+    assert downloader.download_tasks(tasks) is True
+    for url, filepath in items:
+        with open(filepath, 'rb') as fh:
+            assert fh.read() == url.encode()
+
+
+def test_download_paused(items):
+    from lib.core.segmentdownloader import SegmentDownloader
+
+    pause_ev = Event()
+    resume_ev = Event()
+    pause_ev.set()
+
+    fetched = list()
+    downloader = SegmentDownloader(logging.getLogger(), workers=2, pause_ev=pause_ev, resume_ev=resume_ev)
+    thread = Thread(target=downloader.download_tasks, args=(_tasks(lambda url: fetched.append(url) or b'z', items),))
+    thread.start()
+    thread.join(timeout=0.2)
+    assert thread.is_alive()
+    assert fetched == []
+
+    # resume, the way the ui does it.
+    resume_ev.set()
+    pause_ev.clear()
+    thread.join()
+    assert len(fetched) == len(items)
+
+
+def test_download_interrupted(items):
+    from lib.core.segmentdownloader import SegmentDownloader
+
+    def progress(value):
+        raise RuntimeError('widget deleted')
+
+    downloader = SegmentDownloader(logging.getLogger(), workers=1)
+    with pytest.raises(RuntimeError):
+        downloader.download_tasks(_tasks(lambda url: b'z', items), progress)
+    assert downloader.stop_ev.is_set()
@@ -0,0 +1,81 @@
+import logging
+
+import pytest
+
+
+def _checker(tracks_info, **conf):
+    from lib.core.streamchecker import StreamChecker
+
+    return StreamChecker(conf, tracks_info, logging.getLogger())
+
+
+def _segment(file_number, duration):
+    from lib.media.m3u8parser import Segment
+
+    return Segment(file_number, duration, 'http://foo/{}.ts'.format(file_number))
+
+
+def test_check_valid_stream():
+    from test.media.tsfixtures import ts_stream
+
+    item = _segment(0, 10)
+    checker = _checker([[item]])
+    checker.check(0, 0, item, content=ts_stream(10))
+    assert checker.scans[0][0].duration() == 10
+    assert not checker.failures
+
+
+def test_check_refetches_invalid_stream():
+    from lib.core.segmentdownloader import InvalidContentError
+    from lib.media.tsscanner import InvalidStreamError
+
+    item = _segment(0, 10)
+    checker = _checker([[item]], stream_refetches=2)
+    for _ in range(2):
+        with pytest.raises(InvalidContentError):
+            checker.check(0, 0, item, content=b'<html>error</html>')
+    # kept, with a warning.
+    checker.check(0, 0, item, content=b'<html>error</html>')
+
+    checker = _checker([[item]], stream_refetches=1, invalid_streams='fail')
+    with pytest.raises(InvalidContentError):
+        checker.check(0, 0, item, content=b'<html>error</html>')
+    with pytest.raises(InvalidStreamError):
+        checker.check(0, 0, item, content=b'<html>error</html>')
+
+
+def test_check_refetches_short_stream(tmp_path):
+    from lib.core.segmentdownloader import InvalidContentError
+    from test.media.tsfixtures import ts_stream
+
+    item = _segment(0, 10)
+    checker = _checker([[item]], stream_refetches=1, invalid_streams='fail')
+    filepath = tmp_path / 'stream.ts'
+    filepath.write_bytes(ts_stream(4))
+    with pytest.raises(InvalidContentError):
+        checker.check(0, 0, item, filepath=str(filepath))
+    # valid TS data, kept even with invalid_streams: 'fail'.
+    checker.check(0, 0, item, filepath=str(filepath))
+
+    # not checked.
+    checker = _checker([[item]], check_track_durations=False)
+    checker.check(0, 0, item, filepath=str(filepath))
+    checker = _checker([[item]], validate_streams=False, check_track_durations=False)
+    assert not checker.enabled()
+    checker.check(0, 0, item, content=b'<html>error</html>')
+
+
+def test_check_track_durations(caplog):
+    from test.media.tsfixtures import ts_stream
+
+    tracks_info = [[_segment(0, 10), _segment(1, 10)], [_segment(2, 10), _segment(3, 10)]]
+    checker = _checker(tracks_info)
+    for stream_index, item in enumerate(tracks_info[0]):
+        checker.check(0, stream_index, item, content=ts_stream(10))
+    checker.check(1, 0, tracks_info[1][0], content=ts_stream(10))
+
+    with caplog.at_level(logging.DEBUG):
+        checker.check_track_durations(30)
+    # both streams of track 0 start at 10s.
+    assert 'Track 0 is 10.0s long, lecture duration is 30s.' in caplog.text
+    assert 'Track 1 resumed' in caplog.text
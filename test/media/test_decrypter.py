@@ -1,5 +1,4 @@
 import pytest
-from mock import MagicMock
 
 
 @pytest.fixture
@@ -30,44 +29,112 @@ def bad_enc_key_lengths():
     ]
 
 
-def test_decrypt_with_encryption_key(mocker, enc_keys):
-    infile = '/tmp/1'
-    mock_file = mocker.patch('builtins.open', mocker.mock_open(read_data='encrypted content'))
+@pytest.fixture
+def plaintext():
+    # not aligned to the block size, so that the ciphertext ends with a padded block.
+    return bytes(range(256)) * 1000 + b'tail'
+
 
-    mock_crypto = mocker.patch('Crypto.Cipher.AES.new')
-    mock_crypto().decrypt = MagicMock(return_value='decrypted content')
+def _encrypt(key, plaintext, iv=b'\0' * 16):
+    from Crypto.Cipher import AES
+    from Crypto.Util.Padding import pad
 
-    mocker.patch('os.path.join')
+    key = key.encode() if isinstance(key, str) else key
+    return AES.new(key, AES.MODE_CBC, iv).encrypt(pad(plaintext, AES.block_size))
 
+
+def test_decrypt_with_encryption_key(tmp_path, enc_keys, plaintext):
     from lib.media.decrypter import Decrypter
 
     for enc_key in enc_keys:
-        Decrypter.decrypt(enc_key, infile, '/tmp')
-        assert mock_file.call_count == 2
-        mock_file.return_value.__enter__().write.assert_called_once_with('decrypted content')
-        mock_file.reset_mock()
+        infile = tmp_path / '1'
+        infile.write_bytes(_encrypt(enc_key, plaintext))
+        outfile = Decrypter.decrypt(enc_key, str(infile), str(tmp_path))
+        assert outfile == str(tmp_path / '1.ts')
+        with open(outfile, 'rb') as fh:
+            assert fh.read() == plaintext
+
 
+def test_decrypt_without_encryption_key(tmp_path):
+    from lib.media.decrypter import Decrypter
+
+    infile = str(tmp_path / '1')
+    assert Decrypter.decrypt(None, infile, str(tmp_path)) == infile
 
-def test_decrypt_with_bad_encryption_key_types(mocker, bad_enc_key_types):
-    infile = '/tmp/1'
-    mocker.patch('os.path.join')
+
+def test_decrypt_with_bad_encryption_key_types(tmp_path, bad_enc_key_types):
+    infile = str(tmp_path / '1')
 
     from lib.media.decrypter import Decrypter
 
     for enc_key in bad_enc_key_types:
         with pytest.raises(AssertionError) as err:
-            Decrypter.decrypt(enc_key, infile, '/tmp')
+            Decrypter.decrypt(enc_key, infile, str(tmp_path))
         assert 'Implement handling for type' in err.value.args[0]
 
 
-def test_decrypt_with_bad_encryption_key_lengths(mocker, bad_enc_key_lengths):
-    infile = '/tmp/1'
-    mocker.patch('os.path.join')
-    mock_file = mocker.patch('builtins.open', mocker.mock_open(read_data='encrypted content'))
+def test_decrypt_with_bad_encryption_key_lengths(tmp_path, bad_enc_key_lengths):
+    infile = str(tmp_path / '1')
 
     from lib.media.decrypter import Decrypter
 
     for enc_key in bad_enc_key_lengths:
         with pytest.raises(ValueError) as err:
-            Decrypter.decrypt(enc_key, infile, '/tmp')
+            Decrypter.decrypt(enc_key, infile, str(tmp_path))
         assert 'Incorrect AES key length' in err.value.args[0]
+
+
+def test_decrypt_bytes(enc_keys, plaintext):
+    from lib.media.decrypter import Decrypter
+
+    for enc_key in enc_keys:
+        assert Decrypter.decrypt_bytes(enc_key, _encrypt(enc_key, plaintext)) == plaintext
+
+    # explicit iv.
+    iv = bytes(range(16))
+    assert Decrypter.decrypt_bytes(enc_keys[1], _encrypt(enc_keys[1], plaintext, iv), iv=iv) == plaintext
+
+
+def test_decrypt_into(enc_keys, plaintext):
+    from lib.media.decrypter import Decrypter
+
+    ciphertext = _encrypt(enc_keys[1], plaintext)
+    output = bytearray(len(ciphertext) + 100)
+    length = Decrypter.decrypt_into(enc_keys[1], memoryview(ciphertext), memoryview(output))
+    assert output[:length] == plaintext
+
+    length = Decrypter.decrypt_into(enc_keys[1], ciphertext, output, unpad=False)
+    assert length == len(ciphertext)
+
+    with pytest.raises(ValueError):
+        Decrypter.decrypt_into(enc_keys[1], ciphertext[:-1], output)
+
+
+def test_decrypt_stream(enc_keys, plaintext):
+    import io
+    from lib.media.decrypter import Decrypter
+
+    ciphertext = _encrypt(enc_keys[0], plaintext)
+    for chunk_size in [1, 16, 100, 4096, len(ciphertext), 10 * len(ciphertext)]:
+        out_fh = io.BytesIO()
+        written = Decrypter.decrypt_stream(enc_keys[0], io.BytesIO(ciphertext), out_fh, chunk_size=chunk_size)
+        assert written == len(plaintext)
+        assert out_fh.getvalue() == plaintext
+
+
+def test_unpadded_length():
+    from lib.media.decrypter import Decrypter
+
+    assert Decrypter.unpadded_length(b'x' * 12 + b'\x04' * 4) == 12
+    assert Decrypter.unpadded_length(b'\x10' * 16) == 0
+
+    # invalid padding is left alone.
+    assert Decrypter.unpadded_length(b'x' * 15 + b'\x00') == 16
+    assert Decrypter.unpadded_length(b'x' * 15 + b'\x11') == 16
+    assert Decrypter.unpadded_length(b'x' * 13 + b'\x01\x03\x03') == 16
+
+
+def test_cipher_cache(enc_keys):
+    from lib.media.decrypter import Decrypter
+
+    assert Decrypter.get_cipher(enc_keys[0]) is Decrypter.get_cipher(enc_keys[1])
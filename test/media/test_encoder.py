@@ -126,3 +126,31 @@ def test_join(mocker, tests_data):
     Encoder.join(stream_files, "/tmp", 0)
     assert mock_open.call_count == 1 + len(stream_files)
 
+
+def test_get_probe_window(tmp_path):
+    from lib.media.encoder import Encoder
+    from test.media.tsfixtures import ts_stream
+
+    regular = str(tmp_path / 'regular.ts')
+    with open(regular, 'wb') as fh:
+        fh.write(ts_stream(20))
+    assert Encoder.get_probe_window(regular) == (Encoder.max_probe_size, Encoder.max_analyze_duration * 1000000)
+
+    # bounded by the first segment, and capped by the ffmpeg defaults.
+    assert Encoder.get_probe_window(regular, (188 * 30, 2.0)) == (188 * 30, 2000000)
+    assert Encoder.get_probe_window(regular, (10 ** 9, 60)) == (Encoder.max_probe_size, 5000000)
+    assert Encoder.get_probe_window(regular, (None, 2.0)) == (Encoder.max_probe_size, 2000000)
+    # never short of the first timestamps, the audio stream starts in the third packet, 0.5s after the video.
+    assert Encoder.get_probe_window(regular, (188, 0.1)) == (2 * 188 * 3, 1000000)
+
+    # not TS data, or missing.
+    irregular = str(tmp_path / 'irregular.ts')
+    with open(irregular, 'wb') as fh:
+        fh.write(b'\x00' * 188 * 10)
+    assert Encoder.get_probe_window(irregular) is None
+    assert Encoder.get_probe_window(str(tmp_path / 'missing.ts')) is None
+
+    command = Encoder._encode_command(1234, [regular, irregular], '/tmp/out.mkv', probe_windows=[(1000, 2000), None])
+    assert ' '.join(command) == (
+        'ffmpeg -y -loglevel quiet -analyzeduration 2000 -probesize 1000 -i {} -analyzeduration 2147483647'
+        ' -probesize 2147483647 -i {} -metadata ttid=1234 -c copy -map 0 -map 1 /tmp/out.mkv'.format(regular, irregular))
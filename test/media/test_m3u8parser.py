@@ -217,3 +217,129 @@ def test_parse(mocker, m3u8_sample):
     assert len(tracks_object[0]) == 70      # 70 media files in track 0.
     assert len(tracks_object[1]) == 0       # 0 media files in track 1.
     assert len(tracks_object[2]) == 0       # 0 media files in track 2.
+
+
+def test_segments(m3u8_sample):
+    from lib.media.m3u8parser import M3u8Parser
+
+    _, tracks = M3u8Parser(m3u8_sample).parse()
+    segment = tracks[0][10]
+    assert segment.file_number == 10
+    assert segment.duration == 10.0
+    assert segment.url == 'https://impartusmedia.oss-ap-south-1.aliyuncs.com/download1/4168424_hls/854x480_30/' \
+                          '854x480_30v1_0010_hls_1.ts'
+    assert segment.encryption_method == 'AES-128'
+    assert segment.encryption_key_id == '1'
+    assert segment.encryption_key_url == 'http://a.impartus.com/api/fetchvideo/getVideoKey?ttid=4168424&keyid=1'
+    # segments using the same key share the key object.
+    assert tracks[0][10].key is tracks[0][19].key
+    assert [x.file_number for x in tracks[0][68:]] == [68, 69]
+    assert round(tracks[0].duration()) == 701
+
+
+def test_parse_incrementally():
+    import io
+    from lib.media.m3u8parser import M3u8Parser
+
+    playlist = b"""#EXTM3U
+#EXT-X-KEY:METHOD=AES-128,URI="http://a.impartus.com/api/fetchvideo/getVideoKey?ttid=1&keyid=5"
+#EXTINF:4.5,
+http://media/track0/0.ts
+#EXTINF:5.5,
+http://media/track1/0.ts
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:6,
+http://media/track0/1.ts
+"""
+    # lines from a binary stream, and more base urls than the tracks expected.
+    summary, tracks = M3u8Parser(io.BytesIO(playlist), num_tracks=1).parse()
+    assert summary == {'key_files': 1, 'media_files': 3, 'total_files': 4, 'total_duration': 16}
+    assert [[(x.file_number, x.duration, x.url, x.encryption_key_id) for x in track] for track in tracks] == [
+        [(0, 4.5, 'http://media/track0/0.ts', '5'), (2, 6.0, 'http://media/track0/1.ts', None)],
+        [(1, 5.5, 'http://media/track1/0.ts', '5')],
+    ]
+    assert tracks[0][1].encryption_method == 'NONE'
+
+
+def test_media_sequence_and_iv():
+    from lib.media.m3u8parser import M3u8Parser
+
+    playlist = """#EXTM3U
+#EXT-X-MEDIA-SEQUENCE:7
+#EXT-X-KEY:METHOD=AES-128,URI="http://a.impartus.com/api/fetchvideo/getVideoKey?ttid=1&keyid=5"
+#EXTINF:10.0,
+http://media/track0/0.ts
+#EXT-X-KEY:METHOD=AES-128,URI="http://a.impartus.com/api/fetchvideo/getVideoKey?ttid=1&keyid=6",IV=0x1F
+#EXTINF:10.0,
+http://media/track0/1.ts
+""".splitlines()
+    _, tracks = M3u8Parser(playlist).parse()
+    assert [x.sequence for x in tracks[0]] == [7, 8]
+    assert tracks[0][0].iv == (7).to_bytes(16, 'big')
+    assert tracks[0][1].iv == (0x1f).to_bytes(16, 'big')
+    assert tracks[0][1].key.iv == (0x1f).to_bytes(16, 'big')
+
+
+def test_byte_ranges():
+    from lib.media.m3u8parser import M3u8Parser
+
+    playlist = """#EXTM3U
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:1000@0
+http://media/track0/all.ts
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:2000
+http://media/track0/all.ts
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:500
+http://media/track0/all.ts
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:500@5000
+http://media/track0/all.ts
+#EXTINF:10.0,
+http://media/track0/other.ts
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:100
+http://media/track0/all.ts
+""".splitlines()
+    _, tracks = M3u8Parser(playlist).parse()
+    assert [x.byte_range for x in tracks[0]] == [(0, 1000), (1000, 2000), (3000, 500), (5000, 500), None,
+                                                  (5500, 100)]
+
+    def groups(max_length):
+        return [[stream_index for stream_index, _ in group]
+                for group in M3u8Parser.coalesce_byte_ranges(enumerate(tracks[0]), max_length)]
+
+    # 3 is not adjacent to 2, 4 is not a byte range, 5 is not consecutive with 3.
+    assert groups(1 << 20) == [[0, 1, 2], [3], [4], [5]]
+    assert groups(3000) == [[0, 1], [2], [3], [4], [5]]
+
+    # ranges of the streams yet to be downloaded.
+    pending = [(i, x) for i, x in enumerate(tracks[0]) if i != 1]
+    assert [[i for i, _ in group] for group in M3u8Parser.coalesce_byte_ranges(pending, 1 << 20)] == \
+        [[0], [2], [3], [4], [5]]
+
+
+def test_split_track():
+    from lib.media.m3u8parser import M3u8Parser
+
+    # 3 tracks worth (60s each) of content in track 0.
+    lines = ['#EXTM3U', '#EXT-X-KEY:METHOD=AES-128,URI="http://a.impartus.com/key?keyid=1"']
+    durations = [10.0] * 5 + [4.0, 6.0] + [10.0] * 6 + [10.0, 10.0, 10.0, 10.0, 10.0, 4.0]
+    for i, duration in enumerate(durations):
+        lines += ['#EXTINF:{},'.format(duration), 'http://media/track0/{}.ts'.format(i)]
+    tracks = M3u8Parser(lines, num_tracks=3).parse()[1]
+    assert M3u8Parser.needs_split(tracks)
+
+    split_tracks = M3u8Parser.split_track(tracks, 60)
+    assert not M3u8Parser.needs_split(split_tracks)
+    assert [[x.file_number for x in track] for track in split_tracks] == \
+        [list(range(0, 7)), list(range(7, 13)), list(range(13, 19))]
+    assert split_tracks[1][0] == tracks[0][7]
+    assert [x.url for x in split_tracks[2]] == ['http://media/track0/{}.ts'.format(i) for i in range(13, 19)]
+
+    # segments go to the track their mid point falls in, the excess to the last track.
+    assert [len(x) for x in M3u8Parser.split_track(tracks, 50)] == [5, 6, 8]
+    # a duration leaving a track empty, or none at all, splits evenly.
+    assert [len(x) for x in M3u8Parser.split_track(tracks, 200)] == [7, 6, 6]
+    assert [len(x) for x in M3u8Parser.split_track(tracks, 0)] == [7, 6, 6]
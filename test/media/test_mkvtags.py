@@ -0,0 +1,57 @@
+import pytest
+
+from benchmarks.mkvfixtures import ebml_header, element, tags, uint_element, write_mkv
+
+
+@pytest.mark.parametrize('with_seek_head', [True, False])
+def test_get_rfid(tmp_path, with_seek_head):
+    from lib.media.mkvtags import MkvTags
+
+    filepath = write_mkv(str(tmp_path / 'ttid.mkv'), 3 << 20, {'ENCODER': 'Lavf', 'TTID': '1234'},
+                         with_seek_head=with_seek_head, cluster_size=1 << 16)
+    assert MkvTags.get_tags(filepath) == {'ENCODER': 'Lavf', 'TTID': '1234'}
+    assert MkvTags.get_rfid(filepath) == (1234, False)
+
+    filepath = write_mkv(str(tmp_path / 'fcid.mkv'), 1 << 16, {'FCID': '99'}, with_seek_head=with_seek_head)
+    assert MkvTags.get_rfid(filepath) == (99, True)
+
+
+def test_no_rfid(tmp_path):
+    from lib.media.mkvtags import MkvTags
+
+    filepath = write_mkv(str(tmp_path / 'lecture.mkv'), 1 << 16, {'ENCODER': 'Lavf'})
+    assert MkvTags.get_rfid(filepath) == (None, None)
+
+
+def test_unknown_size_cluster(tmp_path):
+    from lib.media.mkvtags import MkvTags
+
+    # segment and cluster of unknown size, as written by live streams: found by scanning the tail of the file.
+    filepath = str(tmp_path / 'live.mkv')
+    with open(filepath, 'wb') as fh:
+        fh.write(ebml_header())
+        fh.write(bytes.fromhex('18538067') + b'\x01' + b'\xff' * 7)
+        fh.write(bytes.fromhex('1f43b675') + b'\xff' + uint_element(0xE7, 0) + element(0xA3, bytes(1000)))
+        fh.write(tags({'TTID': '42'}))
+    assert MkvTags.get_rfid(filepath) == (42, False)
+
+
+@pytest.mark.parametrize('contents', [b'', b'not an mkv file', ebml_header() + bytes.fromhex('18538067')])
+def test_malformed(tmp_path, contents):
+    from lib.media.mkvtags import MalformedMKVError, MkvTags
+
+    filepath = str(tmp_path / 'bad.mkv')
+    with open(filepath, 'wb') as fh:
+        fh.write(contents)
+    with pytest.raises(MalformedMKVError):
+        MkvTags.get_rfid(filepath)
+
+
+def test_truncated(tmp_path):
+    from lib.media.mkvtags import MalformedMKVError, MkvTags
+
+    filepath = write_mkv(str(tmp_path / 'lecture.mkv'), 1 << 16, {'TTID': '1234'}, cluster_size=1 << 14)
+    with open(filepath, 'r+b') as fh:
+        fh.truncate(fh.seek(0, 2) - 10)
+    with pytest.raises(MalformedMKVError):
+        MkvTags.get_rfid(filepath)
@@ -0,0 +1,163 @@
+from threading import Event, Thread
+
+import pytest
+
+
+@pytest.fixture
+def track_filepath(tmp_path):
+    return str(tmp_path / 'track-0.ts')
+
+
+def test_write_in_order(track_filepath):
+    from lib.media.trackwriter import TrackWriter
+
+    writer = TrackWriter(track_filepath)
+    for index in range(5):
+        assert writer.write(index, bytes([index]) * 10)
+    writer.close()
+
+    assert writer.completed() == 5
+    with open(track_filepath, 'rb') as fh:
+        assert fh.read() == b''.join(bytes([index]) * 10 for index in range(5))
+
+
+def test_write_out_of_order(track_filepath):
+    from lib.media.trackwriter import TrackWriter
+
+    writer = TrackWriter(track_filepath)
+    for index in [3, 1, 2]:
+        writer.write(index, bytes([index]))
+    assert writer.completed() == 0
+
+    writer.write(0, bytes([0]))
+    assert writer.completed() == 4
+    writer.close()
+
+    with open(track_filepath, 'rb') as fh:
+        assert fh.read() == bytes([0, 1, 2, 3])
+
+
+def test_resume_from_journal(track_filepath):
+    from lib.media.trackwriter import TrackWriter
+
+    writer = TrackWriter(track_filepath)
+    writer.write(0, b'aaaa')
+    writer.write(1, b'bbbb')
+    writer.close()
+
+    # simulate a crash after writing partial content for stream 2, and a partial journal entry.
+    with open(track_filepath, 'ab') as fh:
+        fh.write(b'cc')
+    with open('{}.journal'.format(track_filepath), 'a') as fh:
+        fh.write('2 1')
+
+    writer = TrackWriter(track_filepath)
+    assert writer.completed() == 2
+
+    # streams already written are ignored.
+    writer.write(1, b'xxxx')
+    writer.write(2, b'cccc')
+    writer.close()
+
+    with open(track_filepath, 'rb') as fh:
+        assert fh.read() == b'aaaabbbbcccc'
+    assert TrackWriter(track_filepath).completed() == 3
+
+
+def test_max_pending(track_filepath):
+    from lib.media.trackwriter import TrackWriter
+
+    writer = TrackWriter(track_filepath, max_pending=2)
+    writer.write(1, b'1')
+
+    # stream 2 is too far ahead, and has to wait for stream 0.
+    thread = Thread(target=writer.write, args=(2, b'2'))
+    thread.start()
+    thread.join(timeout=0.2)
+    assert thread.is_alive()
+
+    writer.write(0, b'0')
+    thread.join()
+    assert writer.completed() == 3
+
+    abort_ev = Event()
+    abort_ev.set()
+    assert writer.write(10, b'10', abort_ev) is False
+    writer.close()
+
+
+def test_piped_track_writer(tmp_path):
+    import os
+    from lib.media.trackwriter import PipedTrackWriter
+
+    fifo_path = str(tmp_path / 'track-0.fifo')
+    os.mkfifo(fifo_path)
+
+    received = list()
+
+    def reader():
+        with open(fifo_path, 'rb') as fh:
+            received.append(fh.read())
+
+    thread = Thread(target=reader)
+    thread.start()
+
+    writer = PipedTrackWriter(fifo_path, max_pending=2)
+    for index in [1, 0, 3, 2]:
+        writer.write(index, bytes([index]) * 4)
+    writer.close()
+    thread.join()
+
+    assert writer.error is None
+    assert received == [b'\x00' * 4 + b'\x01' * 4 + b'\x02' * 4 + b'\x03' * 4]
+
+
+def test_piped_track_writer_reader_exited(tmp_path):
+    import os
+    from lib.media.trackwriter import PipedTrackWriter
+
+    fifo_path = str(tmp_path / 'track-0.fifo')
+    os.mkfifo(fifo_path)
+
+    writer = PipedTrackWriter(fifo_path, max_pending=2, reader_alive=lambda: False)
+    for index in range(5):
+        writer.write(index, b'x')
+    writer.close()
+    assert isinstance(writer.error, BrokenPipeError)
+
+
+def test_piped_track_writer_reader_stalled(tmp_path):
+    import os
+    from lib.media.trackwriter import PipedTrackWriter
+
+    fifo_path = str(tmp_path / 'track-0.fifo')
+    os.mkfifo(fifo_path)
+
+    # the reader opens the fifo, but never reads from it.
+    reader_fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+    writer = PipedTrackWriter(fifo_path, max_pending=2)
+
+    abort_ev = Event()
+    results = list()
+
+    def write():
+        for index in range(20):
+            results.append(writer.write(index, b'x' * (1 << 16), abort_ev))
+
+    thread = Thread(target=write)
+    thread.start()
+    thread.join(timeout=1.0)
+    assert thread.is_alive()
+
+    # writers give up once aborted, and close() returns once the reader is gone.
+    abort_ev.set()
+    thread.join(timeout=5.0)
+    assert not thread.is_alive()
+    assert results[-1] is False
+
+    os.close(reader_fd)
+    closer = Thread(target=writer.close, kwargs={'abort': True})
+    closer.start()
+    closer.join(timeout=5.0)
+    assert not closer.is_alive()
+    assert isinstance(writer.error, BrokenPipeError)
@@ -0,0 +1,55 @@
+def test_scan_bytes():
+    from lib.media.tsscanner import TsScanner
+    from test.media.tsfixtures import ts_stream
+
+    info = TsScanner.scan_bytes(ts_stream(20))
+    assert info.is_valid()
+    assert info.packets == 63
+    assert info.pid_packets == {0x100: 42, 0x101: 21}
+    assert info.pcr_range == (10.0, 30.0)
+    assert info.pts_ranges == {0x100: (10.0, 30.0), 0x101: (10.5, 30.5)}
+    assert info.duration() == 20.0
+    assert info.pts_offsets == {0x100: 188, 0x101: 376}
+    assert info.start_spread() == 0.5
+
+
+def test_invalid_streams():
+    import pytest
+    from lib.media.tsscanner import InvalidStreamError, TsScanner
+    from test.media.tsfixtures import ts_stream
+
+    info = TsScanner.scan_bytes(b'<html><body>Access Denied</body></html>' * 20)
+    assert not info.is_valid()
+    assert info.sync_errors == info.packets == 4
+    assert info.duration() is None
+
+    with pytest.raises(InvalidStreamError):
+        TsScanner.validate(ts_stream(2)[:-10], 'truncated.ts')
+    with pytest.raises(InvalidStreamError):
+        TsScanner.validate(b'', 'empty.ts')
+    assert TsScanner.validate(ts_stream(2), 'stream.ts').packets == 9
+
+
+def test_scan_file(tmp_path):
+    from lib.media.tsscanner import TsScanner
+    from test.media.tsfixtures import ts_stream
+
+    filepath = str(tmp_path / 'track.ts')
+    with open(filepath, 'wb') as fh:
+        fh.write(ts_stream(100))
+
+    # scan a few packets at a time, the chunks should add up to the whole file.
+    TsScanner.chunk_packets = 7
+    try:
+        info = TsScanner.scan_file(filepath)
+    finally:
+        TsScanner.chunk_packets = 1 << 16
+    assert info.is_valid()
+    assert info.packets == 303
+    assert info.pcr_range == (10.0, 110.0)
+    assert info.duration() == 100.0
+    assert info.pts_offsets == {0x100: 188, 0x101: 376}
+
+    head = TsScanner.scan_head(filepath, 1000)
+    assert head.is_valid()
+    assert head.packets == 5
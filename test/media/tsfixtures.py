@@ -0,0 +1,35 @@
+"""
+Builds minimal MPEG-TS packets / streams (PCR, PES headers with a PTS) for the TsScanner and Encoder tests.
+"""
+
+
+def pes_packet(pid, stream_id, pts):
+    # packet starting a PES, with a PTS, payload only.
+    pts_bytes = bytes([
+        0x21 | ((pts >> 29) & 0x0e),
+        (pts >> 22) & 0xff, 0x01 | ((pts >> 14) & 0xfe),
+        (pts >> 7) & 0xff, 0x01 | ((pts << 1) & 0xfe),
+    ])
+    header = bytes([0x47, 0x40 | (pid >> 8), pid & 0xff, 0x10])
+    pes = bytes([0, 0, 1, stream_id, 0, 0, 0x80, 0x80, 5]) + pts_bytes
+    return header + pes + b'\xff' * (188 - len(header) - len(pes))
+
+
+def pcr_packet(pid, pcr_base):
+    # packet with an adaptation field carrying a PCR, no payload.
+    header = bytes([0x47, pid >> 8, pid & 0xff, 0x20, 183, 0x10])
+    pcr = bytes([
+        (pcr_base >> 25) & 0xff, (pcr_base >> 17) & 0xff, (pcr_base >> 9) & 0xff,
+        (pcr_base >> 1) & 0xff, ((pcr_base & 1) << 7) | 0x7e, 0,
+    ])
+    return header + pcr + b'\xff' * (188 - len(header) - len(pcr))
+
+
+def ts_stream(seconds):
+    # a video (0x100, carrying the PCR) and an audio (0x101) stream, a frame each second, starting at 10s.
+    packets = list()
+    for second in range(seconds + 1):
+        packets.append(pcr_packet(0x100, 90000 * (second + 10)))
+        packets.append(pes_packet(0x100, 0xe0, 90000 * (second + 10)))
+        packets.append(pes_packet(0x101, 0xc0, 90000 * (second + 10) + 45000))
+    return b''.join(packets)
@@ -0,0 +1,208 @@
+import json
+from threading import Event, Lock, Thread
+
+import pytest
+
+
+def test_fair_limiter_limit():
+    from lib.downloadqueue import FairLimiter
+
+    limiter = FairLimiter(2)
+    limiter.acquire('a')
+    limiter.acquire('a')
+
+    thread = Thread(target=limiter.acquire, args=('b',))
+    thread.start()
+    thread.join(timeout=0.2)
+    assert thread.is_alive()
+
+    limiter.release('a')
+    thread.join(timeout=1)
+    assert not thread.is_alive()
+    assert limiter.in_flight == {'a': 1, 'b': 1}
+
+
+def test_fair_limiter_fairness():
+    from lib.downloadqueue import FairLimiter
+
+    limiter = FairLimiter(2)
+    limiter.acquire('a')
+    limiter.acquire('a')
+
+    granted = list()
+    lock = Lock()
+
+    def acquire(owner):
+        limiter.acquire(owner)
+        with lock:
+            granted.append(owner)
+
+    # 'a' queues up first, but 'b' has nothing in flight and gets the slot.
+    threads = [Thread(target=acquire, args=('a',)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    threads[0].join(timeout=0.1)
+    thread_b = Thread(target=acquire, args=('b',))
+    thread_b.start()
+    thread_b.join(timeout=0.1)
+
+    limiter.release('a')
+    thread_b.join(timeout=1)
+    assert granted == ['b']
+
+    limiter.release('a')
+    limiter.release('b')
+    for thread in threads:
+        thread.join(timeout=1)
+    assert granted == ['b', 'a', 'a']
+
+
+def job(rf_id, priority=0, finished_func=None):
+    from lib.downloadqueue import DownloadJob
+
+    return DownloadJob(rf_id, {'ttid': rf_id}, '/tmp/{}.mkv'.format(rf_id), priority=priority,
+                       finished_func=finished_func)
+
+
+def test_queue_priority():
+    from lib.downloadqueue import DownloadQueue, JobStatus
+
+    started = list()
+    first_started = Event()
+    blocker = Event()
+
+    def process(download_job):
+        started.append(download_job.rf_id)
+        first_started.set()
+        return blocker.wait(timeout=5)
+
+    queue = DownloadQueue(process, max_downloads=1)
+    first = queue.add(job(1))
+    assert first_started.wait(timeout=5)
+    queue.add(job(2, priority=0))
+    queue.add(job(3, priority=5))
+    queue.add(job(4, priority=1))
+    queue.set_priority(2, 10)
+
+    blocker.set()
+    assert queue.wait(timeout=5)
+    assert started == [1, 2, 3, 4]
+    assert first.status == JobStatus.DONE
+
+
+def test_queue_concurrency():
+    from lib.downloadqueue import DownloadQueue
+
+    running = list()
+    max_running = list()
+    lock = Lock()
+    blocker = Event()
+
+    def process(download_job):
+        with lock:
+            running.append(download_job.rf_id)
+            max_running.append(len(running))
+        blocker.wait(timeout=0.1)
+        with lock:
+            running.remove(download_job.rf_id)
+        return True
+
+    queue = DownloadQueue(process, max_downloads=2)
+    for rf_id in range(6):
+        queue.add(job(rf_id))
+    assert queue.wait(timeout=5)
+    assert max(max_running) == 2
+
+
+def test_queue_cancel_and_failure():
+    from lib.downloadqueue import DownloadQueue, JobStatus
+
+    blocker = Event()
+    finished = list()
+
+    def process(download_job):
+        blocker.wait(timeout=5)
+        if download_job.rf_id == 1:
+            raise RuntimeError('failed')
+        return True
+
+    queue = DownloadQueue(process, max_downloads=1)
+    failed = queue.add(job(1, finished_func=finished.append))
+    cancelled = queue.add(job(2, finished_func=finished.append))
+
+    # a job already queued is not added again.
+    assert queue.add(job(2)) is cancelled
+    assert queue.cancel(2) is True
+    assert queue.cancel(2) is False
+
+    blocker.set()
+    assert queue.wait(timeout=5)
+    assert failed.status == JobStatus.FAILED
+    assert cancelled.status == JobStatus.CANCELLED
+    assert finished == [failed]
+
+
+def test_queue_persistence(tmp_path):
+    from lib.downloadqueue import DownloadQueue
+
+    state_filepath = str(tmp_path / 'download_queue.json')
+    blocker = Event()
+
+    queue = DownloadQueue(lambda x: blocker.wait(timeout=5), max_downloads=1, state_filepath=state_filepath)
+    queue.add(job(1))
+    queue.add(job(2, priority=3))
+    with open(state_filepath, 'r') as fh:
+        assert {x['rf_id'] for x in json.load(fh)} == {1, 2}
+
+    blocker.set()
+    assert queue.wait(timeout=5)
+    with open(state_filepath, 'r') as fh:
+        assert json.load(fh) == []
+
+
+@pytest.mark.parametrize('saved', [[], [{'rf_id': 7, 'video_metadata': {}, 'filepath': 'x.mkv', 'priority': 2}]])
+def test_load_saved_jobs(tmp_path, saved):
+    from lib.downloadqueue import DownloadQueue
+
+    state_filepath = str(tmp_path / 'download_queue.json')
+    with open(state_filepath, 'w') as fh:
+        json.dump(saved, fh)
+
+    jobs = DownloadQueue(lambda x: True, state_filepath=state_filepath).load_saved_jobs()
+    assert [(x.rf_id, x.priority, x.quality) for x in jobs] == [(x['rf_id'], 2, 'highest') for x in saved]
+
+
+def test_queue_encode_handoff():
+    from concurrent.futures import ThreadPoolExecutor
+    from lib.downloadqueue import DownloadQueue, JobStatus
+
+    encode_blocker = Event()
+    downloaded = list()
+    finished = list()
+    encode_pool = ThreadPoolExecutor(max_workers=1)
+
+    def encode(download_job):
+        encode_blocker.wait(timeout=5)
+        if download_job.rf_id == 2:
+            raise RuntimeError('encode failed')
+        return True
+
+    def process(download_job):
+        # downloads are done on the worker, encodes are handed off.
+        downloaded.append(download_job.rf_id)
+        return encode_pool.submit(encode, download_job)
+
+    queue = DownloadQueue(process, max_downloads=1)
+    jobs = [queue.add(job(rf_id, finished_func=finished.append)) for rf_id in range(4)]
+
+    # the single worker downloads all the videos, while the first encode is still running.
+    assert not queue.wait(timeout=0.5)
+    assert downloaded == [0, 1, 2, 3]
+    assert all(x.status == JobStatus.ENCODING for x in jobs)
+    assert queue.pending() == 4
+
+    encode_blocker.set()
+    assert queue.wait(timeout=5)
+    assert [x.status for x in jobs] == [JobStatus.DONE, JobStatus.DONE, JobStatus.FAILED, JobStatus.DONE]
+    assert sorted(x.rf_id for x in finished) == [0, 1, 2, 3]
+    encode_pool.shutdown()
@@ -0,0 +1,88 @@
+import pytest
+
+
+def test_spans():
+    from lib.instrumentation import Instrumentation
+
+    Instrumentation.clear()
+    for _ in range(3):
+        with Instrumentation.span(1, 'fetch') as span:
+            span.add_bytes(1 << 20)
+    with Instrumentation.span(2, 'fetch') as span:
+        span.add_bytes(100)
+        span.add_retries(2)
+    Instrumentation.add_retries(1, 'fetch')
+    with pytest.raises(ValueError):
+        with Instrumentation.span(1, 'decrypt'):
+            raise ValueError('bad padding')
+    with Instrumentation.span(None, 'encode'):
+        pass
+
+    stages = Instrumentation.lectures[1]
+    assert (stages['fetch'].count, stages['fetch'].bytes, stages['fetch'].retries) == (3, 3 << 20, 1)
+    assert (stages['decrypt'].count, stages['decrypt'].errors) == (1, 1)
+    totals = Instrumentation.totals
+    assert (totals['fetch'].count, totals['fetch'].bytes, totals['fetch'].retries) == (4, (3 << 20) + 100, 3)
+    assert totals['encode'].count == 1
+
+    summary = Instrumentation.summary(1)
+    assert summary.startswith('fetch: 3 in ')
+    assert '3.0 MB' in summary and '1 retries' in summary and 'decrypt: 1 in ' in summary and '1 errors' in summary
+    # forgotten once summarized, the totals are kept.
+    assert Instrumentation.summary(1) == ''
+    assert totals['fetch'].count == 4
+
+
+def test_write_metrics(tmp_path):
+    from lib.instrumentation import Instrumentation
+
+    Instrumentation.clear()
+    Instrumentation.record(1, 'fetch', 2.5, num_bytes=1000, retries=1)
+    Instrumentation.record(1, 'encode', 10.0)
+
+    filepath = str(tmp_path / 'metrics.prom')
+    Instrumentation.write_metrics(filepath)
+    with open(filepath) as fh:
+        lines = fh.read().splitlines()
+    assert '# TYPE impartus_stage_seconds_total counter' in lines
+    assert 'impartus_stage_seconds_total{stage="fetch"} 2.5' in lines
+    assert 'impartus_stage_bytes_total{stage="fetch"} 1000' in lines
+    assert 'impartus_stage_retries_total{stage="fetch"} 1' in lines
+    assert 'impartus_stage_spans_total{stage="encode"} 1' in lines
+    assert 'impartus_stage_errors_total{stage="encode"} 0' in lines
+    Instrumentation.clear()
+
+
+def test_trace(tmp_path):
+    import json
+    from threading import Thread
+    from lib.instrumentation import Instrumentation
+
+    Instrumentation.clear()
+    with Instrumentation.span(1, 'fetch'):
+        pass
+    assert not Instrumentation.is_tracing()
+
+    Instrumentation.start_trace()
+    with Instrumentation.span(1, 'fetch', 'http://example.com/1.ts') as span:
+        span.add_bytes(10)
+    thread = Thread(target=lambda: Instrumentation.record(2, 'key', 0.1), name='worker')
+    thread.start()
+    thread.join()
+    with Instrumentation.span(2, 'decrypt'):
+        pass
+
+    filepath = str(tmp_path / 'trace.json')
+    Instrumentation.write_trace(filepath)
+    with open(filepath) as fh:
+        trace = json.load(fh)
+    Instrumentation.clear()
+
+    events = [x for x in trace['traceEvents'] if x['ph'] == 'X']
+    # record() without a span is counted, but has no timeline.
+    assert [(x['name'], x['pid']) for x in events] == [('fetch', 1), ('decrypt', 2)]
+    assert events[0]['args'] == {'bytes': 10, 'retries': 0, 'detail': 'http://example.com/1.ts'}
+    assert events[1]['ts'] >= events[0]['ts'] + events[0]['dur']
+
+    processes = {x['pid']: x['args']['name'] for x in trace['traceEvents'] if x['name'] == 'process_name'}
+    assert processes == {1: 'lecture 1', 2: 'lecture 2'}
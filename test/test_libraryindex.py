@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def video_file(tmp_path):
+    filepath = str(tmp_path / 'lecture.mkv')
+    with open(filepath, 'wb') as fh:
+        fh.write(b'mkv contents')
+    return filepath
+
+
+@pytest.fixture
+def db_filepath(tmp_path):
+    return str(tmp_path / 'config' / 'library_index.db')
+
+
+def test_get_put(db_filepath, video_file):
+    from lib.libraryindex import LibraryIndex
+
+    metadata = {'ttid': 1234, 'topic': 'intro'}
+    with LibraryIndex(db_filepath) as index:
+        assert index.get(video_file, os.stat(video_file)) is None
+        index.put(video_file, os.stat(video_file), 1234, False, metadata, 0, '/tmp/lecture.vtt')
+
+    with LibraryIndex(db_filepath) as index:
+        assert index.get(video_file, os.stat(video_file)) == {
+            'rf_id': 1234,
+            'flipped': False,
+            'metadata': metadata,
+            'metadata_mtime_ns': 0,
+            'chats_path': '/tmp/lecture.vtt',
+        }
+
+
+def test_changed_file(db_filepath, video_file):
+    from lib.libraryindex import LibraryIndex
+
+    with LibraryIndex(db_filepath) as index:
+        index.put(video_file, os.stat(video_file), 1234, False)
+
+    with open(video_file, 'ab') as fh:
+        fh.write(b'more contents')
+
+    with LibraryIndex(db_filepath) as index:
+        assert index.get(video_file, os.stat(video_file)) is None
+
+
+def test_prune(db_filepath, tmp_path, video_file):
+    from lib.libraryindex import LibraryIndex
+
+    deleted_file = str(tmp_path / 'deleted.mkv')
+    with LibraryIndex(db_filepath) as index:
+        index.put(video_file, os.stat(video_file), 1, False)
+        index.put(deleted_file, os.stat(video_file), 2, True)
+        assert len(index) == 2
+
+    with LibraryIndex(db_filepath) as index:
+        assert index.get(video_file, os.stat(video_file))
+        index.prune()
+        assert len(index) == 1
+
+
+def test_video_path_changed(db_filepath, video_file):
+    from lib.libraryindex import LibraryIndex
+
+    with LibraryIndex(db_filepath, '{target_dir}/{topic}.mkv') as index:
+        index.put(video_file, os.stat(video_file), 1, False, {'topic': 'parsed'}, 0)
+        index.put(video_file + '.2', os.stat(video_file), 2, False, {'topic': 'from json'}, 123)
+
+    # metadata parsed from the file path is dropped, the rf_id is kept.
+    with LibraryIndex(db_filepath, '{target_dir}/{seqNo}.mkv') as index:
+        entry = index.get(video_file, os.stat(video_file))
+        assert entry['rf_id'] == 1 and entry['metadata'] is None
+        assert index.get(video_file + '.2', os.stat(video_file))['metadata'] == {'topic': 'from json'}
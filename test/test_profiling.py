@@ -0,0 +1,81 @@
+def _busy_thread_work():
+    return sum(x * x for x in range(200000))
+
+
+def test_profiler(tmp_path):
+    import pstats
+    from threading import Thread
+    from lib.profiling import Profiler
+
+    with Profiler('test', str(tmp_path), profile=True, trace_memory=True) as profiler:
+        thread = Thread(target=_busy_thread_work)
+        thread.start()
+        thread.join()
+        buffers = [bytearray(1 << 20) for _ in range(4)]    # noqa
+
+    suffixes = sorted(x.split('.', 1)[1] for x in profiler.files)
+    assert suffixes == ['memory.txt', 'profile.txt', 'pstats', 'tracemalloc']
+
+    # functions run in the threads started while profiling are included.
+    pstats_filepath = next(x for x in profiler.files if x.endswith('.pstats'))
+    functions = {function for _, _, function in pstats.Stats(pstats_filepath).stats.keys()}
+    assert '_busy_thread_work' in functions
+
+    memory_filepath = next(x for x in profiler.files if x.endswith('.memory.txt'))
+    with open(memory_filepath) as fh:
+        report = fh.read()
+    assert report.startswith('traced memory: current ')
+    assert 'test_profiling.py' in report
+
+
+def test_profiler_thread_hooks(tmp_path):
+    import sys
+    import threading
+    from queue import Queue
+    from lib.profiling import Profiler
+
+    def previous_hook(*args):
+        pass
+
+    tasks, results = Queue(), Queue()
+
+    def worker():
+        # a long lived thread, started while profiling and still running after.
+        while True:
+            func = tasks.get()
+            if func is None:
+                break
+            results.put(func())
+
+    threading.setprofile(previous_hook)
+    try:
+        with Profiler('test', str(tmp_path), profile=True) as profiler:
+            thread = threading.Thread(target=worker)
+            thread.start()
+            tasks.put(_busy_thread_work)
+            results.get()
+        assert threading.getprofile() is previous_hook
+    finally:
+        threading.setprofile(None)
+
+    # the thread profiler switches itself off, on the first event in its thread.
+    tasks.put(lambda: sum(range(10)))
+    results.get()
+    tasks.put(sys.getprofile)
+    assert results.get() is None
+    tasks.put(None)
+    thread.join()
+    assert len(profiler.thread_profilers) == 1
+
+
+def test_profiler_wrap(tmp_path):
+    import os
+    from lib.profiling import Profiler
+
+    def load(value):
+        return value * 2
+
+    wrapped = Profiler.wrap(load, 'load', str(tmp_path), profile=True)
+    assert wrapped(21) == 42
+    assert wrapped.__name__ == 'load'
+    assert sorted(x.split('.', 1)[1] for x in os.listdir(str(tmp_path))) == ['profile.txt', 'pstats']
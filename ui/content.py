@@ -6,6 +6,7 @@ from PySide2.QtUiTools import QUiLoader
 from PySide2.QtWidgets import QMainWindow, QTableWidget, QPlainTextEdit, QTreeWidget, QTabWidget, QWidget, QToolButton
 
 from lib.finder import Finder
+from lib.core.catalog import Catalog
 from lib.core.impartus import Impartus
 from lib.variables import Variables
 from ui.callbacks.buttoncallbacks import ButtonCallbacks
@@ -108,19 +109,21 @@ class ContentWindow(QMainWindow):
     def work_offline(self):
         self.splashscreen.show(widgets_to_disable=[self.table_widget, self.tree_widget])
         self.reset_content()
-        count = 0
-        for rf_id, video_metadata, is_flipped, chats_path in Finder().get_offline_videos():
-            self.videos_tab.table.add_row_item(rf_id, video_metadata, captions_path=chats_path, is_flipped=is_flipped,
-                                               video_downloaded=True)
-            count += 1
-            self.splashscreen.setText("Found {} offline videos.".format(count))
-
-        # when scanning offline documents, we get 1 document at a time, and identify it's subject (metadata)
-        count = 0
-        for subject, document in Finder().get_offline_backpack_slides():
-            self.documents_tab.tree.add_row_items(subject, [document])
-            count += 1
-            self.splashscreen.setText("Found {} offline documents.".format(count))
+        # videos and documents are found in a single scan, and added as they are found.
+        num_videos = num_documents = 0
+        for kind, item in Finder().get_offline_content():
+            if kind == Finder.VIDEO:
+                rf_id, video_metadata, is_flipped, chats_path = item
+                self.videos_tab.table.add_row_item(rf_id, video_metadata, captions_path=chats_path,
+                                                   is_flipped=is_flipped, video_downloaded=True)
+                num_videos += 1
+            else:
+                # when scanning offline documents, we get 1 document at a time, and identify it's subject (metadata)
+                subject, document = item
+                self.documents_tab.tree.add_row_items(subject, [document])
+                num_documents += 1
+            self.splashscreen.setText("Found {} offline videos, {} offline documents.".format(
+                num_videos, num_documents))
 
         self.videos_tab.table.post_fill_tasks()
         self.documents_tab.tree.post_fill_tasks()
@@ -139,32 +142,45 @@ class ContentWindow(QMainWindow):
         subjects = self.impartus.get_subjects()
         mapping_by_id, mapping_by_name = DataUtils.get_subject_mappings(subjects)
 
-        # videos tab
+        # lectures and documents of all the subjects are fetched concurrently, documents are added to the tree
+        # once the videos are reconciled with the offline data.
         count = 0
-        for video_id, video_metadata, is_flipped in self.impartus.get_lecture_videos(subjects):
-            # for online videos, we won't know if lecture chats exist or not, until the api is called,
-            # so consider caption_path=False (not downloaded) and enable the chat download button.
-            self.videos_tab.table.add_row_item(video_id, video_metadata, is_flipped=is_flipped, captions_path=False)
-            count += 1
-            self.splashscreen.setText("Found {} online videos...".format(count))
+        online_documents = list()
+        for kind, item in self.impartus.get_catalog(subjects):
+            if kind == Catalog.VIDEOS:
+                video_id, video_metadata, is_flipped = item
+                # for online videos, we won't know if lecture chats exist or not, until the api is called,
+                # so consider caption_path=False (not downloaded) and enable the chat download button.
+                self.videos_tab.table.add_row_item(video_id, video_metadata, is_flipped=is_flipped,
+                                                   captions_path=False)
+                count += 1
+                self.splashscreen.setText("Found {} online videos...".format(count))
+            else:
+                online_documents.append(item)
 
         self.splashscreen.setText("Reconciling with offline data.")
-        for (video_id, video_metadata, is_flipped, chats_path) in Finder().get_offline_videos():
-            self.videos_tab.table.add_row_item(video_id, video_metadata, captions_path=chats_path,
-                                               is_flipped=is_flipped, video_downloaded=True)
+        offline_documents = list()
+        for kind, item in Finder().get_offline_content(mapping_by_name):
+            if kind == Finder.VIDEO:
+                video_id, video_metadata, is_flipped, chats_path = item
+                self.videos_tab.table.add_row_item(video_id, video_metadata, captions_path=chats_path,
+                                                   is_flipped=is_flipped, video_downloaded=True)
+            else:
+                # added after the online documents.
+                offline_documents.append(item)
 
         self.videos_tab.table.post_fill_tasks()
         self.documents_tab.tree.post_fill_tasks()
 
         # when fetching online documents, the api returns all the available documents (metadata) for a given subject.
         count = 0
-        for subject_metadata, documents in self.impartus.get_slides(subjects):
+        for subject_metadata, documents in online_documents:
             self.documents_tab.tree.add_row_items(subject_metadata, documents)
             count += len(documents)
             self.splashscreen.setText("Found {} online documents.".format(count))
 
         # when scanning offline documents, we get 1 document at a time, and identify it's subject (metadata).
-        for subject_metadata, document in Finder().get_offline_backpack_slides(mapping_by_name):
+        for subject_metadata, document in offline_documents:
             self.documents_tab.tree.add_row_items(subject_metadata, [document])
 
         MenuCallbacks().set_menu_statuses()
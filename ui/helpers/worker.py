@@ -18,3 +18,11 @@ class Worker(QtCore.QThread):
     def run(self):
         if self.task:
             self.status = self.task()
+
+
+class JobSignals(QtCore.QObject):
+    """
+    Signals for the jobs run by a DownloadQueue, these are emitted from the queue threads and delivered on the
+    ui thread.
+    """
+    finished = QtCore.Signal(object)
@@ -48,9 +48,8 @@ class Documents:
         """
         Download a slide doc in a thread. Update the UI upon completion.
         """
-        # create a new Impartus session reusing existing token.
-        imp = Impartus(self.impartus.token)
-        return imp.download_slides(file_url, filepath)
+        # documents are downloaded over the session's connection pool, shared by all the download threads.
+        return self.impartus.download_slides(file_url, filepath)
 
     def on_click_download_document(self, subject, metadata, pushbutton_widget):  # noqa
         """
@@ -2,20 +2,19 @@ import os
 from datetime import datetime
 from functools import partial
 from typing import Tuple
-from threading import Event
 
-from PySide2.QtCore import QThread
 from PySide2.QtWidgets import QTableWidget
 
 from lib.captions import Captions
 from lib.core.impartus import Impartus
+from lib.downloadqueue import DownloadJob, JobStatus
 from lib.threadlogging import ThreadLogger
 from lib.utils import Utils
 from lib.data.Icons import Icons
 from lib.variables import Variables
 from ui.uiitems.progressbar import SortableRoundProgressbar
 from ui.uiitems.customwidgets.pushbutton import CustomPushButton
-from ui.helpers.worker import Worker
+from ui.helpers.worker import JobSignals
 from ui.uiitems.table import Table
 
 
@@ -43,6 +42,9 @@ class Videos:
         }
         self.table = Table(table, self.impartus, callbacks)
         self.workers = dict()
+        self.download_queue = None
+        self.job_signals = JobSignals()
+        self.job_signals.finished.connect(self.job_finished)    # noqa
         self.logger = ThreadLogger(self.__class__.__name__).logger
 
     def reset_content(self):
@@ -69,23 +71,15 @@ class Videos:
             download_button.setIcon(Icons.VIDEO__VIDEO_PROCESSING.value, animate=True)
             download_button.setToolTip('Processing Video...')
 
-    def _download_video(self, video_metadata, video_filepath, progressbar_widget: SortableRoundProgressbar,
-                        pushbuttons: Tuple, pause_ev, resume_ev):
-
-        dl_button = pushbuttons[0]
-        return self.impartus.process_video(
-            video_metadata,
-            video_filepath,
-            pause_ev,
-            resume_ev,
-            partial(Videos.progress_callback, dl_button, progressbar_widget),
-            video_quality=Variables().flipped_lecture_quality()
-        )
+    def get_download_queue(self):
+        if not self.download_queue:
+            self.download_queue = self.impartus.get_download_queue()
+        return self.download_queue
 
     def on_click_download_video(self, video_id):
         """
         callback function for Download button.
-        Creates a thread to download the request video.
+        Queues the requested video for download.
         """
         video_metadata = self.table.video_ids[video_id]['metadata']
         video_filepath = Utils.get_mkv_path(video_metadata)
@@ -95,42 +89,38 @@ class Videos:
         # pass the earlier saved fields to pause_resume_button_callback.
         if self.workers.get(video_id):
             pushbuttons = self.workers.get(video_id)['pushbuttons']
-            pause_ev = self.workers.get(video_id)['pause_event']
-            resume_ev = self.workers.get(video_id)['resume_event']
-            self.pause_resume_button_click(pushbuttons, pause_ev, resume_ev)
+            job = self.workers.get(video_id)['job']
+            self.pause_resume_button_click(pushbuttons, job.pause_ev, job.resume_ev)
             return
 
         # A fresh download reaches here..
         progressbar, pushbuttons = self.table.get_widgets(video_id)
         dl_button, pl_button, cc_button, of_button, = pushbuttons
 
-        pause_event = Event()
-        resume_event = Event()
-
-        thread = Worker()
-        thread.set_task(partial(self._download_video, video_metadata, video_filepath, progressbar, pushbuttons,
-                                pause_event, resume_event))
-        thread.finished.connect(partial(self.thread_finished, pushbuttons, video_id))
+        job = DownloadJob(
+            video_id, video_metadata, video_filepath,
+            quality=Variables().flipped_lecture_quality(),
+            progress_func=partial(Videos.progress_callback, dl_button, progressbar),
+            finished_func=self.job_signals.finished.emit,
+        )
 
-        # we don't want to enable user to start another thread while this one is going on.
+        # we don't want to enable user to start another download while this one is going on.
         dl_button.setIcon(Icons.VIDEO__PAUSE_DOWNLOAD.value)
         dl_button.setToolTip('Pause Download')
 
         self.workers[video_id] = {
-            'pause_event': pause_event,
-            'resume_event': resume_event,
             'pushbuttons': pushbuttons,
-            'thread':   thread,
+            'job': job,
         }
-        thread.start(priority=QThread.Priority.IdlePriority)
+        self.get_download_queue().add(job)
         self.table.video_ids[video_id]['metadata']['offline_filepath'] = video_filepath
 
-    def thread_finished(self, pushbuttons, video_id):     # noqa
-
+    def job_finished(self, job: DownloadJob):
+        video_id = job.rf_id
         if self.workers.get(video_id):
             # successful run.
-            dl_button, pl_button, cc_button, of_button, = pushbuttons
-            if self.workers[video_id]['thread'].status:
+            dl_button, pl_button, cc_button, of_button, = self.workers[video_id]['pushbuttons']
+            if job.status == JobStatus.DONE:
                 dl_button.setIcon(Icons.VIDEO__DOWNLOAD_VIDEO.value)
                 dl_button.setToolTip('Download Video')
                 dl_button.setEnabled(False)